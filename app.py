@@ -7,11 +7,12 @@ from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Q
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 
-from src.llm.llm import llm_call_analyse_sent, llm_call_analyse_word
+from src.llm.llm import allm_call_analyse_sent, allm_call_analyse_word, llm_call_analyse_sent, llm_call_analyse_word
 from src.models.invalid_model import InvalidModel
-from src.transcribe.deepgram_transcriber import deepgram_transcribe
-from src.utils.json_parser import llm_json_parser
-from src.utils.transcript_format import format_deepgram_transcript_sent, format_deepgram_transcript_word
+from src.transcribe.long_form import transcribe_audio
+from src.utils.audio_extract import extract_audio
+from src.utils.json_parser import llm_invalids_parser, llm_json_parser
+from src.utils.transcript_format import TranscriptLookup, iter_compact_transcript_sent, iter_compact_transcript_word
 from src.utils.video_trimmer import trim_video as video_trimmer
 from dotenv import load_dotenv
 import json
@@ -102,8 +103,9 @@ async def transcribe_video(job_id: str, background_tasks: BackgroundTasks):
             # Update status
             processing_tasks[job_id]["status"] = "transcribing"
             
-            # Transcribe the video
-            transcript = deepgram_transcribe(video_path)
+            # Transcribe the extracted audio track
+            audio_path = extract_audio(video_path, job_dir)
+            transcript = transcribe_audio(audio_path, cache_dir=job_dir)
             
             # Save transcript
             with open(transcript_path, "w") as f:
@@ -143,7 +145,7 @@ async def analyze_transcript(job_id: str, background_tasks: BackgroundTasks):
     sent_analysis_path = os.path.join(job_dir, "sent_analysis.json")
     word_analysis_path = os.path.join(job_dir, "word_analysis.json")
     
-    def process_analysis():
+    async def process_analysis():
         try:
             # Update status
             processing_tasks[job_id]["status"] = "analyzing"
@@ -156,9 +158,9 @@ async def analyze_transcript(job_id: str, background_tasks: BackgroundTasks):
             transcript_json = llm_json_parser(transcript)
             
             # Sentence analysis
-            formatted_sent = format_deepgram_transcript_sent(transcript_json)
-            sent_response = llm_call_analyse_sent(formatted_sent)
-            sent_response_json = llm_json_parser(sent_response)
+            formatted_sent = iter_compact_transcript_sent(transcript_json)
+            sent_response = await allm_call_analyse_sent(formatted_sent)
+            sent_response_json = llm_invalids_parser(sent_response, TranscriptLookup(transcript_json).resolve)
             
             # Save sentence analysis
             with open(sent_analysis_path, "w") as f:
@@ -169,9 +171,15 @@ async def analyze_transcript(job_id: str, background_tasks: BackgroundTasks):
             invalids.sort(key=lambda x: x.start_time)
             
             # Word analysis
-            word_inv = format_deepgram_transcript_word(transcript_json, invalids)
-            word_response = llm_call_analyse_word(word_inv)
-            word_response_json = llm_json_parser(word_response)
+            # only the partially repeated sentences need the word analysis
+            partial = [item for item in invalids if not item.is_entire]
+            if partial:
+                word_inv = iter_compact_transcript_word(transcript_json, partial)
+                word_response = await allm_call_analyse_word(word_inv)
+                word_response_json = llm_invalids_parser(word_response, TranscriptLookup(transcript_json).resolve)
+            else:
+                # no words to look at, an empty prompt would only let the model invent invalids
+                word_response_json = {"data": []}
             
             # Save word analysis
             with open(word_analysis_path, "w") as f:
@@ -195,7 +203,7 @@ async def analyze_transcript(job_id: str, background_tasks: BackgroundTasks):
             processing_tasks[job_id]["status"] = "failed"
             processing_tasks[job_id]["error"] = str(e)
     
-    # Run analysis in the background
+    # Run analysis in the background, awaited on the event loop
     background_tasks.add_task(process_analysis)
     
     return TranscriptionAnalysisResponse(
@@ -327,7 +335,8 @@ async def process_all(background_tasks: BackgroundTasks, file: UploadFile = File
         try:
             # Transcribe
             processing_tasks[job_id]["status"] = "transcribing"
-            transcript = deepgram_transcribe(file_path)
+            audio_path = extract_audio(file_path, job_dir)
+            transcript = transcribe_audio(audio_path, cache_dir=job_dir)
             transcript_path = os.path.join(job_dir, "transcript.json")
             with open(transcript_path, "w") as f:
                 f.write(transcript)
@@ -339,9 +348,9 @@ async def process_all(background_tasks: BackgroundTasks, file: UploadFile = File
             transcript_json = llm_json_parser(transcript)
             
             # Sentence analysis
-            formatted_sent = format_deepgram_transcript_sent(transcript_json)
+            formatted_sent = iter_compact_transcript_sent(transcript_json)
             sent_response = llm_call_analyse_sent(formatted_sent)
-            sent_response_json = llm_json_parser(sent_response)
+            sent_response_json = llm_invalids_parser(sent_response, TranscriptLookup(transcript_json).resolve)
             
             sent_analysis_path = os.path.join(job_dir, "sent_analysis.json")
             with open(sent_analysis_path, "w") as f:
@@ -352,9 +361,15 @@ async def process_all(background_tasks: BackgroundTasks, file: UploadFile = File
             invalids.sort(key=lambda x: x.start_time)
             
             # Word analysis
-            word_inv = format_deepgram_transcript_word(transcript_json, invalids)
-            word_response = llm_call_analyse_word(word_inv)
-            word_response_json = llm_json_parser(word_response)
+            # only the partially repeated sentences need the word analysis
+            partial = [item for item in invalids if not item.is_entire]
+            if partial:
+                word_inv = iter_compact_transcript_word(transcript_json, partial)
+                word_response = llm_call_analyse_word(word_inv)
+                word_response_json = llm_invalids_parser(word_response, TranscriptLookup(transcript_json).resolve)
+            else:
+                # no words to look at, an empty prompt would only let the model invent invalids
+                word_response_json = {"data": []}
             
             word_analysis_path = os.path.join(job_dir, "word_analysis.json")
             with open(word_analysis_path, "w") as f:
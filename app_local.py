@@ -1,10 +1,15 @@
 import os
+import asyncio
 import argparse
 
 from fastapi import BackgroundTasks, FastAPI
 from pydantic import BaseModel
+from typing import Optional
+from src.api.cache_stats import _fetch_cache_stats
+from src.api.cancel import _cancel_trim
 from src.api.transcript import _fetch_transcript
 from src.api.invalids import _fetch_invalid_segments, _override_invalid
+from src.api.llm_stats import _fetch_llm_latency
 from src.api.process_all import _process_all
 from src.api.status import _get_status
 from src.api.transcribe import _transcribe_video
@@ -44,7 +49,8 @@ class JobIdModel(BaseModel):
 @app.post("/upload")
 async def upload_file(data: FilePathModel):
     print("[DEBUG] Uploading file:", data.file_path)
-    return _upload_file(data.file_path)
+    # probing reads the file, keep it off the event loop
+    return await asyncio.to_thread(_upload_file, data.file_path)
 
 @app.post("/process_all", response_model=ResponseModel)
 async def process_all(data: JobIdModel, background_tasks: BackgroundTasks):
@@ -58,13 +64,25 @@ async def get_status(job_id: str):
 async def trim(data: JobIdModel, background_tasks: BackgroundTasks):
     return await _trim(data.job_id, background_tasks)
 
+@app.post("/cancel", response_model=ResponseModel)
+def cancel_trim(data: JobIdModel):
+    return _cancel_trim(data.job_id)
+
 @app.post("/transcribe", response_model=ResponseModel)
 async def transcribe_video(data: JobIdModel, background_tasks: BackgroundTasks):
     return await _transcribe_video(data.job_id, background_tasks)
 
 @app.get("/transcript/{job_id}", response_model=ResponseModel)
-def get_transcript(job_id: str):
-    return _fetch_transcript(job_id)
+def get_transcript(job_id: str, start: Optional[float] = None, end: Optional[float] = None):
+    return _fetch_transcript(job_id, start, end)
+
+@app.get("/cache/stats", response_model=ResponseModel)
+def get_cache_stats():
+    return _fetch_cache_stats()
+
+@app.get("/llm/latency", response_model=ResponseModel)
+def get_llm_latency():
+    return _fetch_llm_latency()
 
 @app.get("/invalids/{job_id}", response_model=ResponseModel)
 def get_invalids(job_id:str):
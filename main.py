@@ -1,10 +1,12 @@
 import os
 import argparse
+import tempfile
 from src.llm.llm import llm_call_analyse_sent, llm_call_analyse_word
 from src.models.invalid_model import InvalidModel
-from src.transcribe.deepgram_transcriber import deepgram_transcribe
-from src.utils.json_parser import llm_json_parser
-from src.utils.transcript_format import format_deepgram_transcript_sent, format_deepgram_transcript_word
+from src.transcribe.long_form import transcribe_audio
+from src.utils.audio_extract import extract_audio
+from src.utils.json_parser import llm_invalids_parser, llm_json_parser
+from src.utils.transcript_format import TranscriptLookup, iter_compact_transcript_sent, iter_compact_transcript_word
 from src.utils.video_trimmer import trim_video as video_trimmer
 from dotenv import load_dotenv
 
@@ -12,8 +14,10 @@ load_dotenv()
 
 def trim_video(video_path:str, output_path:str, verbose:bool=False):
     try:
-        # transcribe the video
-        transcript = deepgram_transcribe(video_path)
+        # transcribe the extracted audio track
+        with tempfile.TemporaryDirectory() as tmpdir:
+            audio_path = extract_audio(video_path, tmpdir)
+            transcript = transcribe_audio(audio_path)
         if verbose:
             print("Transcription completed.")
             print("Transcription result: ", transcript)
@@ -27,13 +31,13 @@ def trim_video(video_path:str, output_path:str, verbose:bool=False):
         if verbose:
             print("transcript: ", transcript)
         # sentence analysis
-        formatted_sent = format_deepgram_transcript_sent(transcript)
+        formatted_sent = "".join(iter_compact_transcript_sent(transcript))
         if verbose:
             print("Formatted transcript: ", formatted_sent)
         res = llm_call_analyse_sent(formatted_sent)
         if verbose:
             print("LLM response: ", res)
-        res = llm_json_parser(res)
+        res = llm_invalids_parser(res, TranscriptLookup(transcript).resolve)
         if verbose:
             print("sent: ",res)
 
@@ -44,9 +48,15 @@ def trim_video(video_path:str, output_path:str, verbose:bool=False):
             print(f"Invalid entries: {invalids}")
 
         # word analysis
-        word_inv = format_deepgram_transcript_word(transcript, invalids)
-        resp_word = llm_call_analyse_word(word_inv)
-        resp_word = llm_json_parser(resp_word)
+        # only the partially repeated sentences need the word analysis
+        partial = [item for item in invalids if not item.is_entire]
+        if partial:
+            word_inv = iter_compact_transcript_word(transcript, partial)
+            resp_word = llm_call_analyse_word(word_inv)
+            resp_word = llm_invalids_parser(resp_word, TranscriptLookup(transcript).resolve)
+        else:
+            # no words to look at, an empty prompt would only let the model invent invalids
+            resp_word = {"data": []}
         if verbose:
             print(resp_word)
 
@@ -0,0 +1,24 @@
+from src.llm.response_cache import cache_stats
+from src.models.response_model import ResponseModel
+
+
+def _fetch_cache_stats():
+    """
+    Fetch the hit/miss counters and size of the LLM response cache.
+    """
+    try:
+        return ResponseModel(
+            status="success",
+            message="Cache stats fetched successfully",
+            job_id="",
+            project_status=None,
+            data={"llm": cache_stats()}
+        )
+    except Exception as e:
+        return ResponseModel(
+            status="error",
+            message=f"Error fetching cache stats: {str(e)}",
+            job_id="",
+            project_status="failed",
+            data=None
+        )
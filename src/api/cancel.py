@@ -0,0 +1,35 @@
+
+from src.models.metadata_model import MetadataModel
+from src.models.project_status import ProjectStatus
+from src.models.response_model import ResponseModel
+from src.utils.ffmpeg_runner import cancel_job
+
+
+def _cancel_trim(job_id: str):
+    try:
+        meta = MetadataModel.load_metadata(job_id)
+        if not meta:
+            raise ValueError("Metadata not found for the given job_id.")
+
+        if meta.status != ProjectStatus.TRIM_START or not meta.is_processing:
+            raise ValueError("No trimming in progress for this job.")
+
+        # the trimming task resets the status and removes the partial output
+        if not cancel_job(job_id):
+            raise ValueError("No running ffmpeg process found for this job.")
+
+        return ResponseModel(
+            status="success",
+            message="Trimming cancelled successfully",
+            job_id=job_id,
+            project_status=meta.status.to_string(),
+            data=None
+        )
+    except Exception as e:
+        return ResponseModel(
+            status="error",
+            message=f"Error cancelling trimming: {str(e)}",
+            job_id=job_id,
+            project_status="failed",
+            data=None
+        )
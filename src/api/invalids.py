@@ -15,6 +15,20 @@ def _fetch_invalid_segments(job_id: str) -> str:
         if not meta:
             raise ValueError("Metadata not found for the given job_id.")
         
+        # While the analysis runs, show the sentence invalids streamed so far
+        if ProjectStatus.SENT_ANALYSIS_START <= meta.status < ProjectStatus.PROCESSED_INVALID_SEGMENT:
+            analysis_sent_path = os.path.join(TEMP_DIR, job_id, "analysis_sent.json")
+            if os.path.exists(analysis_sent_path):
+                with open(analysis_sent_path, "r") as f:
+                    invalids = json.load(f)
+                return ResponseModel(
+                    status="success",
+                    message="Partial invalid segments fetched, analysis in progress",
+                    job_id=job_id,
+                    project_status=meta.status.to_string(),
+                    data={"invalids": invalids['data'], "partial": True}
+                )
+
         # Check if the invalid segments are available
         if meta.status < ProjectStatus.PROCESSED_INVALID_SEGMENT:
             raise ValueError("Invalid segments are not available.")
@@ -0,0 +1,24 @@
+from src.llm.async_llm import latency_stats
+from src.models.response_model import ResponseModel
+
+
+def _fetch_llm_latency():
+    """
+    Fetch the latency histogram of every LLM model called by this process.
+    """
+    try:
+        return ResponseModel(
+            status="success",
+            message="LLM latency fetched successfully",
+            job_id="",
+            project_status=None,
+            data={"models": latency_stats.report()}
+        )
+    except Exception as e:
+        return ResponseModel(
+            status="error",
+            message=f"Error fetching LLM latency: {str(e)}",
+            job_id="",
+            project_status="failed",
+            data=None
+        )
@@ -1,33 +1,54 @@
 
+import asyncio
 import json
 import os
 
 from fastapi import BackgroundTasks
-from src.llm.llm import llm_call_analyse_sent, llm_call_analyse_word
+from src.llm.llm import track_prompt_usage
+from src.llm.pipeline import aanalyse_pipelined, aanalyse_sequential, combine_invalids
 from src.models.invalid_model import InvalidModel
 from src.models.metadata_model import MetadataModel
 from src.models.project_status import ProjectStatus
 from src.models.response_model import ResponseModel
-from src.transcribe.deepgram_transcriber import deepgram_transcribe
-from src.utils.constants import TEMP_DIR
-from src.utils.json_parser import llm_json_parser
-from src.utils.transcript_format import dummy_word_transcript, format_deepgram_transcript_sent, format_deepgram_transcript_word
+from src.transcribe.long_form import transcribe_audio
+from src.utils.audio_extract import extract_audio
+from src.utils.constants import FILLER_DETECTION, PIPELINE_ANALYSIS, PROGRESS_INTERVAL, SILENCE_DETECTION, TEMP_DIR
+from src.utils.disk_cache import write_atomic
+from src.utils.filler_detect import detect_fillers
+from src.utils.silence_detect import detect_silences
+from src.utils.transcript_format import dummy_word_transcript
+from src.utils.word_index import build_word_index
 import time
 import random
 
 
-def process_together(meta: MetadataModel, is_debug=False):
+async def process_together(meta: MetadataModel, is_debug=False):
+    """
+    Transcribe and analyse the job. Awaited by the background task, the blocking
+    audio and transcription steps run in worker threads so the event loop stays free.
+    """
     if meta.is_processing:
         raise ValueError("Processing is already in progress.")
+    pauses_task = None
     try:
         print(f"[DEBUG] Starting processing for job {meta.job_id}")
         meta.status = ProjectStatus.TRANSCRIPT_START
         meta.is_processing = True
         meta.save_metadata()
 
-        # Transcribe the video
+        # Extract the audio track, only the audio is uploaded for transcription
+        print(f"[DEBUG] Extracting audio")
+        job_dir = os.path.join(TEMP_DIR, meta.job_id)
+        audio_path = await asyncio.to_thread(extract_audio, meta.input_path, job_dir)
+
+        # Long pauses are found in the audio signal, no LLM needed; runs alongside the transcription
+        if SILENCE_DETECTION:
+            print(f"[DEBUG] Starting silence detection")
+            pauses_task = asyncio.create_task(asyncio.to_thread(detect_silences, audio_path))
+
+        # Transcribe the video, long recordings are transcribed in chunks
         print(f"[DEBUG] Starting video transcription")
-        transcription = deepgram_transcribe(meta.input_path)
+        transcription = await asyncio.to_thread(transcribe_audio, audio_path, cache_dir=job_dir)
         if not transcription:
             raise ValueError("No transcription data received.")
         
@@ -35,6 +56,7 @@ def process_together(meta: MetadataModel, is_debug=False):
         transcript_path = os.path.join(TEMP_DIR, meta.job_id, "transcript.json")
         with open(transcript_path, "w") as f:
             f.write(transcription)
+        await asyncio.to_thread(build_word_index, json.loads(transcription), job_dir)
 
         # update metadata
         meta.status = ProjectStatus.TRANSCRIPT_COMPLETE
@@ -44,44 +66,60 @@ def process_together(meta: MetadataModel, is_debug=False):
         
         with open(transcript_path, "r") as f:
             transcription = json.load(f)
-        transcription_sent = format_deepgram_transcript_sent(transcription)
+
+        # Filler words are cut by rule and left out of the word analysis prompts
+        fillers, filler_ids = detect_fillers(transcription) if FILLER_DETECTION else ([], set())
+        with open(os.path.join(TEMP_DIR, meta.job_id, "analysis_filler.json"), "w") as f:
+            json.dump({"data": [item.to_dict() for item in fillers]}, f)
+        print(f"[DEBUG] Found {len(fillers)} filler segments without the LLM")
 
         # Perform sentence analysis
         print(f"[DEBUG] Starting sentence analysis")
         meta.status = ProjectStatus.SENT_ANALYSIS_START
         meta.save_metadata()
-        analysis_sent = llm_call_analyse_sent(transcription_sent)
-        analysis_sent = llm_json_parser(analysis_sent)
-        if not analysis_sent or analysis_sent == {}:
-            raise ValueError("Sentence analysis failed.")
-        
-        # Save the sentence analysis to a file
+        # invalids are written as they stream in so /invalids can show them early
         analysis_sent_path = os.path.join(TEMP_DIR, meta.job_id, "analysis_sent.json")
-        with open(analysis_sent_path, "w") as f:
-            json.dump(analysis_sent, f)
-        
-        # completed sentence analysis
-        meta.status = ProjectStatus.SENT_ANALYSIS_END
-        meta.save_metadata()
-        print(f"[DEBUG] Sentence analysis completed successfully")
+        partial_sent = []
+        write_atomic(analysis_sent_path, json.dumps({"data": partial_sent}))
+        last_write = [0.0]
 
-        # Process invalids from sentence analysis
-        invalids = [InvalidModel.from_dict(item) for item in analysis_sent['data']]
-        invalids.sort(key=lambda x: x.start_time)
-        print(f"[DEBUG] Found {len(invalids)} invalid segments from sentence analysis")
+        def on_invalid(item: InvalidModel):
+            # rewritten at most once per PROGRESS_INTERVAL, the merged analysis is written when done
+            partial_sent.append(item.to_dict())
+            now = time.monotonic()
+            if now - last_write[0] < PROGRESS_INTERVAL:
+                return
+            last_write[0] = now
+            write_atomic(analysis_sent_path, json.dumps({"data": partial_sent}))
 
-        # Perform word analysis
-        print(f"[DEBUG] Starting word analysis")
-        meta.status = ProjectStatus.WORD_ANALYSIS_START
-        meta.save_metadata()
+        def on_sent_done(analysis_sent: dict):
+            if not analysis_sent or analysis_sent == {}:
+                raise ValueError("Sentence analysis failed.")
+
+            # Save the merged sentence analysis over the streamed one
+            with open(analysis_sent_path, "w") as f:
+                json.dump(analysis_sent, f)
+
+            # completed sentence analysis, the word analysis of its first invalids may already run
+            meta.status = ProjectStatus.SENT_ANALYSIS_END
+            meta.save_metadata()
+            print(f"[DEBUG] Sentence analysis completed successfully, found {len(analysis_sent['data'])} invalid segments")
+            meta.status = ProjectStatus.WORD_ANALYSIS_START
+            meta.save_metadata()
+
+        # long transcripts are analysed in overlapping windows, the partial invalids
+        # go to the word analysis in batches while the sentence analysis streams
+        print(f"[DEBUG] Starting word analysis {'alongside' if PIPELINE_ANALYSIS else 'after'} the sentence analysis")
+        prompt_usage = track_prompt_usage()
+        analyse = aanalyse_pipelined if PIPELINE_ANALYSIS else aanalyse_sequential
+        analysis_sent, analysis_word = await analyse(transcription, on_invalid=on_invalid, on_sent_done=on_sent_done,
+                                                    skip_words=filler_ids)
+
+        # Save the prompt sizes of the job
+        with open(os.path.join(TEMP_DIR, meta.job_id, "prompt_usage.json"), "w") as f:
+            json.dump(prompt_usage, f)
+        print(f"[DEBUG] Prompt tokens: {prompt_usage}")
 
-        # word analysis
-        transcription_word = format_deepgram_transcript_word(transcription, invalids)
-        analysis_word = llm_call_analyse_word(transcription_word)
-        analysis_word = llm_json_parser(analysis_word)
-        if not analysis_word or analysis_word == {}:
-            raise ValueError("Word analysis failed.")
-        
         # Save the word analysis to a file
         analysis_word_path = os.path.join(TEMP_DIR, meta.job_id, "analysis_word.json")
         with open(analysis_word_path, "w") as f:
@@ -92,15 +130,15 @@ def process_together(meta: MetadataModel, is_debug=False):
         meta.save_metadata()
         print(f"[DEBUG] Word analysis completed successfully")
 
-        # Prepare invalids for trimming
-        invalids_entire = [item for item in invalids if item.is_entire]
-        invalids_word = [InvalidModel.from_dict(item) for item in analysis_word['data']]
-        invalids_word.sort(key=lambda x: x.start_time)
-        print(f"[DEBUG] Found {len(invalids_entire)} entire segments and {len(invalids_word)} word segments to remove")
+        # Save the long pauses to a file
+        pauses = await pauses_task if pauses_task is not None else []
+        with open(os.path.join(TEMP_DIR, meta.job_id, "analysis_pause.json"), "w") as f:
+            json.dump({"data": [item.to_dict() for item in pauses]}, f)
+
+        # Merge the entire sentences, the word invalids, the pauses and the fillers for trimming
+        all_invalids = combine_invalids(analysis_sent, analysis_word, pauses + fillers)
+        print(f"[DEBUG] Found {len(all_invalids) - len(analysis_word['data']) - len(pauses) - len(fillers)} entire segments, {len(analysis_word['data'])} word segments, {len(pauses)} long pauses and {len(fillers)} fillers to remove")
 
-        # Merge invalids
-        all_invalids = invalids_entire + invalids_word
-        all_invalids.sort(key=lambda x: x.start_time)
         # Save the merged invalids to a file
         all_invalids_path = os.path.join(TEMP_DIR, meta.job_id, "all_invalids.json")
         with open(all_invalids_path, "w") as f:
@@ -116,6 +154,10 @@ def process_together(meta: MetadataModel, is_debug=False):
         meta.is_processing = False
         meta.save_metadata()
         raise e
+    finally:
+        # a step failed before the pauses were used, let the detection thread finish and drop its result
+        if pauses_task is not None:
+            await asyncio.gather(pauses_task, return_exceptions=True)
 
 def dummy_process_together(meta: MetadataModel):
     """
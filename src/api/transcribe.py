@@ -1,11 +1,14 @@
 
 import os
+import json
 from fastapi import BackgroundTasks
 from src.models.metadata_model import MetadataModel
 from src.models.project_status import ProjectStatus
 from src.models.response_model import ResponseModel
-from src.transcribe.deepgram_transcriber import deepgram_transcribe
+from src.transcribe.long_form import transcribe_audio
+from src.utils.audio_extract import extract_audio
 from src.utils.constants import TEMP_DIR
+from src.utils.word_index import build_word_index
 
 
 def process_transcription(meta: MetadataModel):
@@ -16,8 +19,10 @@ def process_transcription(meta: MetadataModel):
         meta.is_processing = True
         meta.save_metadata()
 
-        # Transcribe the video
-        transcription = deepgram_transcribe(meta.input_path)
+        # Transcribe the extracted audio track
+        job_dir = os.path.join(TEMP_DIR, meta.job_id)
+        audio_path = extract_audio(meta.input_path, job_dir)
+        transcription = transcribe_audio(audio_path, cache_dir=job_dir)
         if not transcription:
             raise ValueError("Transcription failed.")
         
@@ -25,6 +30,7 @@ def process_transcription(meta: MetadataModel):
         transcript_path = os.path.join(TEMP_DIR, meta.job_id, "transcript.json")
         with open(transcript_path, "w") as f:
             f.write(transcription)
+        build_word_index(json.loads(transcription), job_dir)
 
         # update metadata
         meta.status = ProjectStatus.TRANSCRIPT_COMPLETE
@@ -5,13 +5,17 @@ from src.models.metadata_model import MetadataModel
 from src.models.project_status import ProjectStatus
 from src.models.response_model import ResponseModel
 from src.utils.constants import TEMP_DIR
+from src.utils.word_index import load_word_index
+from typing import Optional
 
 def format_word_transcript(transcript: dict) -> dict:
     return transcript['results']['channels'][0]['alternatives'][0]['words']
 
-def _fetch_transcript(job_id: str) -> str:
+def _fetch_transcript(job_id: str, start: Optional[float] = None, end: Optional[float] = None) -> str:
     """
     Fetch the transcript from the given job ID.
+    With start and/or end only the words inside that time range are returned,
+    looked up in the word index of the job.
     """
     try:
         # Load metadata
@@ -28,15 +32,18 @@ def _fetch_transcript(job_id: str) -> str:
         if not os.path.exists(transcript_path):
             raise ValueError("Transcript file not found.")
         
-        with open(transcript_path, "r") as f:
-            transcript = json.load(f)
+        if start is not None or end is not None:
+            words = load_word_index(os.path.join(TEMP_DIR, job_id)).words_in_range(start, end)
+        else:
+            with open(transcript_path, "r") as f:
+                words = format_word_transcript(json.load(f))
 
         return ResponseModel(
             status="success",
             message="Transcript fetched successfully",
             job_id=job_id,
             project_status=meta.status.to_string(),
-            data={"transcript": format_word_transcript(transcript)}
+            data={"transcript": words}
         )
     except Exception as e:
         return ResponseModel(
@@ -7,6 +7,7 @@ from src.models.invalid_model import InvalidModel
 from src.models.metadata_model import MetadataModel
 from src.models.project_status import ProjectStatus
 from src.models.response_model import ResponseModel
+from src.utils.ffmpeg_runner import FFmpegCancelled
 from src.utils.video_trimmer import trim_video as video_trimmer
 from src.utils.constants import TEMP_DIR
 
@@ -17,6 +18,7 @@ def _trim_video(meta: MetadataModel):
     try:
         meta.status = ProjectStatus.TRIM_START
         meta.is_processing = True
+        meta.progress = None
         meta.save_metadata()
 
         # Load invalid segments
@@ -34,17 +36,30 @@ def _trim_video(meta: MetadataModel):
             raise ValueError("No invalid segments found for trimming.")
         if not meta.input_path or not os.path.isfile(meta.input_path):
             raise ValueError("File not found.")
-        video_trimmer(meta.input_path, invalids, output_path)
+
+        def on_progress(progress: dict):
+            meta.progress = progress
+            meta.save_metadata()
+
+        video_trimmer(meta.input_path, invalids, output_path, job_id=meta.job_id, on_progress=on_progress)
 
         # Update metadata
         meta.status = ProjectStatus.COMPLETED
         meta.is_processing = False
         meta.save_metadata()
 
+    except FFmpegCancelled as e:
+        print(f"[DEBUG] Video trimming cancelled: {str(e)}")
+        meta.is_processing = False
+        meta.status = ProjectStatus.PROCESSED_INVALID_SEGMENT
+        meta.progress = None
+        meta.save_metadata()
+
     except Exception as e:
         print(f"[DEBUG] Error during video trimming: {str(e)}")
         meta.is_processing = False
         meta.status = ProjectStatus.PROCESSED_INVALID_SEGMENT
+        meta.progress = None
         meta.save_metadata()
         raise e
     
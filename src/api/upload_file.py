@@ -5,6 +5,7 @@ from src.models.metadata_model import MetadataModel
 from src.models.project_status import ProjectStatus
 from src.models.response_model import ResponseModel
 from src.utils.constants import TEMP_DIR
+from src.utils.media_probe import probe_media
 
 
 def _already_uploaded(file_path: str) -> MetadataModel | None:
@@ -35,6 +36,10 @@ def _upload_file(file_path: str):
         # Check if the file is a video
         if not file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
             raise ValueError("File is not a valid video format.")
+        # Probe the streams once, the packet index smart cut needs is added at trim time
+        media = probe_media(file_path)
+        if media.video_stream is None:
+            raise ValueError("File has no video stream.")
 
         # Check if the file has already been uploaded
         meta = _already_uploaded(file_path)
@@ -60,6 +65,7 @@ def _upload_file(file_path: str):
         )
         # Save metadata to a file or database
         meta.save_metadata()
+        probe_media(input_path, cache_dir=os.path.join(TEMP_DIR, job_id))
         
         return ResponseModel(
             status="success",
@@ -0,0 +1,424 @@
+import os
+import time
+import asyncio
+import bisect
+import weakref
+import threading
+from collections import deque
+from typing import AsyncIterator
+import httpx
+import litellm
+from litellm import acompletion
+from openai import AsyncOpenAI
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+from src.utils.constants import (
+    LLM_CONCURRENCY, LLM_MAX_CONCURRENCY, LLM_MAX_CONNECTIONS, LLM_MODEL_RATE_LIMITS,
+    LLM_RATE_LIMIT_RPM, LLM_TIMEOUT,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second on average with bursts of up to `capacity`.
+    Shared by every thread and event loop of the process: a request reserves the
+    next token under a thread lock and sleeps on its own loop until it is due.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    async def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1.0
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # the reserved token goes back to the requests queued behind
+                with self.lock:
+                    self.tokens += 1.0
+                raise
+
+
+class Slots:
+    """
+    Semaphore shared by every thread and event loop of the process. A released
+    slot is handed to the oldest waiter on that waiter's own loop.
+    """
+
+    def __init__(self, value: int):
+        self.value = value
+        self.lock = threading.Lock()
+        self.waiters: deque = deque()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.value > 0 and not self.waiters:
+                self.value -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.lock:
+                queued = waiter in self.waiters
+                if queued:
+                    self.waiters.remove(waiter)
+            # granted just before the cancellation, pass the slot on
+            if not queued and waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                loop, future = self.waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+                except RuntimeError:
+                    # the waiter's loop is closed
+                    continue
+            self.value += 1
+
+    def _grant(self, future: asyncio.Future):
+        if future.done():
+            # the waiter was cancelled meanwhile
+            self.release()
+        else:
+            future.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class LatencyStats:
+    """
+    Latency of the successful requests of every model: a histogram over
+    LATENCY_BUCKETS for reporting and the last `window` samples for percentiles.
+    """
+
+    LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.lock = threading.Lock()
+        self.counts: dict[str, list] = {}
+        self.samples: dict[str, deque] = {}
+
+    def record(self, model: str, seconds: float):
+        with self.lock:
+            if model not in self.counts:
+                self.counts[model] = [0] * (len(self.LATENCY_BUCKETS) + 1)
+                self.samples[model] = deque(maxlen=self.window)
+            self.counts[model][bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+            self.samples[model].append(seconds)
+
+    def percentile(self, model: str, q: float, min_samples: int = 1) -> float | None:
+        """Latency under which `q` (0-1) of the recent requests finished, None with too few samples"""
+        with self.lock:
+            samples = sorted(self.samples.get(model, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def report(self) -> dict:
+        """Per model request count, p50/p90/p99 and histogram keyed by bucket upper bound"""
+        with self.lock:
+            models = {model: (list(counts), sorted(self.samples[model])) for model, counts in self.counts.items()}
+        report = {}
+        for model, (counts, samples) in models.items():
+            bounds = [f"<={bound:g}s" for bound in self.LATENCY_BUCKETS] + [f">{self.LATENCY_BUCKETS[-1]:g}s"]
+            report[model] = {
+                "requests": sum(counts),
+                **{f"p{q}": round(samples[min(len(samples) - 1, q * len(samples) // 100)], 3) for q in (50, 90, 99)},
+                "histogram": dict(zip(bounds, counts)),
+            }
+        return report
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+            self.samples.clear()
+
+
+latency_stats = LatencyStats()
+
+
+class _Limits:
+    """Concurrency and rate limits of the whole process, whatever thread or loop sends the request"""
+
+    def __init__(self, max_concurrency: int, model_concurrency: int):
+        self.semaphore = Slots(max_concurrency)
+        self.model_concurrency = model_concurrency
+        self.model_semaphores: dict[str, Slots] = {}
+        self.buckets: dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def limits_for(self, model: str) -> tuple:
+        with self.lock:
+            if model not in self.model_semaphores:
+                rpm = LLM_MODEL_RATE_LIMITS.get(model, LLM_RATE_LIMIT_RPM)
+                self.model_semaphores[model] = Slots(self.model_concurrency)
+                # no bursts, requests are spaced evenly at the provider rate
+                self.buckets[model] = TokenBucket(rpm / 60.0)
+            return self.model_semaphores[model], self.buckets[model]
+
+
+_limits = _Limits(LLM_MAX_CONCURRENCY, LLM_CONCURRENCY)
+
+
+class _Clients:
+    """Pooled connections of one event loop, handed to litellm with every request"""
+
+    def __init__(self):
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        self.session = httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+        self.gemini_client = AsyncHTTPHandler(timeout=LLM_TIMEOUT)
+        self.openai_clients: dict[tuple, AsyncOpenAI] = {}
+
+    def client_for(self, model: str, api_key: str | None, kwargs: dict):
+        """Client of the model's provider over the pooled connections, None to let litellm pick"""
+        if model.startswith("gemini/"):
+            return self.gemini_client
+        try:
+            provider = litellm.get_llm_provider(model)[1]
+        except Exception:
+            return None
+        if provider != "openai":
+            return None
+        # resolved like litellm does for OpenAI compatible servers
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        api_base = kwargs.get("api_base") or os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE")
+        if not api_key:
+            return None
+        # litellm sets max_retries on the client it is given, one client per value
+        key = (api_key, api_base, kwargs.get("max_retries"))
+        if key not in self.openai_clients:
+            self.openai_clients[key] = AsyncOpenAI(api_key=api_key, base_url=api_base, http_client=self.session)
+        return self.openai_clients[key]
+
+    async def aclose(self):
+        await self.session.aclose()
+        await self.gemini_client.close()
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Clients]" = weakref.WeakKeyDictionary()
+
+
+def _get_clients() -> _Clients:
+    # pooled connections belong to the loop that opened them
+    loop = asyncio.get_running_loop()
+    clients = _clients.get(loop)
+    if clients is None:
+        clients = _Clients()
+        _clients[loop] = clients
+    return clients
+
+
+def configure_limits(max_concurrency: int = LLM_MAX_CONCURRENCY, model_concurrency: int = LLM_CONCURRENCY):
+    """Replace the limits of the process, models get fresh semaphores and buckets"""
+    global _limits
+    _limits = _Limits(max_concurrency, model_concurrency)
+
+
+async def acall_llm(prompt: str, model: str, api_key: str | None = None, timeout: float = LLM_TIMEOUT,
+                    **kwargs) -> str:
+    """
+    Send one prompt to the model and return the text of the answer. Waits for
+    a free slot under the global and the per-model concurrency limits and for
+    the model's rate limit before the request is sent; `timeout` only counts
+    the request itself. The latency of answered requests goes to latency_stats.
+    """
+    limits = _limits
+    model_semaphore, bucket = limits.limits_for(model)
+    if "client" not in kwargs:
+        client = _get_clients().client_for(model, api_key, kwargs)
+        if client is not None:
+            kwargs["client"] = client
+
+    async with limits.semaphore:
+        async with model_semaphore:
+            await bucket.acquire()
+            start = time.monotonic()
+            # the provider timeout is not always enforced while streaming or retrying, bound it here too
+            response = await asyncio.wait_for(acompletion(
+                model=model,
+                api_key=api_key,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=timeout,
+                **kwargs,
+            ), timeout)
+            latency_stats.record(model, time.monotonic() - start)
+    return response["choices"][0]["message"]["content"]
+
+
+async def astream_llm(prompt: str, model: str, api_key: str | None = None, timeout: float = LLM_TIMEOUT,
+                      **kwargs) -> AsyncIterator[str]:
+    """
+    Stream the answer of the model, yielding its text as it arrives. Holds a
+    slot under the same limits as acall_llm until the stream ends; `timeout`
+    bounds the whole stream.
+    """
+    limits = _limits
+    model_semaphore, bucket = limits.limits_for(model)
+    if "client" not in kwargs:
+        client = _get_clients().client_for(model, api_key, kwargs)
+        if client is not None:
+            kwargs["client"] = client
+
+    async with limits.semaphore:
+        async with model_semaphore:
+            await bucket.acquire()
+            start = time.monotonic()
+            deadline = start + timeout
+            response = await asyncio.wait_for(acompletion(
+                model=model,
+                api_key=api_key,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=timeout,
+                stream=True,
+                **kwargs,
+            ), timeout)
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            latency_stats.record(model, time.monotonic() - start)
+
+
+async def aclose():
+    """Close the pooled connections of the running loop"""
+    clients = _clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients.aclose()
+
+
+# burst of requests against a local rate limited OpenAI compatible server
+# usage: python -m src.llm.async_llm [n_requests] [rpm]
+if __name__ == "__main__":
+    import sys
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rpm = float(sys.argv[2]) if len(sys.argv) > 2 else 600.0
+    model = "openai/fake-model"
+
+    class RateLimitedHandler(BaseHTTPRequestHandler):
+        """Answers like the OpenAI API and returns 429 above rpm like a provider"""
+        protocol_version = "HTTP/1.1"
+        lock = threading.Lock()
+        allowance = 2.0
+        last = time.monotonic()
+        served = 0
+        rejected = 0
+        connections = set()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            cls = RateLimitedHandler
+            with cls.lock:
+                cls.connections.add(self.client_address)
+                now = time.monotonic()
+                # a little burst tolerance, providers count over a window rather than per request
+                cls.allowance = min(2.0, cls.allowance + (now - cls.last) * rpm / 60.0)
+                cls.last = now
+                allowed = cls.allowance >= 1.0
+                if allowed:
+                    cls.allowance -= 1.0
+                    cls.served += 1
+                else:
+                    cls.rejected += 1
+            if allowed:
+                time.sleep(0.05)
+                status, body = 200, {
+                    "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": "fake-model",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{\"data\": []}"}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                }
+            else:
+                status, body = 429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": 429}}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{server.server_port}/v1"
+
+    async def burst(limited: bool, n: int = n_requests) -> tuple:
+        async def one(i: int):
+            try:
+                if limited:
+                    return await acall_llm(f"prompt {i}", model, api_key="fake", api_base=api_base, max_retries=0)
+                response = await acompletion(model=model, api_key="fake", api_base=api_base, max_retries=0,
+                                             messages=[{"role": "user", "content": f"prompt {i}"}])
+                return response["choices"][0]["message"]["content"]
+            except litellm.RateLimitError:
+                return None
+
+        start = time.monotonic()
+        results = await asyncio.gather(*(one(i) for i in range(n)))
+        elapsed = time.monotonic() - start
+        await aclose()
+        return sum(r is not None for r in results), elapsed
+
+    LLM_MODEL_RATE_LIMITS[model] = rpm
+    litellm.suppress_debug_info = True
+    for limited in (False, True):
+        RateLimitedHandler.served = RateLimitedHandler.rejected = 0
+        RateLimitedHandler.connections = set()
+        time.sleep(60.0 / rpm)
+        ok, elapsed = asyncio.run(burst(limited))
+        label = "limited" if limited else "unlimited"
+        print(f"{label:>9}: {ok}/{n_requests} succeeded, {RateLimitedHandler.rejected} rejected with 429 in {elapsed:.2f}s "
+              f"({ok / elapsed * 60:.0f} rpm of {rpm:.0f}), {len(RateLimitedHandler.connections)} connections")
+        if limited:
+            assert ok == n_requests and RateLimitedHandler.rejected == 0, "rate limited burst saw 429s"
+            assert len(RateLimitedHandler.connections) <= LLM_CONCURRENCY, "connections were not reused"
+
+    # the same burst split over two threads, each with its own loop, shares the limits
+    RateLimitedHandler.served = RateLimitedHandler.rejected = 0
+    time.sleep(60.0 / rpm)
+    results = []
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: results.append(asyncio.run(burst(True, n_requests // 2))))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    ok = sum(r[0] for r in results)
+    print(f"2 threads: {ok}/{n_requests // 2 * 2} succeeded, {RateLimitedHandler.rejected} rejected with 429 in {elapsed:.2f}s "
+          f"({ok / elapsed * 60:.0f} rpm of {rpm:.0f})")
+    assert ok == n_requests // 2 * 2 and RateLimitedHandler.rejected == 0, "loops in two threads exceeded the rate limit"
+    assert litellm.aclient_session is None, "the litellm global session was set"
+    server.shutdown()
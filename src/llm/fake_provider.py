@@ -0,0 +1,144 @@
+import json
+import time
+import random
+import threading
+from typing import Callable, Optional, Union
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeModel:
+    """
+    Behaviour of one model of the fake provider: answer, latency range in
+    seconds (or a function drawing one), share of requests failing with
+    `fail_status` and the requests per minute allowed before answering 429. Streamed answers are sent
+    `chunk_chars` characters at a time, one every `chunk_delay` seconds,
+    and a non-streamed answer waits for the whole stream to be generated.
+    """
+
+    def __init__(self, answer: Callable[[str], str] = lambda prompt: '{"data": []}',
+                 latency: Union[tuple, Callable[[], float]] = (0.0, 0.0), fail_rate: float = 0.0, fail_status: int = 500,
+                 rpm: Optional[float] = None, burst: float = 2.0, chunk_chars: int = 16,
+                 chunk_delay: float = 0.0):
+        self.answer = answer
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.rpm = rpm
+        self.burst = burst
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.allowance = burst
+        self.last = time.monotonic()
+        self.requests = 0
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+
+
+class FakeProvider:
+    """
+    Local server answering like the OpenAI chat completions API, streamed as
+    server-sent events when asked, for checking the LLM layer offline. Call
+    models as "openai/<name>" with api_base=provider.api_base.
+    """
+
+    def __init__(self, models: dict):
+        self.models = models
+        self.lock = threading.Lock()
+        self.connections = set()
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, payload = provider._handle(body, self.client_address)
+                if status == 200 and body.get('stream'):
+                    self._stream(body.get('model'), payload)
+                    return
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up on the request, e.g. a cancelled hedge or a timeout
+                    pass
+
+            def _stream(self, name: str, payload: dict):
+                model = provider.models[name]
+                content = payload['choices'][0]['message']['content']
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for i in range(0, len(content), model.chunk_chars):
+                        time.sleep(model.chunk_delay)
+                        chunk = {"id": "fake", "object": "chat.completion.chunk", "created": payload['created'],
+                                 "model": name, "choices": [{"index": 0, "finish_reason": None,
+                                                             "delta": {"content": content[i:i + model.chunk_chars]}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    done = {"id": "fake", "object": "chat.completion.chunk", "created": payload['created'],
+                            "model": name, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+                    self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.api_base = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def _handle(self, body: dict, client_address) -> tuple:
+        model = self.models.get(body.get('model'))
+        if model is None:
+            return 404, {"error": {"message": f"Unknown model {body.get('model')}", "type": "invalid_request_error", "code": 404}}
+        prompt = "".join(m.get('content', "") for m in body.get('messages', []))
+
+        with self.lock:
+            self.connections.add(client_address)
+            model.requests += 1
+            if model.rpm:
+                now = time.monotonic()
+                model.allowance = min(model.burst, model.allowance + (now - model.last) * model.rpm / 60.0)
+                model.last = now
+                if model.allowance < 1.0:
+                    model.rejected += 1
+                    return 429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": 429}}
+                model.allowance -= 1.0
+            failed = random.random() < model.fail_rate
+            if failed:
+                model.failed += 1
+
+        time.sleep(model.latency() if callable(model.latency) else random.uniform(*model.latency))
+        answer = model.answer(prompt)
+        if not body.get('stream') and model.chunk_delay:
+            # the answer takes as long to generate whether it is streamed or not
+            time.sleep(model.chunk_delay * -(-len(answer) // model.chunk_chars))
+        if failed:
+            return model.fail_status, {"error": {"message": "Simulated provider error", "type": "server_error", "code": model.fail_status}}
+
+        with self.lock:
+            model.served += 1
+        return 200, {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body.get('model'),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 1, "total_tokens": len(prompt) // 4 + 1},
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
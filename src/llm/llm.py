@@ -1,57 +1,179 @@
 import os
-from litellm import completion
-from src.llm.prompt import generate_sent_analysis_prompt, generate_word_analysis_prompt
+import asyncio
+import logging
+import contextvars
+from typing import Callable, Iterable, List, Optional, Union
+from src.llm.async_llm import aclose
+from src.llm.prompt import count_tokens, generate_sent_analysis_prompt, generate_word_analysis_prompt
+from src.llm.resilient import AllModelsFailedError, acall_resilient, astream_resilient
+from src.llm.response_cache import get_response, put_response
+from src.llm.structured import SENT_ITEM_REFERENCE, WORD_ITEM_REFERENCE, invalids_response_format, supports_structured_output
+from src.utils.constants import LLM_SENT_MODELS, LLM_STRUCTURED_OUTPUT, LLM_WORD_MODELS
+from src.models.invalid_model import InvalidModel
+from src.utils.json_parser import InvalidsParser, parse_invalids
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def llm_call_analyse_sent(transcript:str):
+logger = logging.getLogger(__name__)
+
+# prompt sizes of the job being processed, see track_prompt_usage
+_prompt_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("prompt_usage", default=None)
+
+def track_prompt_usage() -> dict:
     """
-    Call the LLM to analyze the transcript
+    Count the prompts sent from the current context on, tasks started from
+    it included. Returns the counters, per stage: calls, calls answered from
+    the cache, prompt tokens and the tokens actually sent to a model.
     """
+    usage = {stage: {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "sent_tokens": 0} for stage in ("sent", "word")}
+    _prompt_usage.set(usage)
+    return usage
 
-    # generate the prompt
-    prompt = generate_sent_analysis_prompt(transcript)
-    # print(prompt)
-
-    # call the LLM
-    response = completion(
-        api_key=os.getenv("GOOGLE_API_KEY"),
-        model="gemini/gemini-1.5-flash",  
-        # model="gemini/gemini-2.5-pro-exp-03-25",  # Gemini Pro via LiteLLM
-        # model="gpt-4o",  # OpenAI GPT-4 model
-        # api_key=os.getenv("OPENAI_API_KEY"),  # OpenAI API key
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    # print(response["choices"][0]["message"]["content"])
-    return response["choices"][0]["message"]["content"]
-
-def llm_call_analyse_word(transcript:str):
+def _record_usage(stage: str, models: List[str], prompt: str, cached: bool):
+    usage = _prompt_usage.get()
+    if usage is None:
+        return
+    tokens = count_tokens(prompt, models[0])
+    usage[stage]["calls"] += 1
+    usage[stage]["prompt_tokens"] += tokens
+    if cached:
+        usage[stage]["cached_calls"] += 1
+    else:
+        usage[stage]["sent_tokens"] += tokens
+
+def sent_analysis_models() -> List[str]:
+    """Fallback list of the sentence analysis, LLM_SENT_MODELS env var or the default"""
+    return _models("LLM_SENT_MODELS", LLM_SENT_MODELS)
+
+def word_analysis_models() -> List[str]:
+    """Fallback list of the word analysis, LLM_WORD_MODELS env var or the default"""
+    return _models("LLM_WORD_MODELS", LLM_WORD_MODELS)
+
+def _models(env_name: str, default: List[str]) -> List[str]:
+    # read at call time so a .env loaded after the constants still applies
+    value = os.getenv(env_name)
+    if not value:
+        return list(default)
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+def _model_options(models: List[str], reference: dict) -> dict:
+    options = {}
+    for model in models:
+        options[model] = {}
+        # Gemini reads GOOGLE_API_KEY, other providers find their own key in the environment
+        if model.startswith("gemini/"):
+            options[model]["api_key"] = os.getenv("GOOGLE_API_KEY")
+        # answers constrained to the invalids schema where the provider can, the parser copes with the others
+        if LLM_STRUCTURED_OUTPUT and supports_structured_output(model):
+            options[model]["response_format"] = invalids_response_format(reference)
+    return options
+
+def _cache_response(model: str, prompt: str, content: str):
+    # truncated or malformed answers are not cached, a retry should ask again
+    if not parse_invalids(content)[1]:
+        return
+    put_response(model, prompt, content)
+
+async def _acall_cached(stage: str, models: List[str], prompt: str, reference: dict) -> str:
+    # cached per fallback list, any model of it may have given the answer
+    cache_model = ",".join(models)
+    cached = get_response(cache_model, prompt)
+    _record_usage(stage, models, prompt, cached is not None)
+    if cached is not None:
+        return cached
+    content = await acall_resilient(prompt, models, model_options=_model_options(models, reference))
+    _cache_response(cache_model, prompt, content)
+    return content
+
+async def _astream_cached(stage: str, models: List[str], prompt: str, reference: dict,
+                         on_invalid: Callable[[InvalidModel], None],
+                         resolve: Optional[Callable[[dict], dict]] = None) -> str:
+    """
+    Stream the answer and call on_invalid with every invalid as soon as its
+    object is complete, its times found by `resolve`. Returns the whole
+    answer like _acall_cached.
+    """
+    cache_model = ",".join(models)
+    cached = get_response(cache_model, prompt)
+    _record_usage(stage, models, prompt, cached is not None)
+    if cached is not None:
+        for item in parse_invalids(cached, resolve)[0]:
+            on_invalid(item)
+        return cached
+
+    options = _model_options(models, reference)
+    parser = InvalidsParser(resolve)
+    emitted = set()
+
+    def emit(items: List[InvalidModel]):
+        for item in items:
+            key = tuple(item.to_dict().values())
+            if key not in emitted:
+                emitted.add(key)
+                on_invalid(item)
+
+    parts = []
+    try:
+        async for text in astream_resilient(prompt, models, model_options=options):
+            parts.append(text)
+            emit(parser.feed(text))
+        emit(parser.close())
+        content = "".join(parts)
+    except AllModelsFailedError:
+        raise
+    except Exception as e:
+        # the stream broke after part of the answer was used, ask again for the whole answer
+        logger.warning(f"Answer stream interrupted ({type(e).__name__}), retrying without streaming")
+        content = await acall_resilient(prompt, models, model_options=options)
+        emit(parse_invalids(content, resolve)[0])
+
+    _cache_response(cache_model, prompt, content)
+    return content
+
+def _run_sync(coro):
+    # the sync calls run on a loop of their own, its connections are closed with it
+    async def run():
+        try:
+            return await coro
+        finally:
+            await aclose()
+    return asyncio.run(run())
+
+def llm_call_analyse_sent(transcript:Union[str, Iterable[str]], on_invalid: Optional[Callable[[InvalidModel], None]] = None,
+                          resolve: Optional[Callable[[dict], dict]] = None):
     """
-    Call the LLM to analyze the transcript
+    Call the LLM to analyze the transcript, given as iter_compact_transcript_sent
+    lines; the answer refers to the sentences by id. With on_invalid the answer
+    is streamed and every invalid passed to it as soon as it is complete, its
+    times found by resolve (TranscriptLookup.resolve).
     """
+    return _run_sync(allm_call_analyse_sent(transcript, on_invalid, resolve))
 
-    # generate the prompt
-    prompt = generate_word_analysis_prompt(transcript)
-    # print(prompt)
+def llm_call_analyse_word(transcript:Union[str, Iterable[str]]):
+    """
+    Call the LLM to analyze the transcript, given as iter_compact_transcript_word
+    lines; the answer refers to the words by id
+    """
+    return _run_sync(allm_call_analyse_word(transcript))
 
-    # call the LLM
-    response = completion(
-        api_key=os.getenv("GOOGLE_API_KEY"),
-        model="gemini/gemini-2.0-flash",  
-        # model="gemini/gemini-2.5-pro-exp-03-25",  # Gemini Pro via LiteLLM
-        # model="gpt-4o",  # OpenAI GPT-4 model
-        # api_key=os.getenv("OPENAI_API_KEY"),  # OpenAI API key
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
+async def allm_call_analyse_sent(transcript:Union[str, Iterable[str]],
+                                 on_invalid: Optional[Callable[[InvalidModel], None]] = None,
+                                 resolve: Optional[Callable[[dict], dict]] = None):
+    """
+    Call the LLM to analyze the transcript, awaiting the shared async client.
+    With on_invalid the answer is streamed, see llm_call_analyse_sent.
+    """
+    prompt = generate_sent_analysis_prompt(transcript)
+    if on_invalid is not None:
+        return await _astream_cached("sent", sent_analysis_models(), prompt, SENT_ITEM_REFERENCE, on_invalid, resolve)
+    return await _acall_cached("sent", sent_analysis_models(), prompt, SENT_ITEM_REFERENCE)
 
-    # print(response["choices"][0]["message"]["content"])
-    return response["choices"][0]["message"]["content"]
+async def allm_call_analyse_word(transcript:Union[str, Iterable[str]]):
+    """
+    Call the LLM to analyze the word transcript, awaiting the shared async client
+    """
+    return await _acall_cached("word", word_analysis_models(), generate_word_analysis_prompt(transcript), WORD_ITEM_REFERENCE)
 
 
 # # Example usage
@@ -130,4 +252,68 @@ def llm_call_analyse_word(transcript:str):
 # """
 
 # res = llm_call_analyse_word(trans)
-# print(res)
\ No newline at end of file
+# print(res)
+
+# time to the first invalid, streamed and not, against a local fake streaming provider
+# usage: python -m src.llm.llm [n_invalids]
+if __name__ == "__main__":
+    import sys
+    import json
+    import time
+    import tempfile
+    import litellm
+    from src.llm.fake_provider import FakeModel, FakeProvider
+    from src.utils.constants import LLM_MODEL_RATE_LIMITS
+    from src.utils.transcript_format import TranscriptLookup, iter_compact_transcript_sent
+
+    n_invalids = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    litellm.suppress_debug_info = True
+    sentences = [{"text": f"sentence {i}", "start": i * 4.0, "end": i * 4.0 + 2.5} for i in range(n_invalids)]
+    transcript = {"results": {"channels": [{"alternatives": [{"words": [], "paragraphs": {"paragraphs": [{"sentences": sentences}]}}]}]}}
+    resolve = TranscriptLookup(transcript).resolve
+    answer = json.dumps({"data": [
+        {"id": i, "type": "repetition", "is_entire": i % 4 != 0} for i in range(n_invalids)
+    ]}, indent=2)
+    # about 500 tokens per second, 4 characters each
+    fake = {"streamer": FakeModel(answer=lambda prompt: answer, chunk_chars=8, chunk_delay=0.004)}
+    LLM_MODEL_RATE_LIMITS["openai/streamer"] = 60_000
+
+    with FakeProvider(fake) as provider, tempfile.TemporaryDirectory() as tmpdir:
+        # answers are cached under the working directory
+        os.chdir(tmpdir)
+        os.environ.update({"OPENAI_API_BASE": provider.api_base, "OPENAI_API_KEY": "fake",
+                           "LLM_SENT_MODELS": "openai/streamer"})
+
+        async def run(stream: bool, lines: List[str]) -> tuple:
+            start = time.monotonic()
+            first = []
+            streamed = []
+
+            def on_invalid(item: InvalidModel):
+                if not first:
+                    first.append(time.monotonic() - start)
+                streamed.append(item)
+
+            content = await allm_call_analyse_sent(lines, on_invalid if stream else None, resolve)
+            if not stream:
+                streamed = parse_invalids(content, resolve)[0]
+                first.append(time.monotonic() - start)
+            total = time.monotonic() - start
+            await aclose()
+            return first[0], total, streamed
+
+        lines = list(iter_compact_transcript_sent(transcript))
+        plain_first, plain_total, plain = asyncio.run(run(False, lines))
+        # another prompt, the first answer is cached
+        stream_first, stream_total, streamed = asyncio.run(run(True, lines + ["\n"]))
+        print(f"{n_invalids} invalids, {len(answer)} characters")
+        print(f"   plain: first invalid after {plain_first * 1000:.0f} ms, done in {plain_total * 1000:.0f} ms")
+        print(f"streamed: first invalid after {stream_first * 1000:.0f} ms, done in {stream_total * 1000:.0f} ms")
+        assert streamed == plain and len(streamed) == n_invalids, "streamed invalids differ"
+        assert [(item.start_time, item.end_time) for item in streamed] == [(s['start'], s['end']) for s in sentences]
+        assert stream_first < plain_first / 5, "streaming did not bring the first invalid forward"
+
+        # the answer is cached, a cached call replays it through on_invalid
+        replayed = []
+        asyncio.run(allm_call_analyse_sent(lines + ["\n"], replayed.append, resolve))
+        assert replayed == streamed and fake["streamer"].requests == 2, "cached answer not replayed"
@@ -0,0 +1,230 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from src.llm.llm import allm_call_analyse_word, word_analysis_models
+from src.llm.prompt import count_tokens, generate_word_analysis_prompt, split_by_budget
+from src.llm.windowed import aanalyse_sent_windowed
+from src.models.invalid_model import InvalidModel
+from src.utils.constants import WORD_BATCH_SIZE, WORD_PROMPT_TOKENS
+from src.utils.json_parser import llm_invalids_parser
+from src.utils.transcript_format import TranscriptLookup, iter_compact_transcript_word
+
+
+def _key(item: dict) -> Tuple[float, float]:
+    return float(item['start_time']), float(item['end_time'])
+
+
+def _partial(analysis_sent: dict) -> List[dict]:
+    # only sentences repeated in part need the word analysis, entire ones are cut whole
+    return sorted((item for item in analysis_sent['data'] if not item.get('is_entire', True)), key=_key)
+
+
+def _word_blocks(transcript: dict, invalids: List[InvalidModel], skip: Optional[Set[int]] = None) -> List[str]:
+    # the word lines of each invalid with the empty line closing it
+    blocks = []
+    block = []
+    for line in iter_compact_transcript_word(transcript, invalids, skip):
+        block.append(line)
+        if line == "\n":
+            blocks.append("".join(block))
+            block = []
+    return blocks
+
+
+async def _analyse_words(transcript: dict, items: List[dict], word_call: Callable[..., Awaitable[str]],
+                         max_tokens: int = WORD_PROMPT_TOKENS, skip_words: Optional[Set[int]] = None) -> List[dict]:
+    """
+    Word analysis of the invalids, split into prompts of at most max_tokens
+    that run concurrently. Word ids in skip_words are not sent.
+    """
+    if not items:
+        return []
+    invalids = [InvalidModel.from_dict(dict(item)) for item in items]
+    model = word_analysis_models()[0]
+    budget = max(1, max_tokens - count_tokens(generate_word_analysis_prompt(""), model))
+    parts = split_by_budget(_word_blocks(transcript, invalids, skip_words), budget, model)
+    resolve = TranscriptLookup(transcript).resolve
+    answers = await asyncio.gather(*(word_call(part) for part in parts))
+    return [item for answer in answers for item in llm_invalids_parser(answer, resolve)['data']]
+
+
+def _sorted_words(items: List[dict]) -> List[dict]:
+    unique = {(_key(item), item['type']): item for item in items}
+    return [unique[key] for key in sorted(unique)]
+
+
+def combine_invalids(analysis_sent: dict, analysis_word: dict,
+                     local_invalids: Optional[List[InvalidModel]] = None) -> List[InvalidModel]:
+    """
+    Invalids to cut: the entire sentences, the words found in the partial ones
+    and the invalids found without the LLM (long pauses, filler words), by start time
+    """
+    invalids_entire = [InvalidModel.from_dict(dict(item)) for item in analysis_sent['data'] if item.get('is_entire', True)]
+    invalids_entire.sort(key=lambda x: x.start_time)
+    invalids_word = [InvalidModel.from_dict(dict(item)) for item in analysis_word['data']]
+    all_invalids = invalids_entire + invalids_word + list(local_invalids or [])
+    all_invalids.sort(key=lambda x: x.start_time)
+    return all_invalids
+
+
+async def aanalyse_sequential(transcript: dict,
+                              sent_analyse: Callable[..., Awaitable[dict]] = aanalyse_sent_windowed,
+                              word_call: Callable[..., Awaitable[str]] = allm_call_analyse_word,
+                              on_invalid: Optional[Callable[[InvalidModel], None]] = None,
+                              on_sent_done: Optional[Callable[[dict], None]] = None,
+                              skip_words: Optional[Set[int]] = None) -> Tuple[dict, dict]:
+    """The whole sentence analysis, then one word analysis of its partial invalids"""
+    analysis_sent = await sent_analyse(transcript, on_invalid=on_invalid)
+    if on_sent_done is not None:
+        on_sent_done(analysis_sent)
+    words = await _analyse_words(transcript, _partial(analysis_sent), word_call, skip_words=skip_words)
+    return analysis_sent, {"data": _sorted_words(words)}
+
+
+async def aanalyse_pipelined(transcript: dict,
+                             sent_analyse: Callable[..., Awaitable[dict]] = aanalyse_sent_windowed,
+                             word_call: Callable[..., Awaitable[str]] = allm_call_analyse_word,
+                             batch_size: int = WORD_BATCH_SIZE,
+                             on_invalid: Optional[Callable[[InvalidModel], None]] = None,
+                             on_sent_done: Optional[Callable[[dict], None]] = None,
+                             skip_words: Optional[Set[int]] = None) -> Tuple[dict, dict]:
+    """
+    Sentence and word analysis overlapped: partial invalids streamed by the
+    sentence analysis go to the word analysis in batches of batch_size while
+    the sentence analysis goes on. Once it ends, the merged partial invalids
+    not sent yet make the last batch, and words found for a streamed invalid
+    that the merge dropped are discarded, so the result is the same as
+    aanalyse_sequential for a word analysis that looks at each invalid alone.
+    """
+    sent: Dict[Tuple[float, float], Tuple[int, InvalidModel]] = {}
+    batches: List[asyncio.Future] = []
+    pending: List[dict] = []
+
+    def flush():
+        if pending:
+            batches.append(asyncio.ensure_future(_analyse_words(transcript, list(pending), word_call, skip_words=skip_words)))
+            pending.clear()
+
+    def queue(item: dict):
+        if _key(item) not in sent:
+            sent[_key(item)] = (len(batches), InvalidModel.from_dict(dict(item)))
+            pending.append(item)
+            if len(pending) >= batch_size:
+                flush()
+
+    def streamed(item: InvalidModel):
+        if on_invalid is not None:
+            on_invalid(item)
+        if not item.is_entire:
+            queue(item.to_dict())
+
+    try:
+        analysis_sent = await sent_analyse(transcript, on_invalid=streamed)
+        if on_sent_done is not None:
+            on_sent_done(analysis_sent)
+        final = _partial(analysis_sent)
+        for item in final:
+            queue(item)
+        flush()
+        results = await asyncio.gather(*batches)
+    finally:
+        for batch in batches:
+            batch.cancel()
+
+    # words of a batch belong to the invalid of the batch that holds them,
+    # dropped when the merge did not keep that invalid
+    final_keys = {_key(item) for item in final}
+    batch_invalids: List[List[Tuple[Tuple[float, float], InvalidModel]]] = [[] for _ in batches]
+    for key, (index, invalid) in sent.items():
+        batch_invalids[index].append((key, invalid))
+
+    words = []
+    for invalids, result in zip(batch_invalids, results):
+        for word in result:
+            start, end = _key(word)
+            owner = next((key for key, invalid in invalids if invalid.start_time <= start and end <= invalid.end_time), None)
+            if owner is None or owner in final_keys:
+                words.append(word)
+    return analysis_sent, {"data": _sorted_words(words)}
+
+
+# pipelined and sequential analysis give the same invalids, checked with fake LLMs
+# usage: python -m src.llm.pipeline
+if __name__ == "__main__":
+    import re
+    import json
+    import time
+    import random
+    from src.llm.prompt import generate_sent_analysis_prompt, generate_word_analysis_prompt
+
+    SENTENCE = re.compile(r"^(\d+) (\d+) (\d+) (.*)$")
+    LLM_DELAY = 0.002
+
+    async def fake_sent_llm(lines, on_invalid=None, resolve=None) -> str:
+        """Flag a sentence said again later, in part when the retake is longer, streaming like a model"""
+        body = generate_sent_analysis_prompt(lines).split("Format: id pause duration text\n", 1)[1]
+        sentences = [SENTENCE.match(line).group(1, 4) for line in body.splitlines() if SENTENCE.match(line)]
+        data = []
+        for i, (sentence_id, text) in enumerate(sentences):
+            later = [t for _, t in sentences[i + 1:i + 4] if t.startswith(text.split(" again")[0])]
+            if later:
+                item = {"id": int(sentence_id), "type": "repetition", "is_entire": not any(len(t) > len(text) for t in later)}
+                data.append(item)
+                await asyncio.sleep(LLM_DELAY * 10)
+                if on_invalid is not None:
+                    on_invalid(InvalidModel.model_validate(resolve(item)))
+        await asyncio.sleep(LLM_DELAY * 10)
+        return json.dumps({"data": data})
+
+    async def fake_word_llm(lines) -> str:
+        """In every invalid block flag the first two words when they are said twice"""
+        body = generate_word_analysis_prompt(lines).split("Transcript:\n", 1)[1].split("\nRules:", 1)[0]
+        data = []
+        for block in body.split("\n\n"):
+            words = [line.split(" ", 1) for line in block.splitlines() if line.strip()]
+            await asyncio.sleep(LLM_DELAY * len(words))
+            if len(words) >= 4 and words[0][1] == words[2][1] and words[1][1] == words[3][1]:
+                data.append({"start_id": int(words[0][0]), "end_id": int(words[1][0]), "type": "repetition", "is_entire": True})
+        return json.dumps({"data": data})
+
+    random.seed(5)
+    sentences, words = [], []
+    t = 0.0
+    for i in range(600):
+        text = f"part {i} of the talk"
+        if i and random.random() < 0.15:
+            # a retake: the last sentence again, sometimes stuttered and finished longer
+            text = sentences[-1]['text'] + (" again" if random.random() < 0.5 else "")
+        tokens = text.split(" ")
+        if random.random() < 0.3:
+            tokens = tokens[:2] + tokens
+        start = t
+        for token in tokens:
+            words.append({"word": token, "punctuated_word": token, "start": round(t, 2), "end": round(t + 0.3, 2)})
+            t += 0.35
+        sentences.append({"text": text, "start": round(start, 2), "end": round(t - 0.05, 2)})
+        t += 0.5
+    transcript = {"results": {"channels": [{"alternatives": [
+        {"words": words, "paragraphs": {"paragraphs": [{"sentences": sentences}]}}]}]}}
+
+    async def sent_analyse(transcript, on_invalid=None):
+        return await aanalyse_sent_windowed(transcript, llm_call=fake_sent_llm, max_tokens=1200,
+                                            overlap_tokens=200, on_invalid=on_invalid)
+
+    async def run(analyse) -> tuple:
+        start = time.monotonic()
+        analysis_sent, analysis_word = await analyse(transcript, sent_analyse=sent_analyse, word_call=fake_word_llm)
+        return combine_invalids(analysis_sent, analysis_word), time.monotonic() - start, analysis_word
+
+    sequential, sequential_time, sequential_word = asyncio.run(run(aanalyse_sequential))
+    pipelined, pipelined_time, pipelined_word = asyncio.run(run(aanalyse_pipelined))
+    print(f"sequential: {sequential_time:.2f}s, pipelined: {pipelined_time:.2f}s, "
+          f"{len(sequential)} invalids of which {len(sequential_word['data'])} from the word analysis")
+    assert sequential_word['data'], "the fake word analysis found nothing"
+    assert [i.to_dict() for i in pipelined] == [i.to_dict() for i in sequential], "pipelined invalids differ"
+
+    # word prompts over the token budget are split, the answers are the same
+    partial = [item for item in _partial(asyncio.run(sent_analyse(transcript)))]
+    whole = asyncio.run(_analyse_words(transcript, partial, fake_word_llm, max_tokens=100_000))
+    split = asyncio.run(_analyse_words(transcript, partial, fake_word_llm, max_tokens=600))
+    assert _sorted_words(split) == _sorted_words(whole), "split word prompts differ"
+    print("pipelined all_invalids identical to the sequential ones, split word prompts too")
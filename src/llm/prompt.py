@@ -1,9 +1,72 @@
-def generate_sent_analysis_prompt(transcript:str)->str:
+from typing import Iterable, Iterator, List, Union
+import litellm
+
+# bump when a prompt template changes so cached LLM answers to the old prompts are not reused
+PROMPT_VERSION = 3
+
+# characters of transcript lines joined at a time while building a prompt
+ASSEMBLE_BLOCK_CHARS = 64 * 1024
+
+
+def chunk_transcript(lines: Iterable[str], max_chars: int) -> Iterator[str]:
+    """
+    Group transcript lines into chunks of at most max_chars characters,
+    never splitting a line. A single longer line becomes its own chunk.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        if chunk and size + len(line) > max_chars:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield "".join(chunk)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Tokens of the text for the model's tokenizer, or a standard one when litellm has none for it"""
+    return litellm.token_counter(model=model, text=text)
+
+
+def split_by_budget(blocks: List[str], budget: int, model: str) -> List[List[str]]:
+    """
+    Group the blocks of a prompt into parts of at most `budget` tokens each,
+    in order and never splitting a block. A block over the budget alone is
+    its own part.
+    """
+    parts = []
+    part = []
+    size = 0
+    for block in blocks:
+        tokens = count_tokens(block, model)
+        if part and size + tokens > budget:
+            parts.append(part)
+            part = []
+            size = 0
+        part.append(block)
+        size += tokens
+    if part:
+        parts.append(part)
+    return parts
+
+
+def _assemble(head: str, transcript: Union[str, Iterable[str]], tail: str) -> str:
+    # lines from a generator are joined in blocks as they come, so only the blocks
+    # and the final prompt are held rather than every line as its own string
+    if isinstance(transcript, str):
+        return "".join((head, transcript, tail))
+    return "".join([head, *chunk_transcript(transcript, ASSEMBLE_BLOCK_CHARS), tail])
+
+
+def generate_sent_analysis_prompt(transcript:Union[str, Iterable[str]])->str:
     """
     Generate the prompt for the analysis of the transcript
     """
 
-    prompt = f"""
+    head = f"""
 You are an assistant designed to process speech transcripts from recorded videos with timestamps. Speakers may repeat portions of their script; your task is to identify all repeated segments and mark them as "repetition" except for the very last occurrence. Use the rules below to guide your analysis:
 
 RULES:
@@ -13,18 +76,18 @@ RULES:
 4. The repetition status can be flagged per sentence or per partial segment within a sentence:
     - If the entire sentence (or meaning) is repeated earlier, mark it as `"is_entire": true`.
     - If only a part of the sentence is repeated and later completed, mark it as `"is_entire": false`.
-5. Do NOT alter any original timestamps. Return them exactly as provided.
+5. Refer to sentences only by their id. Return the ids exactly as provided.
 6. Analysis must consider the context of the transcript, so even if sentences are slightly modified, treat them as the same if their meaning is essentially identical.
 
 INPUT FORMAT:
-The transcript will be provided as follows:
-Format: start_time end_time text
-{transcript} 
+The transcript will be provided as follows, pause being the silence before the sentence and duration its length, both in centiseconds:
+Format: id pause duration text
+"""
+    tail = f""" 
 
 OUTPUT FORMAT:
 Return a JSON object with a single key "data", which contains an array of objects. Each object should have these keys:
-- "start_time": Timestamp (SS.sss)
-- "end_time": Timestamp (SS.sss)
+- "id": The id of the sentence (integer)
 - "type": Always "repetition"
 - "is_entire": true or false
 
@@ -33,8 +96,8 @@ Only include objects for segments that are repetitions (i.e., all the repeated o
 EXAMPLE:
 
 Transcript:
-0.32 2.26 hi everyone  
-3.4 4.89 hello everyone! Happy to see you all.
+0 32 194 hi everyone
+1 114 149 hello everyone! Happy to see you all.
 
 Analysis:
 - "hi everyone" repeats as part of "hello everyone! Happy to see you all." So the first instance ("hi everyone") is marked as repetition (even though it is shorter, consider it a full repetition if the meaning is repeated).
@@ -42,8 +105,7 @@ Output:
 {{
     "data": [
         {{
-            "start_time": "0.32",
-            "end_time": "2.26",
+            "id": 0,
             "type": "repetition",
             "is_entire": true
         }}
@@ -52,7 +114,7 @@ Output:
 
 Another Example:
 Transcript:
-12.32 16.65 you can you can do it. just do it.
+7 48 433 you can you can do it. just do it.
 
 Analysis:
 - "you can" repeats before being followed by "do it. just do it." only in the beginning.
@@ -64,22 +126,22 @@ Always assume that the LAST occurrence in chronological order is the valid, corr
 Return only the JSON output (as specified in the format) without extra commentary.
 """
 
-    return prompt
+    return _assemble(head, transcript, tail)
 
 
-def generate_word_analysis_prompt(transcript:str,)->str:
+def generate_word_analysis_prompt(transcript:Union[str, Iterable[str]],)->str:
     """
     Generate the prompt for the analysis of the transcript
     """
 
-    prompt = f"""
-Analyze the provided transcript with word-level timestamps. Detect any repeated phrases or word sequences that appear more than once. If repetition is found don't include the last occurrence as there must be at least one instance. Output with the following JSON format:
+    head = f"""
+Analyze the provided transcript, one word per line after its id. Detect any repeated phrases or word sequences that appear more than once. If repetition is found don't include the last occurrence as there must be at least one instance. Output with the following JSON format:
 
 {{
   "data": [
     {{
-      "start_time": "<start_timestamp_of_first_occurrence>",
-      "end_time": "<end_timestamp_of_first_occurrence>",
+      "start_id": <id_of_the_first_word_of_first_occurrence>,
+      "end_id": <id_of_the_last_word_of_first_occurrence>,
       "type": "repetition",
       "is_entire": true
     }}
@@ -87,10 +149,12 @@ Analyze the provided transcript with word-level timestamps. Detect any repeated
 }}
 
 Transcript:
-{transcript}
+"""
+    tail = f"""
 Rules:
 Combine repetitions if they are continuous.
+Words used only as fillers (e.g. "like", "you know", "so") are marked with "type": "filler_words" instead.
 Do not mark the later (last) occurrence(s) of the phrase as repetition.
 Return only the first occurrence of each repeated phrase in the JSON response.
 """
-    return prompt
\ No newline at end of file
+    return _assemble(head, transcript, tail)
\ No newline at end of file
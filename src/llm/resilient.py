@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import random
+from typing import AsyncIterator, Callable, List, Optional
+import litellm
+from src.llm.async_llm import acall_llm, astream_llm, latency_stats
+from src.utils.constants import (
+    LLM_ATTEMPT_TIMEOUT, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_PERCENTILE,
+    LLM_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# errors worth another attempt on the same model, anything else moves on to the next model
+RETRYABLE_ERRORS = (
+    litellm.RateLimitError,
+    litellm.APIConnectionError,
+    litellm.InternalServerError,
+    litellm.ServiceUnavailableError,
+    litellm.BadGatewayError,
+    # a provider timeout derives from openai.APITimeoutError, neither of the others
+    litellm.Timeout,
+    TimeoutError,
+)
+
+
+class AllModelsFailedError(RuntimeError):
+    """Every model of the fallback list failed, `errors` holds the last error of each"""
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        details = "; ".join(f"{model}: {type(error).__name__}: {error}" for model, error in errors.items())
+        super().__init__(f"All models failed: {details}")
+
+
+class EmptyResponseError(RuntimeError):
+    pass
+
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE, maximum: float = LLM_BACKOFF_MAX) -> float:
+    """Full jitter: a random delay up to base * 2^attempt, capped at maximum"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+async def _attempt(prompt: str, model: str, timeout: float, call: Callable, **kwargs) -> str:
+    content = await call(prompt, model=model, timeout=timeout, **kwargs)
+    if not content:
+        raise EmptyResponseError(f"{model} returned an empty answer")
+    return content
+
+
+async def _hedged(prompt: str, model: str, timeout: float, hedge_percentile: Optional[float],
+                  hedge_min_samples: int, call: Callable, **kwargs) -> str:
+    """
+    One attempt on the model. When the request is slower than the model's
+    hedge_percentile latency a second identical request is sent, the first
+    answer wins and the other request is cancelled.
+    """
+    first = asyncio.ensure_future(_attempt(prompt, model, timeout, call, **kwargs))
+    delay = None
+    if hedge_percentile is not None:
+        delay = latency_stats.percentile(model, hedge_percentile, hedge_min_samples)
+    if delay is None:
+        return await first
+
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            logger.debug(f"Hedging {model} after {delay:.2f}s")
+            pending.add(asyncio.ensure_future(_attempt(prompt, model, timeout, call, **kwargs)))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def acall_resilient(prompt: str, models: List[str], retries: int = LLM_RETRIES,
+                          attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                          backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                          hedge_percentile: Optional[float] = LLM_HEDGE_PERCENTILE,
+                          hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                          model_options: Optional[dict] = None, call: Callable = acall_llm, **kwargs) -> str:
+    """
+    Send the prompt to the models in order and return the first answer. Each
+    model gets `retries` attempts of at most attempt_timeout seconds with
+    jittered exponential backoff between them; errors that another attempt
+    cannot fix (bad request, auth, unknown model) skip to the next model
+    straight away. model_options maps a model to extra arguments of its
+    requests, e.g. its api_key. Raises AllModelsFailedError when no model answered.
+    """
+    if not models:
+        raise ValueError("No models to call")
+    # retries are counted here, the provider client must not retry on its own
+    kwargs.setdefault("max_retries", 0)
+
+    errors = {}
+    for model in models:
+        model_kwargs = {**kwargs, **(model_options or {}).get(model, {})}
+
+        for attempt in range(max(1, retries)):
+            try:
+                return await _hedged(prompt, model, attempt_timeout, hedge_percentile, hedge_min_samples, call,
+                                     **model_kwargs)
+            except (*RETRYABLE_ERRORS, EmptyResponseError) as e:
+                errors[model] = e
+                if attempt + 1 < retries:
+                    delay = backoff_delay(attempt, backoff_base, backoff_max)
+                    logger.warning(f"{model} attempt {attempt + 1}/{retries} failed ({type(e).__name__}), "
+                                   f"retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                errors[model] = e
+                logger.warning(f"{model} failed ({type(e).__name__}), not retrying")
+                break
+        logger.warning(f"{model} gave no answer, trying the next model")
+
+    raise AllModelsFailedError(errors)
+
+
+async def astream_resilient(prompt: str, models: List[str], retries: int = LLM_RETRIES,
+                            attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                            backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                            model_options: Optional[dict] = None, stream: Callable = astream_llm,
+                            **kwargs) -> AsyncIterator[str]:
+    """
+    Streaming acall_resilient: yields the text of the first model that starts
+    answering. Attempts are retried and models tried in order as long as
+    nothing was yielded; an error after that is raised to the caller, which
+    has already used part of the answer. Streams are not hedged.
+    """
+    if not models:
+        raise ValueError("No models to call")
+    kwargs.setdefault("max_retries", 0)
+
+    errors = {}
+    for model in models:
+        model_kwargs = {**kwargs, **(model_options or {}).get(model, {})}
+
+        for attempt in range(max(1, retries)):
+            started = False
+            try:
+                async for text in stream(prompt, model=model, timeout=attempt_timeout, **model_kwargs):
+                    started = True
+                    yield text
+                if not started:
+                    raise EmptyResponseError(f"{model} returned an empty answer")
+                return
+            except (*RETRYABLE_ERRORS, EmptyResponseError) as e:
+                if started:
+                    raise
+                errors[model] = e
+                if attempt + 1 < retries:
+                    delay = backoff_delay(attempt, backoff_base, backoff_max)
+                    logger.warning(f"{model} stream attempt {attempt + 1}/{retries} failed ({type(e).__name__}), "
+                                   f"retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                if started:
+                    raise
+                errors[model] = e
+                logger.warning(f"{model} stream failed ({type(e).__name__}), not retrying")
+                break
+        logger.warning(f"{model} gave no answer, trying the next model")
+
+    raise AllModelsFailedError(errors)
+
+
+# retries, fallback, timeouts and hedging against a local fake provider
+# usage: python -m src.llm.resilient
+if __name__ == "__main__":
+    import time
+    from src.llm.async_llm import aclose
+    from src.llm.fake_provider import FakeModel, FakeProvider
+    from src.utils.constants import LLM_MODEL_RATE_LIMITS
+
+    logging.basicConfig(level=logging.ERROR)
+    litellm.suppress_debug_info = True
+    random.seed(7)
+
+    def tail_latency() -> float:
+        # most answers are quick, one in ten is stuck behind a slow replica
+        return 1.0 if random.random() < 0.1 else random.uniform(0.03, 0.06)
+
+    fake = {
+        "broken": FakeModel(fail_rate=1.0),
+        "flaky": FakeModel(fail_rate=0.3, fail_status=503),
+        "hanging": FakeModel(latency=(3.0, 3.0)),
+        "stalled": FakeModel(latency=(3.0, 3.0)),
+        "good": FakeModel(answer=lambda prompt: '{"data": ["good"]}', latency=(0.01, 0.02)),
+        "tail": FakeModel(latency=tail_latency),
+    }
+    for name in fake:
+        LLM_MODEL_RATE_LIMITS[f"openai/{name}"] = 60_000
+    LLM_MODEL_RATE_LIMITS["openai/missing"] = 60_000
+
+    with FakeProvider(fake) as provider:
+        options = {"api_key": "fake", "api_base": provider.api_base, "backoff_base": 0.01}
+
+        async def main():
+            # a failing model is retried, then the next model answers
+            answer = await acall_resilient("prompt", ["openai/broken", "openai/good"], retries=3, **options)
+            assert answer == '{"data": ["good"]}' and fake["broken"].requests == 3, "no fallback after the retries"
+
+            # the same for a streamed answer
+            parts = [text async for text in astream_resilient("prompt", ["openai/broken", "openai/good"], **options)]
+            assert "".join(parts) == '{"data": ["good"]}' and fake["broken"].requests == 6, "stream did not fall back"
+
+            # an unknown model is not retried
+            answer = await acall_resilient("prompt", ["openai/missing", "openai/good"], **options)
+            assert answer == '{"data": ["good"]}', "no fallback after a 404"
+
+            # 30% of requests fail, eight attempts get every call through
+            answers = await asyncio.gather(*(acall_resilient(f"prompt {i}", ["openai/flaky"], retries=8, **options)
+                                             for i in range(30)))
+            assert all(answers), "flaky model calls failed"
+            print(f"flaky: 30/30 answered with {fake['flaky'].requests} requests, {fake['flaky'].failed} failed")
+
+            # a hanging model is abandoned after the attempt timeout
+            start = time.monotonic()
+            answer = await acall_resilient("prompt", ["openai/hanging", "openai/good"], retries=1,
+                                           attempt_timeout=0.3, **options)
+            elapsed = time.monotonic() - start
+            assert answer == '{"data": ["good"]}' and elapsed < 1.5, f"attempt timeout not enforced ({elapsed:.2f}s)"
+            print(f"timeout: hanging model abandoned, answered by the fallback in {elapsed:.2f}s")
+
+            # a timeout raised by the provider client is retried like any transient error
+            async def provider_timeout(prompt: str, model: str, timeout: float, **kwargs) -> str:
+                response = await litellm.acompletion(model=model, messages=[{"role": "user", "content": prompt}],
+                                                     timeout=timeout, **kwargs)
+                return response["choices"][0]["message"]["content"]
+
+            try:
+                await acall_resilient("prompt", ["openai/stalled"], retries=3, attempt_timeout=0.2,
+                                      call=provider_timeout, **options)
+                raise AssertionError("stalled model answered")
+            except AllModelsFailedError as e:
+                assert isinstance(e.errors["openai/stalled"], litellm.Timeout), e.errors
+            assert fake["stalled"].requests == 3, f"litellm.Timeout not retried ({fake['stalled'].requests} requests)"
+            print("timeout: litellm.Timeout retried 3 times")
+
+            # tail latency with and without hedging, the first 20 requests warm the histogram
+            for hedge in (None, 0.8):
+                latencies = []
+                for i in range(120):
+                    start = time.monotonic()
+                    await acall_resilient(f"prompt {i}", ["openai/tail"], hedge_percentile=hedge, **options)
+                    latencies.append(time.monotonic() - start)
+                latencies = sorted(latencies[20:])
+                p50, p95 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+                label = "hedged" if hedge else "plain"
+                print(f"{label:>6}: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+                if hedge:
+                    assert p95 < 0.5, "hedging did not cut the tail"
+            await aclose()
+
+        asyncio.run(main())
+
+    for model, report in latency_stats.report().items():
+        print(model, report)
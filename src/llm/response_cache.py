@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional
+from src.llm.prompt import PROMPT_VERSION
+from src.utils.constants import LLM_CACHE_DIR, LLM_CACHE_MAX_MB, LLM_CACHE_TTL
+from src.utils.disk_cache import cache_usage, evict_lru, write_atomic
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+
+
+def response_key(model: str, prompt: str, version: int = PROMPT_VERSION) -> str:
+    digest = hashlib.sha256(f"{model}\n{version}\n".encode())
+    digest.update(prompt.encode())
+    return digest.hexdigest()
+
+
+def _cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _stats[name] += n
+
+
+def get_response(model: str, prompt: str, cache_dir: str = LLM_CACHE_DIR, ttl: float = LLM_CACHE_TTL) -> Optional[str]:
+    """Get the cached answer to the prompt, None when missing or older than ttl seconds"""
+    path = _cache_path(response_key(model, prompt), cache_dir)
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        _count("misses")
+        return None
+
+    if time.time() - entry.get('created', 0) > ttl:
+        _count("expired")
+        _count("misses")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+
+    os.utime(path)
+    _count("hits")
+    return entry['response']
+
+
+def put_response(model: str, prompt: str, response: str, cache_dir: str = LLM_CACHE_DIR,
+                 max_mb: float = LLM_CACHE_MAX_MB):
+    """Store the answer and evict the least recently used answers above max_mb"""
+    entry = {"model": model, "version": PROMPT_VERSION, "created": time.time(), "response": response}
+    size = write_atomic(_cache_path(response_key(model, prompt), cache_dir), json.dumps(entry))
+    _count("writes")
+    with _lock:
+        _stats["evictions"] += evict_lru(cache_dir, int(max_mb * 1024 * 1024), size)
+
+
+def cache_stats(cache_dir: str = LLM_CACHE_DIR) -> dict:
+    """Hit and miss counters of this process plus the current size of the cache"""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    stats['entries'], size = cache_usage(cache_dir)
+    stats['size_mb'] = round(size / 1024 ** 2, 2)
+    return stats
+
+
+# check keys, TTL, eviction and counters
+# usage: python -m src.llm.response_cache
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        prompt = "0.48 7.12 you can undo you can undo\n"
+        assert response_key("a", prompt) != response_key("b", prompt)
+        assert response_key("a", prompt) != response_key("a", prompt, version=PROMPT_VERSION + 1)
+
+        assert get_response("model", prompt, cache_dir) is None
+        put_response("model", prompt, '{"data": []}', cache_dir)
+        assert get_response("model", prompt, cache_dir) == '{"data": []}'
+        assert get_response("model", prompt, cache_dir, ttl=-1) is None, "expired answer returned"
+        assert get_response("model", prompt, cache_dir) is None, "expired answer kept"
+
+        # 30 answers of ~50 KB in a 0.5 MB cache
+        for i in range(30):
+            put_response("model", f"prompt {i}", "x" * 50_000, cache_dir, max_mb=0.5)
+            time.sleep(0.01)
+        assert get_response("model", "prompt 29", cache_dir) is not None
+        assert get_response("model", "prompt 0", cache_dir) is None
+
+        stats = cache_stats(cache_dir)
+        print(stats)
+        assert stats['hits'] == 2 and stats['expired'] == 1 and stats['evictions'] > 0
+        assert stats['size_mb'] <= 0.5
+
+    # a put below the size limit does not walk the cache, however many entries it holds
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for n in (1000, 4000):
+            for i in range(n - cache_usage(cache_dir)[0]):
+                put_response("model", f"fill {n} {i}", "x" * 100, cache_dir)
+            start = time.perf_counter()
+            for i in range(200):
+                put_response("model", f"timed {n} {i}", "x" * 100, cache_dir)
+            print(f"{n} entries: {(time.perf_counter() - start) / 200 * 1e6:.0f} us per put")
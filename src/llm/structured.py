@@ -0,0 +1,42 @@
+import litellm
+from src.models.invalid_model import InvalidModel
+
+# how the items of an answer refer to the transcript, see the prompts
+SENT_ITEM_REFERENCE = {"id": {"type": "integer"}}
+WORD_ITEM_REFERENCE = {"start_id": {"type": "integer"}, "end_id": {"type": "integer"}}
+
+
+def invalids_schema(reference: dict) -> dict:
+    """
+    JSON schema of the analysis answer, {"data": [item, ...]} where an item
+    holds the `reference` properties plus the InvalidModel fields other than
+    the times, without titles and defaults
+    """
+    properties = dict(reference)
+    for name, field in InvalidModel.model_json_schema()['properties'].items():
+        if name not in ("start_time", "end_time"):
+            properties[name] = {key: value for key, value in field.items() if key not in ("title", "default")}
+    item = {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+    return {
+        "type": "object",
+        "properties": {"data": {"type": "array", "items": item}},
+        "required": ["data"],
+        "additionalProperties": False,
+    }
+
+
+def invalids_response_format(reference: dict) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "invalids", "schema": invalids_schema(reference), "strict": True},
+    }
+
+
+def supports_structured_output(model: str) -> bool:
+    """Whether litellm can pass a JSON schema for the answers of the model"""
+    try:
+        if litellm.supports_response_schema(model=model):
+            return True
+        return "response_format" in (litellm.get_supported_openai_params(model=model) or [])
+    except Exception:
+        return False
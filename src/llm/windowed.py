@@ -0,0 +1,209 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Iterable, List, Optional, Union
+from src.llm.llm import allm_call_analyse_sent, llm_call_analyse_sent, sent_analysis_models
+from src.llm.prompt import count_tokens, generate_sent_analysis_prompt
+from src.models.invalid_model import InvalidModel
+from src.utils.constants import LLM_CONCURRENCY, SENT_WINDOW_OVERLAP_TOKENS, SENT_WINDOW_TOKENS
+from src.utils.json_parser import llm_invalids_parser
+from src.utils.transcript_format import TranscriptLookup, iter_compact_transcript_sent
+
+
+def plan_windows(lines: List[str], max_tokens: int, overlap_tokens: int, model: str) -> List[tuple]:
+    """
+    Split the transcript lines into (lo, hi) windows of at most max_tokens
+    tokens of the model each. Every window starts with the last
+    overlap_tokens of the previous one so a repetition across the cut is
+    seen whole by one of them.
+    """
+    tokens = [count_tokens(line, model) for line in lines]
+    windows = []
+    lo = 0
+    while lo < len(lines):
+        hi = lo
+        size = 0
+        while hi < len(lines) and (hi == lo or size + tokens[hi] <= max_tokens):
+            size += tokens[hi]
+            hi += 1
+        windows.append((lo, hi))
+        if hi == len(lines):
+            break
+
+        # step back over the overlap, always moving forward by at least one line
+        next_lo = hi
+        overlap = 0
+        while next_lo - 1 > lo and overlap + tokens[next_lo - 1] <= overlap_tokens:
+            next_lo -= 1
+            overlap += tokens[next_lo]
+        lo = next_lo
+    return windows
+
+
+def _interval(item: dict) -> tuple:
+    return float(item['start_time']), float(item['end_time'])
+
+
+def merge_invalids(results: List[List[dict]]) -> List[dict]:
+    """
+    Merge the invalids found by every window, sorted by start time. An
+    invalid flagged by two overlapping windows, or lying inside another one
+    of the same kind, is kept once. When the windows disagree on is_entire
+    the partial flag wins so the word analysis still checks the sentence.
+    """
+    items = sorted((item for result in results for item in result), key=lambda item: (_interval(item)[0], -_interval(item)[1]))
+
+    merged = []
+    for item in items:
+        start, end = _interval(item)
+        duplicate = None
+        for kept in reversed(merged):
+            kept_start, kept_end = _interval(kept)
+            if kept_end < start:
+                break
+            if kept.get('type') == item.get('type') and kept_start <= start and end <= kept_end:
+                duplicate = kept
+                break
+        if duplicate is None:
+            merged.append(dict(item))
+        elif _interval(duplicate) == (start, end) and not item.get('is_entire', True):
+            duplicate['is_entire'] = False
+    return merged
+
+
+def _plan(transcript: dict, max_tokens: int, overlap_tokens: int) -> tuple:
+    # the prompt template takes its share of the budget, the transcript lines get the rest
+    model = sent_analysis_models()[0]
+    lines = list(iter_compact_transcript_sent(transcript))
+    budget = max(1, max_tokens - count_tokens(generate_sent_analysis_prompt(""), model))
+    return lines, plan_windows(lines, budget, overlap_tokens, model)
+
+
+def analyse_sent_windowed(transcript: dict,
+                          llm_call: Callable[[Union[str, Iterable[str]]], str] = llm_call_analyse_sent,
+                          max_tokens: int = SENT_WINDOW_TOKENS, overlap_tokens: int = SENT_WINDOW_OVERLAP_TOKENS,
+                          workers: int = LLM_CONCURRENCY) -> dict:
+    """
+    Sentence analysis of the transcript in overlapping windows that fit
+    max_tokens of prompt, with at most `workers` LLM calls at a time.
+    A transcript that fits one window is sent as a single call like before.
+    Returns the merged {"data": [...]} analysis.
+    """
+    lines, windows = _plan(transcript, max_tokens, overlap_tokens)
+    resolve = TranscriptLookup(transcript).resolve
+    if len(windows) <= 1:
+        return llm_invalids_parser(llm_call(lines), resolve)
+
+    print(f"[DEBUG] Sentence analysis of {len(lines)} sentences in {len(windows)} windows")
+
+    def analyse(window: tuple) -> List[dict]:
+        lo, hi = window
+        return llm_invalids_parser(llm_call(lines[lo:hi]), resolve).get('data', [])
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(analyse, windows))
+
+    return {"data": merge_invalids(results)}
+
+
+async def aanalyse_sent_windowed(transcript: dict,
+                                 llm_call: Callable[..., Awaitable[str]] = allm_call_analyse_sent,
+                                 max_tokens: int = SENT_WINDOW_TOKENS,
+                                 overlap_tokens: int = SENT_WINDOW_OVERLAP_TOKENS,
+                                 on_invalid: Optional[Callable[[InvalidModel], None]] = None) -> dict:
+    """
+    Async analyse_sent_windowed, the windows wait on the limits of the async
+    LLM client. With on_invalid the answers are streamed and each invalid is
+    passed to it as it arrives, before the windows are merged, so an invalid
+    in an overlap may come once per window.
+    """
+    lines, windows = _plan(transcript, max_tokens, overlap_tokens)
+    resolve = TranscriptLookup(transcript).resolve
+    options = {} if on_invalid is None else {"on_invalid": on_invalid, "resolve": resolve}
+    if len(windows) <= 1:
+        return llm_invalids_parser(await llm_call(lines, **options), resolve)
+
+    print(f"[DEBUG] Sentence analysis of {len(lines)} sentences in {len(windows)} windows")
+
+    async def analyse(window: tuple) -> List[dict]:
+        lo, hi = window
+        return llm_invalids_parser(await llm_call(lines[lo:hi], **options), resolve).get('data', [])
+
+    results = await asyncio.gather(*(analyse(window) for window in windows))
+    return {"data": merge_invalids(results)}
+
+
+# check the windowing, merge and ordering with a fake LLM
+# usage: python -m src.llm.windowed
+if __name__ == "__main__":
+    import re
+    import json
+    import time
+    import random
+    import threading
+
+    SENTENCE = re.compile(r"^(\d+) (\d+) (\d+) (.*)$")
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_llm(transcript: Union[str, Iterable[str]]) -> str:
+        """Flag every sentence whose text comes again later in the prompt, like the real prompt asks"""
+        prompt = generate_sent_analysis_prompt(transcript)
+        body = prompt.split("Format: id pause duration text\n", 1)[1].split(" \n\nOUTPUT FORMAT", 1)[0]
+        sentences = [SENTENCE.match(line).group(1, 4) for line in body.splitlines() if SENTENCE.match(line)]
+
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(random.uniform(0.01, 0.05))
+        with lock:
+            active.pop()
+
+        data = []
+        for i, (sentence_id, text) in enumerate(sentences):
+            if any(later == text for _, later in sentences[i + 1:]):
+                data.append({"id": int(sentence_id), "type": "repetition", "is_entire": True})
+        # answers come back in any order and wrapped in markdown like real models do
+        random.shuffle(data)
+        return "```json\n" + json.dumps({"data": data}) + "\n```"
+
+    random.seed(3)
+    sentences = []
+    t = 0.0
+    for i in range(2000):
+        # retakes: a sentence is sometimes said again a few sentences later
+        text = f"sentence number {i} about the video editor"
+        if sentences and random.random() < 0.1:
+            text = random.choice(sentences[-4:])['text']
+        sentences.append({"text": text, "start": round(t, 2), "end": round(t + 3.0, 2)})
+        t += 3.5
+    transcript = {"results": {"channels": [{"alternatives": [{"paragraphs": {"paragraphs": [{"sentences": sentences}]}}]}]}}
+
+    expected = llm_invalids_parser(fake_llm(iter_compact_transcript_sent(transcript)), TranscriptLookup(transcript).resolve)['data']
+    expected.sort(key=lambda item: float(item['start_time']))
+
+    start = time.time()
+    result = analyse_sent_windowed(transcript, llm_call=fake_llm, max_tokens=3000, overlap_tokens=300, workers=3)['data']
+    print(f"windowed: {time.time() - start:.2f} seconds, {len(result)} repetitions, at most {max(peak)} calls at once")
+
+    assert max(peak) <= 3, "too many concurrent calls"
+    assert [float(item['start_time']) for item in result] == sorted(float(item['start_time']) for item in result), "not sorted"
+    assert len({(item['start_time'], item['end_time']) for item in result}) == len(result), "duplicate invalids"
+    assert result == expected, "windowed analysis differs from the single call"
+
+    async def afake_llm(transcript):
+        return await asyncio.to_thread(fake_llm, transcript)
+
+    result = asyncio.run(aanalyse_sent_windowed(transcript, llm_call=afake_llm, max_tokens=3000, overlap_tokens=300))['data']
+    assert result == expected, "async windowed analysis differs from the single call"
+
+    windows = plan_windows([f"{i}\n" * 40 for i in range(100)], 500, 100, "gemini/gemini-1.5-flash")
+    assert windows[0][0] == 0 and windows[-1][1] == 100
+    assert all(b[0] < a[1] and b[0] > a[0] for a, b in zip(windows, windows[1:])), "windows do not overlap and advance"
+
+    assert merge_invalids([
+        [{"start_time": "1.00", "end_time": "2.00", "type": "repetition", "is_entire": True}],
+        [{"start_time": "1.00", "end_time": "2.00", "type": "repetition", "is_entire": False},
+         {"start_time": "1.20", "end_time": "1.80", "type": "repetition", "is_entire": True}],
+    ]) == [{"start_time": "1.00", "end_time": "2.00", "type": "repetition", "is_entire": False}]
+    print("windows, merge and ordering match the single call")
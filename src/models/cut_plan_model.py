@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import List, Literal, Tuple
+
+
+class CutPlanModel(BaseModel):
+    # "filtergraph": one trim/atrim branch per segment joined by concat,
+    # "select": a single select/aselect expression over the whole input,
+    # "hierarchical": batches of segments encoded to lossless files, then joined
+    strategy: Literal["filtergraph", "select", "hierarchical"] = "filtergraph"
+    segments: List[Tuple[float, float]] = []
+    # cuts dropped for being shorter than the minimum
+    dropped_cuts: int = 0
+    # filters in the graph (of the largest batch), including the split ffmpeg inserts for a reused input
+    nodes: int = 0
+    kept_duration: float = 0.0
+    # frame rate of the input, the select boundaries are moved onto its frame grid
+    fps: float = 30.0
+    # estimated CPU seconds of the encode
+    predicted_seconds: float = 0.0
+
+    def to_dict(self):
+        return self.model_dump()
@@ -12,7 +12,8 @@ class InvalidModel(BaseModel):
     
     @classmethod
     def from_dict(cls, data):
-        data['start_time'] = float(data['start_time']) - 0.09
+        # times are kept as found, the cut padding is added when the trim is planned
+        data['start_time'] = float(data['start_time'])
         data['end_time'] = float(data['end_time'])
         data['is_entire'] = data.get('is_entire', True)
         return cls(**data)
@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class StreamInfoModel(BaseModel):
+    index: int
+    codec_type: str
+    codec_name: Optional[str] = None
+    profile: Optional[str] = None
+    # video
+    pix_fmt: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    # audio
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    channel_layout: Optional[str] = None
+
+
+class MediaInfoModel(BaseModel):
+    # cache key
+    size: int
+    mtime_ns: int
+    content_hash: str
+
+    duration: float
+    start_time: float = 0.0
+    format_name: Optional[str] = None
+    streams: List[StreamInfoModel] = []
+    # presentation times of the first video stream, relative to start_time
+    video_packets: Optional[List[float]] = None
+    keyframes: Optional[List[float]] = None
+
+    @property
+    def video_stream(self) -> Optional[StreamInfoModel]:
+        return next((s for s in self.streams if s.codec_type == "video"), None)
+
+    @property
+    def audio_stream(self) -> Optional[StreamInfoModel]:
+        return next((s for s in self.streams if s.codec_type == "audio"), None)
+
+    def to_dict(self):
+        return self.model_dump()
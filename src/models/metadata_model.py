@@ -13,6 +13,7 @@ class MetadataModel(BaseModel):
     file_extension: str
     output_name: str = "output"
     status:ProjectStatus = ProjectStatus.CREATED
+    progress: dict | None = None
 
     def to_dict(self):
         return self.model_dump()
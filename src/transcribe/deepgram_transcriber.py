@@ -1,30 +1,33 @@
+from typing import Optional
+from src.utils.constants import DEEPGRAM_FILLER_WORDS, DEEPGRAM_MODEL
 from deepgram import (
     DeepgramClient,
+    DeepgramClientOptions,
     PrerecordedOptions,
     FileSource,
 )
-def deepgram_transcribe(audio_path: str, model: str = "nova-3", timeout: int = 120):
+def deepgram_transcribe(audio_path: str, model: str = DEEPGRAM_MODEL, timeout: int = 120, url: Optional[str] = None,
+                        filler_words: bool = DEEPGRAM_FILLER_WORDS):
     try:
         # STEP 1 Create a Deepgram client using the API key
-        deepgram = DeepgramClient()
-
-        with open(audio_path, "rb") as file:
-            buffer_data = file.read()
-
-        payload: FileSource = {
-            "buffer": buffer_data,
-        }
+        # url points the client at another endpoint (on-prem or a local stand-in)
+        deepgram = DeepgramClient(config=DeepgramClientOptions(url=url)) if url else DeepgramClient()
 
         #STEP 2: Configure Deepgram options for audio analysis
         options = PrerecordedOptions(
             model=model,
             smart_format=True,
+            filler_words=filler_words,
         )
 
-        # STEP 3: Call the transcribe_file method with the text payload and options
-        # Added timeout parameter to the API call
+        # STEP 3: Call the transcribe_file method with the file stream and options
+        # the file is streamed from disk in chunks so memory stays bounded for any input size
         print("we have started the transcription")
-        response = deepgram.listen.rest.v("1").transcribe_file(payload, options, timeout=timeout)
+        with open(audio_path, "rb") as file:
+            payload: FileSource = {
+                "stream": file,
+            }
+            response = deepgram.listen.rest.v("1").transcribe_file(payload, options, timeout=timeout)
         print("we have finished the transcription")
         # print("response: ", response)
 
@@ -36,4 +39,60 @@ def deepgram_transcribe(audio_path: str, model: str = "nova-3", timeout: int = 1
         return None
     except Exception as e:
         print(f"Exception: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+# check memory stays bounded while uploading a multi-GB file to a local stand-in server
+# usage: python -m src.transcribe.deepgram_transcriber [size_gb]
+if __name__ == "__main__":
+    import os
+    import sys
+    import json
+    import resource
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    size_gb = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    rss_ceiling_mb = 256
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            remaining = int(self.headers.get("Content-Length", 0))
+            received = 0
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                received += len(chunk)
+                remaining -= len(chunk)
+            body = json.dumps({
+                "metadata": {"request_id": "local", "duration": 0.0, "channels": 1},
+                "results": {"channels": [{"alternatives": [{"transcript": f"{received} bytes", "confidence": 1.0, "words": []}]}]},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.setdefault("DEEPGRAM_API_KEY", "local-test")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # sparse file, takes no disk space but is read in full
+        audio_path = os.path.join(tmpdir, "large.ogg")
+        with open(audio_path, "wb") as f:
+            f.truncate(int(size_gb * 1024 ** 3))
+
+        result = deepgram_transcribe(audio_path, timeout=600, url=f"http://127.0.0.1:{server.server_port}")
+        server.shutdown()
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.loads(result)["results"]["channels"][0]["alternatives"][0]["transcript"])
+    print(f"peak RSS {peak_mb:.0f} MB for a {size_gb:.1f} GB upload")
+    assert peak_mb < rss_ceiling_mb, f"peak RSS {peak_mb:.0f} MB exceeds {rss_ceiling_mb} MB"
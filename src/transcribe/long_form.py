@@ -0,0 +1,359 @@
+import os
+import re
+import bisect
+import json
+import time
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from src.transcribe.deepgram_transcriber import deepgram_transcribe
+from src.transcribe.whisper_transcriber import whisper_transcribe
+from src.utils.audio_extract import AUDIO_FORMATS
+from src.utils.constants import (
+    AUDIO_CODEC, DEEPGRAM_FILLER_WORDS, DEEPGRAM_MODEL, LONG_FORM_CHUNK_DURATION, LONG_FORM_OVERLAP,
+    LONG_FORM_RETRIES, LONG_FORM_THRESHOLD, LONG_FORM_WORKERS, TRANSCRIBER, WHISPER_MODEL,
+)
+from src.utils.ffmpeg_runner import run_ffmpeg
+from src.utils.media_probe import probe_media
+from src.utils.transcript_cache import audio_hash, cache_key, get_transcript, put_transcript
+
+# finished chunk transcripts are kept here inside cache_dir so a restarted job resumes
+CHUNKS_DIR = "transcript_chunks"
+
+# seconds waited before the first retry of a chunk, doubled on every attempt
+RETRY_DELAY = 2.0
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+def find_silences(audio_path: str, noise: str = "-35dB", min_duration: float = 0.3) -> List[tuple]:
+    """Get the (start, end) silences of the audio using ffmpeg silencedetect"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-hide_banner",
+        "-i", audio_path,
+        "-af", f"silencedetect=noise={noise}:d={min_duration}",
+        "-f", "null", "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    if start is not None:
+        silences.append((start, probe_media(audio_path).duration))
+    return silences
+
+
+def plan_chunks(duration: float, silences: List[tuple], chunk_duration: float = LONG_FORM_CHUNK_DURATION) -> List[tuple]:
+    """
+    Split [0, duration] into (start, end) ranges of about chunk_duration each.
+    Every boundary is put in the middle of the silence closest to the target,
+    searched within a quarter chunk either side, so no word is cut in half.
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    window = chunk_duration / 4
+
+    boundaries = [0.0]
+    while duration - boundaries[-1] > chunk_duration + window:
+        target = boundaries[-1] + chunk_duration
+        candidates = [m for m in midpoints if abs(m - target) <= window]
+        boundaries.append(min(candidates, key=lambda m: abs(m - target)) if candidates else target)
+    boundaries.append(duration)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _cut_chunk(audio_path: str, start: float, end: float, output_path: str):
+    # decode and re-encode so the chunk starts exactly at start, audio encodes fast
+    _, encoder = AUDIO_FORMATS[AUDIO_CODEC]
+    cmd = [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{start:.3f}",
+        "-t", f"{end - start:.3f}",
+        "-i", audio_path,
+        "-vn",
+    ] + encoder + [output_path]
+    run_ffmpeg(cmd)
+
+
+def _transcribe_chunk(index: int, audio_path: str, span: tuple, overlap: float, duration: float, work_dir: str,
+                      transcribe_fn: Callable[[str], Optional[str]], retries: int, retry_delay: float) -> dict:
+    """Cut and transcribe one chunk, retrying only this chunk on failure"""
+    start = max(0.0, span[0] - overlap)
+    end = min(duration, span[1] + overlap)
+    result_path = os.path.join(work_dir, f"chunk_{index:04d}_{start:.3f}_{end:.3f}.json")
+    if os.path.exists(result_path):
+        with open(result_path, "r") as f:
+            return {"offset": start, "transcript": json.load(f)}
+
+    file_name, _ = AUDIO_FORMATS[AUDIO_CODEC]
+    chunk_path = os.path.join(work_dir, f"chunk_{index:04d}_{file_name}")
+    _cut_chunk(audio_path, start, end, chunk_path)
+
+    try:
+        for attempt in range(retries + 1):
+            try:
+                transcription = transcribe_fn(chunk_path)
+                if transcription:
+                    transcript = json.loads(transcription)
+                    break
+                logging.warning(f"Chunk {index} ({start:.1f}-{end:.1f}s) returned no transcription")
+            except Exception as e:
+                logging.warning(f"Chunk {index} ({start:.1f}-{end:.1f}s) failed: {e}")
+            if attempt < retries:
+                time.sleep(retry_delay * 2 ** attempt)
+        else:
+            raise RuntimeError(f"Chunk {index} ({start:.1f}-{end:.1f}s) failed after {retries + 1} attempts")
+    finally:
+        os.remove(chunk_path)
+
+    # write then rename so an interrupted job never leaves a truncated chunk
+    with open(result_path + ".tmp", "w") as f:
+        json.dump(transcript, f)
+    os.replace(result_path + ".tmp", result_path)
+    return {"offset": start, "transcript": transcript}
+
+
+def _shift(item: dict, offset: float) -> dict:
+    item = dict(item)
+    item['start'] = round(item['start'] + offset, 3)
+    item['end'] = round(item['end'] + offset, 3)
+    return item
+
+
+def _midpoint(item: dict) -> float:
+    return (item['start'] + item['end']) / 2
+
+
+def _owns(item: dict, span: tuple, is_last: bool) -> bool:
+    # an item belongs to the chunk whose own range holds its midpoint, this drops the overlap duplicates
+    midpoint = _midpoint(item)
+    return span[0] <= midpoint and (midpoint < span[1] or is_last)
+
+
+def _clip_sentence(sent: dict, words: List[dict], midpoints: List[float], owned: List[bool],
+                   span: tuple, is_last: bool) -> Optional[dict]:
+    """Cut a sentence down to the words kept from its chunk, rebuilding the text when it straddles the boundary"""
+    lo = bisect.bisect_left(midpoints, sent['start'])
+    hi = bisect.bisect_right(midpoints, sent['end'])
+    inside = range(lo, hi)
+    kept = [i for i in inside if owned[i]]
+    if not inside:
+        return sent if _owns(sent, span, is_last) else None
+    if len(kept) == len(inside):
+        return sent
+    if not kept:
+        return None
+    sent = dict(sent)
+    sent['start'] = words[kept[0]]['start']
+    sent['end'] = words[kept[-1]]['end']
+    sent['text'] = " ".join(words[i].get('punctuated_word', words[i]['word']) for i in kept)
+    return sent
+
+
+def stitch_transcripts(results: List[dict], spans: List[tuple], duration: float) -> dict:
+    """
+    Merge the chunk transcripts into one Deepgram shaped transcript. Words are
+    shifted by the chunk offset and only kept by the chunk whose own span holds
+    them. Sentences keep the words their chunk kept, so a sentence across a
+    boundary is split between the two chunks instead of repeated.
+    """
+    words = []
+    paragraphs = []
+    for i, (result, span) in enumerate(zip(results, spans)):
+        is_last = i == len(spans) - 1
+        offset = result['offset']
+        alternative = result['transcript']['results']['channels'][0]['alternatives'][0]
+
+        chunk_words = sorted((_shift(word, offset) for word in alternative.get('words', [])), key=_midpoint)
+        midpoints = [_midpoint(word) for word in chunk_words]
+        owned = [_owns(word, span, is_last) for word in chunk_words]
+        # a word heard twice around the boundary is kept once
+        last_end = words[-1]['end'] if words else float("-inf")
+        owned = [own and mid >= last_end for own, mid in zip(owned, midpoints)]
+        words.extend(word for word, own in zip(chunk_words, owned) if own)
+
+        for para in alternative.get('paragraphs', {}).get('paragraphs', []):
+            sentences = [_shift(sent, offset) for sent in para.get('sentences', [])]
+            sentences = [_clip_sentence(sent, chunk_words, midpoints, owned, span, is_last) for sent in sentences]
+            sentences = [sent for sent in sentences if sent is not None]
+            if not sentences:
+                continue
+            para = dict(para)
+            para['sentences'] = sentences
+            para['start'] = sentences[0]['start']
+            para['end'] = sentences[-1]['end']
+            para['num_words'] = sum(len(sent['text'].split()) for sent in sentences)
+            paragraphs.append(para)
+
+    confidence = sum(word.get('confidence', 0.0) for word in words) / len(words) if words else 0.0
+    metadata = dict(results[0]['transcript'].get('metadata', {})) if results else {}
+    metadata['duration'] = duration
+
+    return {
+        "metadata": metadata,
+        "results": {
+            "channels": [{
+                "alternatives": [{
+                    "transcript": " ".join(word.get('punctuated_word', word['word']) for word in words),
+                    "confidence": confidence,
+                    "words": words,
+                    "paragraphs": {
+                        "transcript": "\n\n".join(" ".join(sent['text'] for sent in para['sentences']) for para in paragraphs),
+                        "paragraphs": paragraphs,
+                    },
+                }]
+            }]
+        },
+    }
+
+
+def long_form_transcribe(audio_path: str, cache_dir: Optional[str] = None,
+                         transcribe_fn: Callable[[str], Optional[str]] = deepgram_transcribe,
+                         workers: int = LONG_FORM_WORKERS, chunk_duration: float = LONG_FORM_CHUNK_DURATION,
+                         overlap: float = LONG_FORM_OVERLAP, retries: int = LONG_FORM_RETRIES,
+                         retry_delay: float = RETRY_DELAY) -> Optional[str]:
+    """
+    Transcribe long audio in overlapping chunks split at silences, with at
+    most `workers` chunks in flight. A failing chunk is retried on its own and
+    finished chunks are kept in cache_dir, so an error never restarts the
+    whole transcript. Returns the stitched transcript as JSON like
+    deepgram_transcribe, or None if a chunk keeps failing.
+    """
+    duration = probe_media(audio_path).duration
+    spans = plan_chunks(duration, find_silences(audio_path), chunk_duration)
+    logging.info(f"Transcribing {duration:.0f}s of audio in {len(spans)} chunks")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        work_dir = os.path.join(cache_dir, CHUNKS_DIR) if cache_dir else tmpdir
+        os.makedirs(work_dir, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(_transcribe_chunk, i, audio_path, span, overlap, duration, work_dir,
+                                transcribe_fn, retries, retry_delay)
+                for i, span in enumerate(spans)
+            ]
+            try:
+                results = [future.result() for future in futures]
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                logging.error(f"Long-form transcription failed: {e}")
+                return None
+
+    return json.dumps(stitch_transcripts(results, spans, duration), indent=4)
+
+
+def transcribe_audio(audio_path: str, cache_dir: Optional[str] = None,
+                     threshold: float = LONG_FORM_THRESHOLD, transcriber: str = TRANSCRIBER,
+                     use_cache: bool = True) -> Optional[str]:
+    """
+    Transcribe with a single request, or in chunks when the audio is longer
+    than threshold seconds. The offline "whisper" transcriber has no request
+    timeout and always takes the whole file.
+    Transcripts are reused from the transcript cache when the same audio was
+    already transcribed with the same model and options.
+    """
+    if transcriber == "whisper":
+        options = {"model": WHISPER_MODEL, "language": "en", "word_timestamps": True}
+    else:
+        options = {"model": DEEPGRAM_MODEL, "smart_format": True, "filler_words": DEEPGRAM_FILLER_WORDS}
+
+    key = cache_key(audio_hash(audio_path), transcriber, options) if use_cache else None
+    if key:
+        transcription = get_transcript(key)
+        if transcription:
+            logging.info(f"Using cached transcript {key[:12]} for {audio_path}")
+            return transcription
+
+    if transcriber == "whisper":
+        transcription = whisper_transcribe(audio_path, model=options['model'])
+    elif probe_media(audio_path).duration > threshold:
+        transcription = long_form_transcribe(audio_path, cache_dir,
+                                             transcribe_fn=lambda path: deepgram_transcribe(path, model=options['model'],
+                                                                                        filler_words=options['filler_words']))
+    else:
+        transcription = deepgram_transcribe(audio_path, model=options['model'], filler_words=options['filler_words'])
+
+    if key and transcription:
+        put_transcript(key, transcription)
+    return transcription
+
+
+# check the stitching with a fake transcriber on a generated "speech" signal
+# usage: python -m src.transcribe.long_form
+if __name__ == "__main__":
+    import random
+    import threading
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    # a 0.4s tone every 0.65s stands in for words
+    word_period, word_length, total = 0.65, 0.4, 300.0
+
+    def fake_transcribe(path: str) -> Optional[str]:
+        """Deepgram shaped transcript with one word per tone found in the chunk"""
+        # fail about a third of the first attempts to exercise the retries
+        with lock:
+            attempts[path] = attempts.get(path, 0) + 1
+            if attempts[path] == 1 and random.random() < 0.35:
+                raise ConnectionError("simulated network error")
+
+        chunk_duration = probe_media(path).duration
+        silences = find_silences(path, min_duration=0.1)
+        edges = [0.0] + [t for silence in silences for t in silence] + [chunk_duration]
+        words = [
+            {"word": "w", "punctuated_word": "w", "start": round(s, 3), "end": round(e, 3), "confidence": 0.9}
+            for s, e in zip(edges[::2], edges[1::2]) if e - s > 0.05
+        ]
+        sentences = [
+            {"text": " ".join(w['word'] for w in words[i:i + 5]), "start": words[i]['start'], "end": words[i:i + 5][-1]['end']}
+            for i in range(0, len(words), 5)
+        ]
+        paragraphs = [{"sentences": sentences, "start": words[0]['start'], "end": words[-1]['end'], "num_words": len(words)}] if words else []
+        return json.dumps({
+            "metadata": {"request_id": "fake", "channels": 1},
+            "results": {"channels": [{"alternatives": [{"transcript": "", "words": words, "paragraphs": {"paragraphs": paragraphs}}]}]},
+        })
+
+    lock = threading.Lock()
+    attempts = {}
+    random.seed(7)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        audio_path = os.path.join(tmpdir, "speech.ogg")
+        _, encoder = AUDIO_FORMATS[AUDIO_CODEC]
+        run_ffmpeg([
+            "ffmpeg", "-nostdin", "-y",
+            "-f", "lavfi", "-i", f"aevalsrc=0.5*sin(2*PI*440*t)*lt(mod(t\\,{word_period})\\,{word_length}):s=16000:d={total}",
+        ] + encoder + [audio_path])
+
+        start = time.time()
+        transcription = long_form_transcribe(audio_path, cache_dir=tmpdir, transcribe_fn=fake_transcribe,
+                                             chunk_duration=45.0, retry_delay=0.0)
+        print(f"long form: {time.time() - start:.2f} seconds, {sum(attempts.values())} requests for {len(attempts)} chunks")
+
+    alternative = json.loads(transcription)['results']['channels'][0]['alternatives'][0]
+    words = alternative['words']
+    expected = int(total // word_period) + (total % word_period > 0.05)
+    assert len(words) == expected, f"{len(words)} words, expected {expected}"
+    for i, word in enumerate(words):
+        assert abs(word['start'] - i * word_period) < 0.05, f"word {i} starts at {word['start']}"
+    sentences = [sent for para in alternative['paragraphs']['paragraphs'] for sent in para['sentences']]
+    assert all(a['end'] <= b['start'] for a, b in zip(sentences, sentences[1:])), "overlapping sentences"
+    assert sum(len(sent['text'].split()) for sent in sentences) == len(words), "sentences lost or repeated words"
+    print(f"{len(words)} words and {len(sentences)} sentences stitched without duplicates")
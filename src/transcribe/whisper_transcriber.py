@@ -1,19 +1,273 @@
-import whisper
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from src.utils.constants import WHISPER_MEMORY_BUDGET_MB, WHISPER_MODEL
 
-# transcribe the video using whisper
-def transcribe_video(video_path: str):
+# approximate fp32 size in MB, used to make room before a model is loaded
+MODEL_SIZES_MB = {
+    "tiny": 150, "base": 290, "small": 970, "medium": 3060,
+    "large": 6170, "large-v2": 6170, "large-v3": 6170, "turbo": 3240,
+}
+
+# a pause this long (seconds) between two segments starts a new paragraph
+PARAGRAPH_GAP = 1.5
+
+
+def _load_whisper(name: str):
+    # imported here so the API runs without whisper and torch installed
+    import whisper
+    return whisper.load_model(name, device="cpu")
+
+
+def _model_size_mb(model, name: str) -> float:
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters()) / 1024 ** 2
+    except AttributeError:
+        return MODEL_SIZES_MB.get(name, 0)
+
+
+class _PooledModel:
+    def __init__(self, model, size_mb: float):
+        self.model = model
+        self.size_mb = size_mb
+        # a model runs one transcription at a time
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.time()
+
+
+class WhisperModelPool:
     """
-    Transcribe the video using Whisper
+    Keep loaded Whisper models for the life of the worker process. Each model
+    is loaded once, shared by every job through acquire() and used by one job
+    at a time. Idle models are evicted least recently used first whenever a
+    new model would not fit in the memory budget.
     """
 
-    # Load the Whisper model
-    model = whisper.load_model("turbo")
-    print("Model loaded.")
-    
-    # Transcribe the video
-    result = model.transcribe(video_path, task="transcribe", language="en",  condition_on_previous_text=False, word_timestamps=True)
+    def __init__(self, budget_mb: float = WHISPER_MEMORY_BUDGET_MB, loader: Callable = _load_whisper):
+        self.budget_mb = budget_mb
+        self.loader = loader
+        self.models: OrderedDict[str, _PooledModel] = OrderedDict()
+        self.loading: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def used_mb(self) -> float:
+        return sum(entry.size_mb for entry in self.models.values())
+
+    def _evict_for(self, size_mb: float):
+        # called with self.lock held
+        for name in list(self.models):
+            if self.used_mb + size_mb <= self.budget_mb:
+                return
+            entry = self.models[name]
+            if entry.users == 0:
+                del self.models[name]
+                logging.info(f"Evicted whisper model {name} ({entry.size_mb:.0f} MB)")
+        if self.used_mb + size_mb > self.budget_mb:
+            logging.warning(f"Whisper models in use exceed the {self.budget_mb:.0f} MB budget")
+
+    def _get(self, name: str) -> _PooledModel:
+        with self.lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                entry = self.models[name]
+                entry.users += 1
+                return entry
+            load_lock = self.loading.setdefault(name, threading.Lock())
+
+        # only one thread loads a given model, the others wait for it
+        with load_lock:
+            with self.lock:
+                entry = self.models.get(name)
+                if entry is None:
+                    self._evict_for(MODEL_SIZES_MB.get(name, 0))
+            if entry is None:
+                start = time.time()
+                model = self.loader(name)
+                entry = _PooledModel(model, _model_size_mb(model, name))
+                logging.info(f"Loaded whisper model {name} ({entry.size_mb:.0f} MB) in {time.time() - start:.1f}s")
+            with self.lock:
+                if name not in self.models:
+                    self._evict_for(entry.size_mb)
+                    self.models[name] = entry
+                self.models.move_to_end(name)
+                entry.users += 1
+                self.loading.pop(name, None)
+                return entry
+
+    @contextmanager
+    def acquire(self, name: str = WHISPER_MODEL):
+        """Get the loaded model, waiting while another job is using it"""
+        entry = self._get(name)
+        try:
+            with entry.lock:
+                yield entry.model
+        finally:
+            with self.lock:
+                entry.users -= 1
+                entry.last_used = time.time()
+
+    def clear(self):
+        with self.lock:
+            for name in [name for name, entry in self.models.items() if entry.users == 0]:
+                del self.models[name]
+
+
+_pool = WhisperModelPool()
+
+
+def get_model_pool() -> WhisperModelPool:
+    return _pool
+
+
+def _plain_word(word: str) -> str:
+    # Deepgram "word" is lower case without punctuation, "punctuated_word" keeps both
+    return re.sub(r"[^\w']", "", word).lower()
+
+
+def to_deepgram_format(result: dict, model: str = WHISPER_MODEL) -> dict:
+    """
+    Convert a Whisper result with word timestamps to the Deepgram transcript
+    shape read by iter_deepgram_transcript_sent and iter_deepgram_transcript_word.
+    Segments become sentences, grouped in paragraphs at pauses.
+    """
+    words = []
+    paragraphs = []
+    for segment in result.get('segments', []):
+        text = segment['text'].strip()
+        if not text:
+            continue
+        for word in segment.get('words', []):
+            punctuated = word['word'].strip()
+            words.append({
+                "word": _plain_word(punctuated) or punctuated,
+                "start": round(word['start'], 3),
+                "end": round(word['end'], 3),
+                "confidence": round(word.get('probability', 0.0), 4),
+                "punctuated_word": punctuated,
+            })
+
+        sentence = {"text": text, "start": round(segment['start'], 3), "end": round(segment['end'], 3)}
+        if not paragraphs or sentence['start'] - paragraphs[-1]['end'] >= PARAGRAPH_GAP:
+            paragraphs.append({"sentences": [], "num_words": 0, "start": sentence['start'], "end": sentence['end']})
+        paragraph = paragraphs[-1]
+        paragraph['sentences'].append(sentence)
+        paragraph['num_words'] += len(text.split())
+        paragraph['end'] = sentence['end']
+
+    duration = paragraphs[-1]['end'] if paragraphs else 0.0
+    return {
+        "metadata": {
+            "request_id": str(uuid.uuid4()),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "duration": duration,
+            "channels": 1,
+            "models": [f"whisper-{model}"],
+        },
+        "results": {
+            "channels": [{
+                "detected_language": result.get('language'),
+                "alternatives": [{
+                    "transcript": result.get('text', "").strip(),
+                    "confidence": sum(w['confidence'] for w in words) / len(words) if words else 0.0,
+                    "words": words,
+                    "paragraphs": {
+                        "transcript": "\n\n".join(" ".join(s['text'] for s in p['sentences']) for p in paragraphs),
+                        "paragraphs": paragraphs,
+                    },
+                }],
+            }],
+        },
+    }
+
+
+# transcribe the video using whisper
+def transcribe_video(video_path: str, model: str = WHISPER_MODEL):
+    """
+    Transcribe the video using Whisper, the model is loaded once per process
+    """
+    with get_model_pool().acquire(model) as whisper_model:
+        result = whisper_model.transcribe(video_path, task="transcribe", language="en", condition_on_previous_text=False, word_timestamps=True)
     print("Transcription completed.")
+    return result
+
+
+def whisper_transcribe(audio_path: str, model: str = WHISPER_MODEL) -> Optional[str]:
+    """Offline drop-in for deepgram_transcribe, returns the Deepgram shaped JSON"""
+    try:
+        result = transcribe_video(audio_path, model)
+        return json.dumps(to_deepgram_format(result, model), indent=4)
+    except Exception as e:
+        print(f"Exception: {e}")
+        return None
+
+
+# check loading, LRU eviction and the concurrency guard with fake models
+# usage: python -m src.transcribe.whisper_transcriber
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    from src.models.invalid_model import InvalidModel
+    from src.utils.transcript_format import iter_deepgram_transcript_sent, iter_deepgram_transcript_word
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    loads = []
+    active = {}
+    overlaps = []
+
+    class FakeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def transcribe(self, path, **kwargs):
+            active[self.name] = active.get(self.name, 0) + 1
+            if active[self.name] > 1:
+                overlaps.append(self.name)
+            time.sleep(0.02)
+            active[self.name] -= 1
+            return {
+                "text": " Hello, world. This is a test.",
+                "language": "en",
+                "segments": [
+                    {"start": 0.0, "end": 1.0, "text": " Hello, world.", "words": [
+                        {"word": " Hello,", "start": 0.0, "end": 0.5, "probability": 0.9},
+                        {"word": " world.", "start": 0.5, "end": 1.0, "probability": 0.8}]},
+                    {"start": 3.0, "end": 4.6, "text": " This is a test.", "words": [
+                        {"word": " This", "start": 3.0, "end": 3.4, "probability": 0.9},
+                        {"word": " is", "start": 3.4, "end": 3.8, "probability": 0.9},
+                        {"word": " a", "start": 3.8, "end": 4.0, "probability": 0.9},
+                        {"word": " test.", "start": 4.0, "end": 4.6, "probability": 0.9}]},
+                ],
+            }
+
+    def fake_loader(name):
+        loads.append(name)
+        time.sleep(0.1)
+        return FakeModel(name)
+
+    # room for "small" + "base" but not "medium" next to them
+    _pool = WhisperModelPool(budget_mb=4100, loader=fake_loader)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: whisper_transcribe(f"job_{i}.ogg", model="small"), range(16)))
+    assert loads == ["small"], f"model loaded {len(loads)} times"
+    assert not overlaps, "a model ran two transcriptions at once"
+
+    whisper_transcribe("job.ogg", model="base")
+    whisper_transcribe("job.ogg", model="small")
+    whisper_transcribe("job.ogg", model="medium")
+    assert list(_pool.models) == ["small", "medium"], f"unexpected pool {list(_pool.models)}"
+    assert _pool.used_mb <= _pool.budget_mb
+    print(f"loads: {loads}, pool: {list(_pool.models)} ({_pool.used_mb:.0f} MB)")
 
-    # Print the transcription
-    # print(result["text"])
-    return result
\ No newline at end of file
+    transcript = json.loads(results[0])
+    print("".join(iter_deepgram_transcript_sent(transcript)), end="")
+    print("".join(iter_deepgram_transcript_word(transcript, [InvalidModel(start_time=0.0, end_time=1.0, type="repetition", is_entire=False)])), end="")
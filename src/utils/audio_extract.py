@@ -0,0 +1,44 @@
+import os
+import logging
+from src.utils.constants import AUDIO_CODEC
+from src.utils.ffmpeg_runner import run_ffmpeg
+
+# codec -> (file name, ffmpeg encoder options)
+AUDIO_FORMATS = {
+    "opus": ("audio.ogg", ["-c:a", "libopus", "-b:a", "24k", "-application", "voip"]),
+    "flac": ("audio.flac", ["-c:a", "flac", "-compression_level", "5"]),
+}
+
+
+def extract_audio(video_path: str, cache_dir: str, codec: str = AUDIO_CODEC) -> str:
+    """
+    Extract the first audio track as mono 16 kHz Opus or FLAC into cache_dir
+    for transcription. Only the audio stream is decoded. An extracted file
+    newer than the input is reused.
+    """
+    if codec not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio codec: {codec}")
+
+    file_name, encoder = AUDIO_FORMATS[codec]
+    audio_path = os.path.join(cache_dir, file_name)
+
+    if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0 \
+            and os.path.getmtime(audio_path) >= os.path.getmtime(video_path):
+        return audio_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write next to the target and rename so a killed job never leaves a truncated cache
+    tmp_path = os.path.join(cache_dir, "tmp_" + file_name)
+    cmd = [
+        "ffmpeg", "-nostdin", "-y",
+        "-i", video_path,
+        "-map", "0:a:0",
+        "-vn", "-sn", "-dn",
+        "-ac", "1",
+        "-ar", "16000",
+    ] + encoder + [tmp_path]
+    run_ffmpeg(cmd)
+    os.replace(tmp_path, audio_path)
+
+    logging.info(f"Extracted audio to {audio_path} ({os.path.getsize(audio_path) / 1e6:.1f} MB)")
+    return audio_path
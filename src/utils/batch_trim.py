@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from src.models.cut_plan_model import CutPlanModel
+from src.utils.constants import FILTERGRAPH_MAX_NODES, HIERARCHICAL_BATCH_SEGMENTS, TRIM_WORKERS
+from src.utils.cut_plan import DEFAULT_FPS, build_filter_script, graph_strategy, plan_batches, write_filter_script
+from src.utils.ffmpeg_runner import ProgressReporter, run_ffmpeg
+
+
+def _batch_cmd(video_path: str, pieces: List[tuple], threads: int, script_path: str, output_path: str,
+               max_nodes: int = FILTERGRAPH_MAX_NODES, fps: float = DEFAULT_FPS) -> list:
+    # seek the input to the batch so it only decodes its own range
+    offset = pieces[0][0]
+    length = pieces[-1][1] - offset
+    plan = CutPlanModel(strategy=graph_strategy(len(pieces), max_nodes),
+                        segments=[(start - offset, end - offset) for start, end in pieces], fps=fps)
+
+    return [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{offset:.6f}",
+        "-t", f"{length:.6f}",
+        "-i", video_path,
+        "-filter_complex_script", write_filter_script(build_filter_script(plan), script_path),
+        "-map", "[outv]", "-map", "[outa]",
+        # lossless intermediates, the quality is only lost once in the final encode
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-qp", "0",
+        "-threads", str(threads),
+        "-c:a", "pcm_s16le",
+        output_path
+    ]
+
+
+def hierarchical_trim(video_path: str, valid_segments: List[tuple], output_path: str,
+                      batch_size: int = HIERARCHICAL_BATCH_SEGMENTS, workers: int = TRIM_WORKERS,
+                      max_nodes: int = FILTERGRAPH_MAX_NODES, fps: float = DEFAULT_FPS, job_id: Optional[str] = None,
+                      progress: Optional[ProgressReporter] = None) -> List[dict]:
+    """
+    Trim an edit list of thousands of segments: batches of batch_size segments
+    are cut from their own range of the input into lossless intermediate files,
+    at most `workers` at once, and the batches are joined by the concat
+    demuxer and encoded once. No graph grows with the total segment count.
+    Returns the per-batch timing report.
+    """
+    batches = plan_batches(valid_segments, batch_size)
+    if not batches:
+        raise ValueError("No valid segments to encode.")
+
+    workers = max(1, min(workers, len(batches)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    def encode(index: int, cmd: list, duration: float) -> dict:
+        start = time.time()
+        run_ffmpeg(cmd, job_id, progress.tracker(index) if progress else None)
+        seconds = time.time() - start
+        return {"batch": index, "duration": duration, "seconds": seconds}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        batch_files = [os.path.join(tmpdir, f"batch_{idx}.mkv") for idx in range(len(batches))]
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    encode, idx,
+                    _batch_cmd(video_path, pieces, threads, os.path.join(tmpdir, f"batch_{idx}.txt"),
+                               batch_files[idx], max_nodes, fps),
+                    sum(end - start for start, end in pieces),
+                )
+                for idx, pieces in enumerate(batches)
+            ]
+            report = [future.result() for future in futures]
+
+        list_path = os.path.join(tmpdir, "batches.txt")
+        with open(list_path, "w") as f:
+            for batch_file in batch_files:
+                f.write(f"file '{batch_file}'\n")
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-crf", "23",
+            "-c:a", "aac",
+            output_path
+        ]
+        run_ffmpeg(cmd, job_id)
+        wall = time.time() - started
+
+    kept = sum(item['duration'] for item in report)
+    logging.info(f"Hierarchical encode: {len(valid_segments)} segments in {len(batches)} batches on {workers} workers, "
+                 f"{kept:.2f}s encoded in {wall:.2f}s wall")
+    return report
+
+
+# wall time and peak memory of every strategy for growing edit lists
+# usage: python -m src.utils.batch_trim [segment counts...]
+if __name__ == "__main__":
+    import sys
+    import resource
+    import subprocess
+    import multiprocessing
+    from src.utils.cut_plan import filter_script_file, hierarchical_seconds, plan_cut, predicted_seconds
+    from src.utils.media_probe import probe_media
+
+    logging.basicConfig(level=logging.WARNING)
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000]
+    # a filtergraph run is skipped when its predicted encode takes longer than this (seconds)
+    max_predicted = 60.0
+    # seconds per segment, 60% kept: whole frames at 25 fps
+    period = 0.4
+
+    def single_pass(video_path: str, plan: CutPlanModel, output_path: str):
+        with filter_script_file(build_filter_script(plan)) as script_path:
+            run_ffmpeg([
+                "ffmpeg", "-nostdin", "-y", "-i", video_path,
+                "-filter_complex_script", script_path,
+                "-map", "[outv]", "-map", "[outa]",
+                "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", "-c:a", "aac",
+                output_path,
+            ])
+
+    def measure(strategy: str, video_path: str, segments: list, output_path: str, queue):
+        # runs in its own process so the peak memory of its ffmpeg children is its own
+        start = time.perf_counter()
+        if strategy == "hierarchical":
+            hierarchical_trim(video_path, segments, output_path, fps=25)
+        else:
+            single_pass(video_path, CutPlanModel(strategy=strategy, segments=segments, fps=25), output_path)
+        elapsed = time.perf_counter() - start
+        queue.put((elapsed, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024))
+
+    # Linux limit on a single command line argument, what a -filter_complex graph would be
+    argv_limit = 32 * os.sysconf("SC_PAGE_SIZE")
+    print(f"hierarchical batches on {TRIM_WORKERS} workers, {os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in counts:
+            # every segment keeps 60% of its period, the clip is just long enough for n segments
+            duration = max(30.0, n * period)
+            video_path = os.path.join(tmpdir, f"input_{n}.mp4")
+            subprocess.run([
+                "ffmpeg", "-v", "error", "-y",
+                "-f", "lavfi", "-i", "testsrc2=size=160x120:rate=25",
+                "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+                "-t", str(duration), "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", video_path,
+            ], check=True)
+            step = duration / n
+            segments = [(i * step, i * step + 0.6 * step) for i in range(n)]
+            kept = sum(end - start for start, end in segments)
+            media = probe_media(video_path)
+            chosen = plan_cut(segments, duration, media, min_cut=0.0).strategy
+            graph = len(build_filter_script(CutPlanModel(strategy="filtergraph", segments=segments)))
+            print(f"{n} segments, {duration:.0f}s clip, plan: {chosen}, trim graph {graph / 1024:.0f} KiB "
+                  f"({'over' if graph > argv_limit else 'within'} the {argv_limit // 1024} KiB argument limit)")
+
+            pixels = media.video_stream.width * media.video_stream.height
+            for strategy in ("filtergraph", "select", "hierarchical"):
+                if strategy == "hierarchical":
+                    predicted = hierarchical_seconds(segments, fps=25, sample_rate=48000, pixels=pixels)
+                else:
+                    predicted = predicted_seconds(strategy, n, duration, kept, 25, 48000, pixels)
+                if strategy == "filtergraph" and predicted > max_predicted:
+                    print(f"  {strategy:>12}: skipped, predicted {predicted:.0f}s")
+                    continue
+                output_path = os.path.join(tmpdir, f"{strategy}_{n}.mp4")
+                queue = multiprocessing.Queue()
+                worker = multiprocessing.Process(target=measure, args=(strategy, video_path, segments, output_path, queue))
+                worker.start()
+                elapsed, peak = queue.get()
+                worker.join()
+                probe = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0",
+                                        output_path], capture_output=True, text=True, check=True)
+                print(f"  {strategy:>12}: {elapsed:6.2f}s wall ({predicted:6.1f}s CPU predicted), {peak:6.0f} MB peak, "
+                      f"{float(probe.stdout):.1f}s out of {kept:.1f}s kept")
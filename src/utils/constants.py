@@ -1,3 +1,147 @@
 # Constants for the AI Video Editor application
+import os
 
-TEMP_DIR = "temp/"
\ No newline at end of file
+TEMP_DIR = "temp/"
+
+# Data shared between jobs, kept outside TEMP_DIR which holds one directory per job
+CACHE_DIR = "cache/"
+
+# Trimming mode used by trim_video: "smart", "parallel" or "filtergraph"
+TRIM_MODE = "smart"
+
+# Chunked encode: number of concurrent ffmpeg processes and seconds of kept video per chunk
+TRIM_WORKERS = min(8, os.cpu_count() or 1)
+TRIM_CHUNK_DURATION = 60.0
+
+# Minimum seconds between two progress updates written to the job metadata
+PROGRESS_INTERVAL = 1.0
+
+# Audio track extracted for transcription: "opus" or "flac"
+AUDIO_CODEC = "opus"
+# Long-form transcription: audio longer than the threshold (seconds) is split at
+# silences into chunks of about LONG_FORM_CHUNK_DURATION seconds, overlapping by
+# LONG_FORM_OVERLAP seconds, and transcribed concurrently
+LONG_FORM_THRESHOLD = 1800.0
+LONG_FORM_CHUNK_DURATION = 600.0
+LONG_FORM_OVERLAP = 2.0
+LONG_FORM_WORKERS = 4
+LONG_FORM_RETRIES = 3
+
+# Transcription backend used by transcribe_audio: "deepgram" or the offline "whisper"
+TRANSCRIBER = "deepgram"
+
+# Local Whisper: default model and the memory (MB) the loaded models may take per worker process
+WHISPER_MODEL = "turbo"
+WHISPER_MEMORY_BUDGET_MB = 4096
+
+# Deepgram model used for transcription
+DEEPGRAM_MODEL = "nova-3"
+
+# Transcripts cached by audio content and model, least recently used removed above the size (MB)
+TRANSCRIPT_CACHE_DIR = os.path.join(CACHE_DIR, "transcripts")
+TRANSCRIPT_CACHE_MAX_MB = 512
+
+# Windowed sentence analysis: estimated tokens per prompt and tokens of transcript
+# repeated between neighbouring windows
+SENT_WINDOW_TOKENS = 8000
+SENT_WINDOW_OVERLAP_TOKENS = 1000
+
+# LLM requests in flight for the whole process and for each model
+LLM_MAX_CONCURRENCY = 16
+LLM_CONCURRENCY = 4
+
+# Requests per minute allowed by the provider, per model, LLM_RATE_LIMIT_RPM when not listed
+LLM_RATE_LIMIT_RPM = 60
+LLM_MODEL_RATE_LIMITS = {
+    "gemini/gemini-1.5-flash": 1000,
+    "gemini/gemini-2.0-flash": 1000,
+}
+
+# Connections kept open to the LLM providers and the timeout (seconds) of one request
+LLM_MAX_CONNECTIONS = 32
+LLM_TIMEOUT = 120.0
+
+# LLM answers cached by model, prompt version and prompt, dropped after the TTL
+# (seconds) and least recently used removed above the size (MB)
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, "llm")
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_MB = 256
+
+# Models tried in order by the LLM calls, the next one is used once a model keeps
+# failing. Overridden by the comma separated LLM_SENT_MODELS / LLM_WORD_MODELS env vars,
+# e.g. "gemini/gemini-2.0-flash,gpt-4o" (OpenAI models read OPENAI_API_KEY)
+LLM_SENT_MODELS = ["gemini/gemini-1.5-flash", "gemini/gemini-2.0-flash"]
+LLM_WORD_MODELS = ["gemini/gemini-2.0-flash", "gemini/gemini-1.5-flash"]
+
+# Attempts per model, jittered exponential backoff (seconds) between them and the
+# timeout (seconds) of one attempt
+LLM_RETRIES = 3
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 30.0
+LLM_ATTEMPT_TIMEOUT = 60.0
+
+# Hedged requests: a second request is sent when the first one is slower than this
+# percentile (0-1) of the model's recent latency, None disables hedging. Hedging
+# starts once the model has LLM_HEDGE_MIN_SAMPLES answered requests
+LLM_HEDGE_PERCENTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20
+
+# Ask the models that support it for answers constrained to the invalids JSON schema
+LLM_STRUCTURED_OUTPUT = True
+
+# Word analysis overlapped with the sentence analysis: partial invalids sent per call
+WORD_BATCH_SIZE = 8
+PIPELINE_ANALYSIS = True
+
+# Tokens of one word analysis prompt, more partial invalids are split over several calls
+WORD_PROMPT_TOKENS = 8000
+
+# Silence detection on the audio track: runs of frames (ms) quieter than the threshold
+# (dBFS) lasting at least SILENCE_MIN_DURATION seconds become long_pause invalids,
+# shrunk by SILENCE_PADDING seconds on each side so the cut keeps a natural breath
+SILENCE_DETECTION = True
+SILENCE_THRESHOLD_DB = -40.0
+SILENCE_MIN_DURATION = 1.0
+SILENCE_PADDING = 0.2
+SILENCE_FRAME_MS = 20
+
+# Filler words cut without the LLM: a transcript word of the lexicon is a filler when
+# recognised with at least FILLER_MIN_CONFIDENCE and lasting FILLER_MIN_DURATION to
+# FILLER_MAX_DURATION seconds, other words are left to the word analysis
+FILLER_DETECTION = True
+FILLER_WORDS = ["um", "umm", "uh", "uhh", "uhm", "er", "erm", "ah", "hmm", "mm", "mhm"]
+FILLER_MIN_CONFIDENCE = 0.6
+FILLER_MIN_DURATION = 0.05
+FILLER_MAX_DURATION = 2.0
+
+# Ask Deepgram to keep the filler words in the transcript, it drops them by default
+DEEPGRAM_FILLER_WORDS = True
+
+# Cut planning: every invalid is widened by these seconds before and after when the
+# kept segments are planned (the stored invalids stay as found), and kept segments
+# shorter than MIN_KEEP_SEGMENT seconds are cut too
+INVALID_PADDING_START = 0.09
+INVALID_PADDING_END = 0.0
+MIN_KEEP_SEGMENT = 0.1
+
+# Cut plan of the filtergraph encode: cuts shorter than MIN_CUT_DURATION seconds are
+# dropped so the kept segments around them join, and a graph of more than
+# FILTERGRAPH_MAX_NODES filters is replaced by one select/aselect expression
+MIN_CUT_DURATION = 0.1
+FILTERGRAPH_MAX_NODES = 256
+
+# Encode cost estimate of a cut plan: CPU seconds per decoded frame and trim branch, per
+# decoded frame and select term (measured with ffmpeg 6), and decode and encode speed
+# (x realtime, 1080p H.264 ultrafast on one core, scaled by the frame size)
+CUT_BRANCH_FRAME_COST = 7e-6
+CUT_SELECT_TERM_COST = 4e-7
+CUT_DECODE_SPEED = 30.0
+CUT_ENCODE_SPEED = 4.0
+# ffmpeg start, seek and encoder setup of every batch of a hierarchical encode (seconds)
+CUT_BATCH_OVERHEAD = 0.5
+
+# Edit lists of more than HIERARCHICAL_MIN_SEGMENTS kept segments are encoded in batches
+# of HIERARCHICAL_BATCH_SEGMENTS into lossless intermediates, then the batches are joined,
+# when that is predicted to be cheaper than one select expression
+HIERARCHICAL_MIN_SEGMENTS = 1000
+HIERARCHICAL_BATCH_SEGMENTS = 50
@@ -0,0 +1,253 @@
+import os
+import math
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from src.models.cut_plan_model import CutPlanModel
+from src.models.media_info_model import MediaInfoModel
+from src.utils.constants import (
+    CUT_BATCH_OVERHEAD, CUT_BRANCH_FRAME_COST, CUT_DECODE_SPEED, CUT_ENCODE_SPEED, CUT_SELECT_TERM_COST,
+    FILTERGRAPH_MAX_NODES, HIERARCHICAL_BATCH_SEGMENTS, HIERARCHICAL_MIN_SEGMENTS, MIN_CUT_DURATION,
+)
+from src.utils.intervals import as_intervals, coalesce
+
+DEFAULT_FPS = 30.0
+DEFAULT_SAMPLE_RATE = 48000
+# frame size the decode and encode speeds are measured at
+REFERENCE_PIXELS = 1920 * 1080
+# samples per AAC frame, audio filters see about sample_rate / 1024 frames a second
+AUDIO_FRAME_SAMPLES = 1024
+
+
+def drop_short_cuts(valid_segments: List[tuple], duration: float, min_cut: float = MIN_CUT_DURATION) -> List[tuple]:
+    """Join kept segments separated by a cut shorter than min_cut, short cuts at either end are dropped too"""
+    segments = coalesce(as_intervals(valid_segments), min_cut)
+    if len(segments):
+        if segments[0, 0] < min_cut:
+            segments[0, 0] = 0.0
+        if duration - segments[-1, 1] < min_cut:
+            segments[-1, 1] = max(segments[-1, 1], duration)
+    return [(float(start), float(end)) for start, end in segments]
+
+
+def filtergraph_nodes(n_segments: int) -> int:
+    # trim, setpts, atrim and asetpts per segment, the concat, and a split per stream once the input is reused
+    return 4 * n_segments + 1 + (2 if n_segments > 1 else 0)
+
+
+def graph_strategy(n_segments: int, max_nodes: int = FILTERGRAPH_MAX_NODES) -> str:
+    """Trim branches while the graph stays within max_nodes filters, one select expression above that"""
+    return "filtergraph" if filtergraph_nodes(n_segments) <= max_nodes else "select"
+
+
+def graph_nodes(strategy: str, n_segments: int) -> int:
+    return filtergraph_nodes(n_segments) if strategy == "filtergraph" else 4
+
+
+def plan_batches(segments: List[tuple], batch_size: int = HIERARCHICAL_BATCH_SEGMENTS) -> List[List[tuple]]:
+    return [segments[i:i + batch_size] for i in range(0, len(segments), max(1, batch_size))]
+
+
+def predicted_seconds(strategy: str, n_segments: int, duration: float, kept: float,
+                      fps: float = DEFAULT_FPS, sample_rate: int = DEFAULT_SAMPLE_RATE,
+                      pixels: int = REFERENCE_PIXELS) -> float:
+    """
+    Rough CPU seconds of a single-pass encode: decoding the whole input, encoding
+    the kept part, and the filters. Every trim branch sees every decoded frame,
+    a select expression evaluates each of its terms on every frame and the
+    timestamp expression each of its terms on every kept frame. Decoding and
+    encoding scale with the frame size.
+    """
+    frame_rate = fps + sample_rate / AUDIO_FRAME_SAMPLES
+    frames = duration * frame_rate
+    scale = pixels / REFERENCE_PIXELS
+    base = (duration / CUT_DECODE_SPEED + kept / CUT_ENCODE_SPEED) * scale
+    if strategy == "select":
+        return base + (frames + kept * frame_rate) * n_segments * CUT_SELECT_TERM_COST
+    return base + frames * n_segments * CUT_BRANCH_FRAME_COST
+
+
+def hierarchical_seconds(segments: List[tuple], batch_size: int = HIERARCHICAL_BATCH_SEGMENTS,
+                         max_nodes: int = FILTERGRAPH_MAX_NODES, fps: float = DEFAULT_FPS,
+                         sample_rate: int = DEFAULT_SAMPLE_RATE, pixels: int = REFERENCE_PIXELS) -> float:
+    """
+    Rough CPU seconds of the batched encode: every batch starts an ffmpeg,
+    decodes its own span and encodes its kept part, then the joined batches
+    are decoded and encoded once more
+    """
+    kept = sum(end - start for start, end in segments)
+    seconds = (kept / CUT_DECODE_SPEED + kept / CUT_ENCODE_SPEED) * pixels / REFERENCE_PIXELS
+    for batch in plan_batches(segments, batch_size):
+        seconds += CUT_BATCH_OVERHEAD + predicted_seconds(graph_strategy(len(batch), max_nodes), len(batch), batch[-1][1] - batch[0][0],
+                                     sum(end - start for start, end in batch), fps, sample_rate, pixels)
+    return seconds
+
+
+def plan_cut(valid_segments: List[tuple], duration: float, media: Optional[MediaInfoModel] = None,
+             min_cut: float = MIN_CUT_DURATION, max_nodes: int = FILTERGRAPH_MAX_NODES,
+             hierarchical_min: int = HIERARCHICAL_MIN_SEGMENTS,
+             batch_size: int = HIERARCHICAL_BATCH_SEGMENTS) -> CutPlanModel:
+    """
+    Plan the filtergraph encode of the kept segments: short cuts are dropped,
+    then the trim/concat graph is used while it has at most max_nodes filters
+    and a select/aselect expression, whose size does not grow with the
+    segment count, above that. More than hierarchical_min segments are
+    encoded in batches of batch_size, each batch only decoding its own range,
+    when that is predicted to be cheaper than the select expression.
+    """
+    segments = drop_short_cuts(valid_segments, duration, min_cut)
+    video = media.video_stream if media else None
+    audio = media.audio_stream if media else None
+    fps = video.fps if video and video.fps else DEFAULT_FPS
+    sample_rate = audio.sample_rate if audio and audio.sample_rate else DEFAULT_SAMPLE_RATE
+    pixels = video.width * video.height if video and video.width and video.height else REFERENCE_PIXELS
+
+    kept = sum(end - start for start, end in segments)
+    strategy = graph_strategy(len(segments), max_nodes)
+    nodes = graph_nodes(strategy, len(segments))
+    predicted = predicted_seconds(strategy, len(segments), duration, kept, fps, sample_rate, pixels)
+    if strategy != "filtergraph" and len(segments) > hierarchical_min:
+        batched = hierarchical_seconds(segments, batch_size, max_nodes, fps, sample_rate, pixels)
+        if batched < predicted:
+            strategy = "hierarchical"
+            nodes = max(graph_nodes(graph_strategy(len(batch), max_nodes), len(batch))
+                        for batch in plan_batches(segments, batch_size))
+            predicted = batched
+    return CutPlanModel(
+        strategy=strategy,
+        segments=segments,
+        dropped_cuts=max(0, len(valid_segments) - len(segments)),
+        nodes=nodes,
+        kept_duration=kept,
+        fps=fps,
+        predicted_seconds=predicted,
+    )
+
+
+def build_filter_script(plan: CutPlanModel) -> str:
+    """The -filter_complex graph of the plan, writing [outv] and [outa]"""
+    if plan.strategy == "hierarchical":
+        raise ValueError("A hierarchical plan has one graph per batch.")
+    if plan.strategy == "select":
+        # segments start and end on the frame grid, so audio keeps what the video frames
+        # show; the bounds sit a millisecond before a frame, away from rounding
+        snapped = [(math.ceil(start * plan.fps - 1e-6) / plan.fps, math.ceil(end * plan.fps - 1e-6) / plan.fps)
+                   for start, end in plan.segments]
+        snapped = [(start, end) for start, end in snapped if end > start]
+        expr = "+".join(f"gte(t,{start - 1e-3:.6f})*lt(t,{end - 1e-3:.6f})" for start, end in snapped)
+        # both streams keep their input time less the cuts before it, they can not drift apart;
+        # aresample fills or trims the audio at the joins to those timestamps
+        shifts, previous = [], 0.0
+        for start, end in snapped:
+            shifts.append(f"gte(T,{start - 1e-3:.6f})*{start - previous:.6f}")
+            previous = end
+        shift = "+".join(shifts)
+        return (
+            f"[0:v]select='{expr}',setpts='PTS-({shift})/TB'[outv];"
+            f"[0:a]aselect='{expr}',asetpts='PTS-({shift})/TB',aresample=async=1:min_hard_comp=0.001:first_pts=0[outa]"
+        )
+
+    filter_parts = []
+    concat_parts = []
+    for i, (start, end) in enumerate(plan.segments):
+        filter_parts.append(
+            f"[0:v]trim=start={start:.6f}:end={end:.6f},setpts=PTS-STARTPTS[v{i}];"
+            f"[0:a]atrim=start={start:.6f}:end={end:.6f},asetpts=PTS-STARTPTS[a{i}];"
+        )
+        concat_parts.append(f"[v{i}][a{i}]")
+    return ''.join(filter_parts) + ''.join(concat_parts) + f"concat=n={len(plan.segments)}:v=1:a=1[outv][outa]"
+
+
+def write_filter_script(script: str, path: str) -> str:
+    """Write a graph for -filter_complex_script, keeping huge graphs off the command line"""
+    with open(path, "w") as f:
+        f.write(script)
+    return path
+
+
+@contextmanager
+def filter_script_file(script: str) -> Iterator[str]:
+    """The graph written to a temporary file, removed afterwards"""
+    fd, path = tempfile.mkstemp(prefix="filtergraph_", suffix=".txt")
+    os.close(fd)
+    try:
+        yield write_filter_script(script, path)
+    finally:
+        os.remove(path)
+
+
+# plan sizes, encode times and A/V sync of both strategies on a synthetic clip
+# usage: python -m src.utils.cut_plan
+if __name__ == "__main__":
+    import time
+    import random
+    import subprocess
+    import numpy as np
+    from src.utils.intervals import complement
+
+    random.seed(2)
+    duration = 120.0
+    fps, sample_rate = 25, 48000
+
+    # hundreds of filler cuts, a fifth of them shorter than the minimum
+    cuts = []
+    for _ in range(250):
+        start = random.uniform(0, duration)
+        cuts.append((start, start + (random.uniform(0.02, 0.09) if random.random() < 0.2 else random.uniform(0.15, 0.4))))
+    valid_segments = [tuple(k) for k in complement(as_intervals(cuts), 0.0, duration).tolist()]
+
+    for max_nodes in (FILTERGRAPH_MAX_NODES, 10_000):
+        plan = plan_cut(valid_segments, duration, max_nodes=max_nodes)
+        print(f"{len(valid_segments)} segments -> {plan.strategy}: {len(plan.segments)} segments, "
+              f"{plan.dropped_cuts} short cuts dropped, {plan.nodes} nodes, predicted {plan.predicted_seconds:.1f}s")
+        assert all(b[0] - a[1] >= MIN_CUT_DURATION for a, b in zip(plan.segments, plan.segments[1:])), "short cut left"
+
+    def probe(path: str, entries: str, stream: str) -> list:
+        result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", stream, "-show_entries", entries,
+                                 "-of", "csv=p=0", path], capture_output=True, text=True, check=True)
+        return [float(value.strip(",")) for value in result.stdout.split()]
+
+    def sync_offsets(path: str) -> np.ndarray:
+        # seconds from every white flash to the nearest beep onset
+        pts = np.array(probe(path, "frame=pts_time", "v:0"))
+        luma = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-map", "0:v", "-fps_mode", "passthrough",
+                               "-f", "rawvideo", "-pix_fmt", "gray", "-"], capture_output=True, check=True).stdout
+        flashes = pts[np.frombuffer(luma, np.uint8).reshape(len(pts), -1).mean(axis=1) > 128]
+        audio = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-map", "0:a", "-ac", "1", "-ar", str(sample_rate),
+                                "-f", "s16le", "-"], capture_output=True, check=True).stdout
+        samples = np.frombuffer(audio, np.int16).astype(np.float32)
+        ms = sample_rate // 1000
+        loud = (samples[:len(samples) // ms * ms].reshape(-1, ms) ** 2).mean(axis=1) > 1e6
+        onsets = np.flatnonzero(np.diff(loud.astype(np.int8), prepend=0) == 1) / 1000.0
+        nearest = np.clip(np.searchsorted(onsets, flashes), 1, len(onsets) - 1)
+        return np.minimum(np.abs(onsets[nearest] - flashes), np.abs(onsets[nearest - 1] - flashes))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # a white frame and a beep together every half second
+        video_path = os.path.join(tmpdir, "input.mp4")
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"color=c=black:s=320x180:r={fps},geq=lum='if(lt(mod(T\\,0.5)\\,0.03)\\,255\\,16)':cb=128:cr=128",
+            "-f", "lavfi", "-i", f"aevalsrc='if(lt(mod(t\\,0.5)\\,0.04)\\,0.8*sin(2*PI*1000*t)\\,0)':s={sample_rate}",
+            "-t", str(duration), "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", video_path,
+        ], check=True)
+
+        for max_nodes in (10_000, FILTERGRAPH_MAX_NODES):
+            plan = plan_cut(valid_segments, duration, max_nodes=max_nodes).model_copy(update={"fps": fps})
+            script_path = write_filter_script(build_filter_script(plan), os.path.join(tmpdir, "graph.txt"))
+            output_path = os.path.join(tmpdir, f"{plan.strategy}.mp4")
+            start = time.perf_counter()
+            subprocess.run([
+                "ffmpeg", "-v", "error", "-y", "-i", video_path,
+                "-filter_complex_script", script_path,
+                "-map", "[outv]", "-map", "[outa]",
+                "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", output_path,
+            ], check=True)
+            elapsed = time.perf_counter() - start
+            video, audio = probe(output_path, "stream=duration", "v:0")[0], probe(output_path, "stream=duration", "a:0")[0]
+            offsets = sync_offsets(output_path)
+            print(f"{plan.strategy}: {plan.nodes} nodes encoded in {elapsed:.2f}s, video {video:.2f}s and audio "
+                  f"{audio:.2f}s out of {plan.kept_duration:.2f}s kept, flash to beep p95 "
+                  f"{np.percentile(offsets, 95) * 1000:.0f} ms, max {offsets.max() * 1000:.0f} ms")
+            # within a frame of each other all along, like the trim graph
+            assert abs(video - audio) <= 1.0 / fps and np.percentile(offsets, 95) <= 1.0 / fps, "audio drifted from the video"
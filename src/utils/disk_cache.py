@@ -0,0 +1,81 @@
+import os
+import logging
+import threading
+
+# bytes stored per cache directory, counted once by a walk and kept up to date by evict_lru
+_sizes: dict[str, int] = {}
+_sizes_lock = threading.Lock()
+
+
+def write_atomic(path: str, content: str) -> int:
+    """
+    Write to a temporary file next to path and rename it, so readers never see
+    a partial file. Returns the size of the file written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    size = os.stat(tmp_path).st_size
+    os.replace(tmp_path, path)
+    return size
+
+
+def cache_usage(cache_dir: str) -> tuple:
+    """Get the (entries, bytes) stored in the cache directory"""
+    entries = 0
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+                entries += 1
+            except FileNotFoundError:
+                pass
+    return entries, total
+
+
+def evict_lru(cache_dir: str, max_bytes: int, added: int = 0) -> int:
+    """
+    Remove the least recently used files, by mtime, until the directory holds
+    at most max_bytes. Readers refresh the mtime of the entries they use.
+    The size of the directory is counted by one walk and then kept as a
+    running total, `added` being the bytes just written; the directory is only
+    walked again when the total goes over max_bytes, which also picks up
+    files written or removed elsewhere. Returns the number of files removed.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    with _sizes_lock:
+        if cache_dir not in _sizes:
+            # the first walk counts the file just written too
+            _sizes[cache_dir] = cache_usage(cache_dir)[1]
+        else:
+            _sizes[cache_dir] += added
+        if _sizes[cache_dir] <= max_bytes:
+            return 0
+
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+            logging.info(f"Evicted cache entry {os.path.basename(path)}")
+        except FileNotFoundError:
+            pass
+    with _sizes_lock:
+        _sizes[cache_dir] = total
+    return removed
@@ -0,0 +1,145 @@
+import os
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+from typing import Callable, Optional
+from src.utils.constants import PROGRESS_INTERVAL
+
+# ffmpeg processes per job, so a cancel request can reach every one of them
+_running: dict[str, set] = {}
+_cancelled: set = set()
+_lock = threading.Lock()
+
+
+class FFmpegCancelled(Exception):
+    """Raised when the ffmpeg process of a job was killed by a cancel request."""
+
+
+class ProgressReporter:
+    """
+    Aggregate the progress of one or more ffmpeg processes working on the same
+    job and report percent complete, encoded fps and ETA at a throttled rate.
+    """
+
+    def __init__(self, total: float, callback: Callable[[dict], None], interval: float = PROGRESS_INTERVAL):
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self.started = time.time()
+        self.last_report = 0.0
+        self.done = {}
+        self.fps = {}
+        self.lock = threading.Lock()
+
+    def tracker(self, key) -> Callable[[float, float], None]:
+        """Get the on_progress callback for one ffmpeg process"""
+        def on_progress(out_time: float, fps: float):
+            with self.lock:
+                self.done[key] = out_time
+                self.fps[key] = fps
+                now = time.time()
+                if now - self.last_report < self.interval:
+                    return
+                self.last_report = now
+                self.callback(self._snapshot(now))
+        return on_progress
+
+    def reset(self):
+        """Forget the processes reported so far, used when falling back to another strategy"""
+        with self.lock:
+            self.done = {}
+            self.fps = {}
+            self.started = time.time()
+
+    def finish(self):
+        with self.lock:
+            self.done = {"total": self.total}
+            self.fps = {}
+            self.callback(self._snapshot(time.time()))
+
+    def _snapshot(self, now: float) -> dict:
+        done = min(sum(self.done.values()), self.total)
+        elapsed = now - self.started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else None
+        return {
+            "percent": round(100.0 * done / self.total, 1) if self.total > 0 else 100.0,
+            "fps": round(sum(self.fps.values(), 0.0), 1),
+            "eta": round(eta, 1) if eta is not None else None,
+            "updated_at": now,
+        }
+
+
+def cancel_job(job_id: str) -> bool:
+    """
+    Kill the process groups of every ffmpeg running for the job. Returns True
+    if anything was running.
+    """
+    with _lock:
+        _cancelled.add(job_id)
+        processes = list(_running.get(job_id, ()))
+
+    for proc in processes:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    return bool(processes)
+
+
+def clear_cancelled(job_id: str):
+    with _lock:
+        _cancelled.discard(job_id)
+
+
+def run_ffmpeg(cmd: list, job_id: Optional[str] = None, on_progress: Optional[Callable[[float, float], None]] = None):
+    """
+    Run an ffmpeg command, parsing `-progress` output from stdout.
+    Raises CalledProcessError on failure like subprocess.run(check=True) and
+    FFmpegCancelled when the job was cancelled.
+    """
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + cmd[1:]
+
+    with tempfile.TemporaryFile() as stderr:
+        with _lock:
+            if job_id in _cancelled:
+                raise FFmpegCancelled(f"Job {job_id} was cancelled.")
+            # own process group so the kill also reaches anything ffmpeg spawns
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True, start_new_session=True)
+            if job_id is not None:
+                _running.setdefault(job_id, set()).add(proc)
+
+        try:
+            out_time = 0.0
+            fps = 0.0
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and value.isdigit():
+                    out_time = int(value) / 1_000_000
+                elif key == "fps":
+                    try:
+                        fps = float(value)
+                    except ValueError:
+                        pass
+                elif key == "progress" and on_progress is not None:
+                    # a finished process no longer adds to the encoded fps
+                    on_progress(out_time, fps if value != "end" else 0.0)
+            returncode = proc.wait()
+        finally:
+            if proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+            with _lock:
+                if job_id is not None:
+                    _running.get(job_id, set()).discard(proc)
+                    if not _running.get(job_id):
+                        _running.pop(job_id, None)
+                cancelled = job_id in _cancelled
+
+        if cancelled:
+            raise FFmpegCancelled(f"Job {job_id} was cancelled.")
+        if returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
@@ -0,0 +1,97 @@
+from typing import Iterable, List, Set, Tuple
+from src.models.invalid_model import InvalidModel
+from src.utils.constants import FILLER_MAX_DURATION, FILLER_MIN_CONFIDENCE, FILLER_MIN_DURATION, FILLER_WORDS
+
+_PUNCTUATION = ".,!?;:-\"'"
+
+
+def _normalise(word: dict) -> str:
+    return word.get('word', '').lower().strip(_PUNCTUATION)
+
+
+def find_filler_words(words: List[dict], lexicon: Iterable[str] = FILLER_WORDS,
+                      min_confidence: float = FILLER_MIN_CONFIDENCE, min_duration: float = FILLER_MIN_DURATION,
+                      max_duration: float = FILLER_MAX_DURATION) -> List[int]:
+    """
+    Indices of the words that are certainly fillers: in the lexicon, recognised
+    confidently and of a plausible length. A lexicon word failing a rule is
+    ambiguous and not returned, the word analysis decides on it.
+    """
+    lexicon = {entry.lower() for entry in lexicon}
+    fillers = []
+    for i, word in enumerate(words):
+        if _normalise(word) not in lexicon:
+            continue
+        duration = word['end'] - word['start']
+        if word.get('confidence', 1.0) >= min_confidence and min_duration <= duration <= max_duration:
+            fillers.append(i)
+    return fillers
+
+
+def filler_invalids(words: List[dict], fillers: List[int]) -> List[InvalidModel]:
+    """One filler_words invalid per run of consecutive filler words"""
+    invalids = []
+    run_start = None
+    for n, i in enumerate(fillers):
+        if run_start is None:
+            run_start = i
+        if n + 1 == len(fillers) or fillers[n + 1] != i + 1:
+            invalids.append(InvalidModel(start_time=words[run_start]['start'], end_time=words[i]['end'],
+                                         type="filler_words", is_entire=True))
+            run_start = None
+    return invalids
+
+
+def detect_fillers(transcript: dict, **rules) -> Tuple[List[InvalidModel], Set[int]]:
+    """
+    Find the filler words of the transcript without the LLM. Returns their
+    invalids and the word ids they cover, to leave out of the word analysis prompts.
+    """
+    words = transcript['results']['channels'][0]['alternatives'][0].get('words', [])
+    fillers = find_filler_words(words, **rules)
+    return filler_invalids(words, fillers), set(fillers)
+
+
+# prompt tokens saved on a synthetic transcript with fillers
+# usage: python -m src.utils.filler_detect
+if __name__ == "__main__":
+    import time
+    import random
+    from src.llm.prompt import count_tokens, generate_word_analysis_prompt
+    from src.utils.transcript_format import iter_compact_transcript_word
+
+    random.seed(3)
+    words = []
+    t = 0.0
+    for i in range(20_000):
+        if random.random() < 0.12:
+            text = random.choice(["um", "uh", "Um,", "erm"])
+            confidence = random.choice([0.95, 0.9, 0.4])
+        else:
+            text = random.choice(["so", "the", "video", "editor", "like", "okay", "cut", "this"])
+            confidence = 0.98
+        length = random.uniform(0.1, 0.5)
+        words.append({"word": text.lower().strip(",."), "punctuated_word": text, "start": round(t, 2),
+                      "end": round(t + length, 2), "confidence": confidence})
+        t += length + 0.05
+    transcript = {"results": {"channels": [{"alternatives": [{"words": words}]}]}}
+
+    start = time.perf_counter()
+    invalids, handled = detect_fillers(transcript)
+    elapsed = time.perf_counter() - start
+    print(f"{len(handled)} filler words in {len(invalids)} invalids found in {elapsed * 1000:.1f} ms")
+
+    # low confidence fillers are ambiguous and stay for the LLM
+    assert all(words[i]['confidence'] >= FILLER_MIN_CONFIDENCE for i in handled)
+    assert any(_normalise(w) in FILLER_WORDS and i not in handled for i, w in enumerate(words)), "nothing ambiguous left"
+    # every handled word is inside exactly one invalid
+    for i in handled:
+        assert sum(inv.start_time <= words[i]['start'] and words[i]['end'] <= inv.end_time for inv in invalids) == 1
+
+    spans = [InvalidModel(start_time=words[i]['start'], end_time=words[min(i + 40, len(words) - 1)]['end'], is_entire=False)
+             for i in range(0, len(words) - 40, 200)]
+    model = "gemini/gemini-2.0-flash"
+    full = count_tokens(generate_word_analysis_prompt(iter_compact_transcript_word(transcript, spans)), model)
+    stripped = count_tokens(generate_word_analysis_prompt(iter_compact_transcript_word(transcript, spans, skip=handled)), model)
+    print(f"word analysis prompt: {full} tokens, {stripped} without the handled fillers ({100 * (1 - stripped / full):.0f}% fewer)")
+    assert stripped < full
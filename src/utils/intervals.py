@@ -0,0 +1,160 @@
+import numpy as np
+from typing import Iterable, List
+from src.models.invalid_model import InvalidModel
+from src.utils.constants import INVALID_PADDING_END, INVALID_PADDING_START, MIN_KEEP_SEGMENT
+
+# Interval algebra on (n, 2) float64 arrays of [start, end] rows. Every operation
+# is a sort plus vectorized passes, results are sorted and disjoint unless noted.
+
+
+def as_intervals(rows: Iterable) -> np.ndarray:
+    """(n, 2) array of (start, end) pairs or InvalidModels, empty and reversed intervals dropped"""
+    pairs = [(row.start_time, row.end_time) if isinstance(row, InvalidModel) else row for row in rows]
+    intervals = np.asarray(pairs, dtype=np.float64).reshape(-1, 2)
+    return intervals[intervals[:, 1] > intervals[:, 0]]
+
+
+def union(intervals: np.ndarray, tolerance: float = 0.0) -> np.ndarray:
+    """
+    Merge overlapping, nested and touching intervals, and those less than
+    tolerance apart, into sorted disjoint ones
+    """
+    if len(intervals) == 0:
+        return intervals.reshape(0, 2)
+    intervals = intervals[np.argsort(intervals[:, 0], kind="stable")]
+    starts, ends = intervals[:, 0], intervals[:, 1]
+    # an interval starts a new group when it begins after every earlier one ended
+    reach = np.maximum.accumulate(ends)
+    new_group = np.empty(len(intervals), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] - reach[:-1] > tolerance
+    first = np.flatnonzero(new_group)
+    last = np.append(first[1:], len(intervals)) - 1
+    return np.column_stack((starts[first], reach[last]))
+
+
+def coalesce(intervals: np.ndarray, min_gap: float) -> np.ndarray:
+    """Union where intervals separated by a gap shorter than min_gap are joined"""
+    return union(intervals, tolerance=np.nextafter(min_gap, -np.inf) if min_gap > 0 else 0.0)
+
+
+def pad(intervals: np.ndarray, before: float = 0.0, after: float = 0.0) -> np.ndarray:
+    """Widen every interval, negative padding narrows it; unsorted, empty ones dropped"""
+    padded = intervals + np.array([-before, after])
+    return padded[padded[:, 1] > padded[:, 0]]
+
+
+def clip(intervals: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    clipped = np.clip(intervals, lo, hi)
+    return clipped[clipped[:, 1] > clipped[:, 0]]
+
+
+def complement(intervals: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    """[lo, hi] minus the intervals"""
+    merged = clip(union(intervals), lo, hi)
+    bounds = np.concatenate(([lo], merged.ravel(), [hi])).reshape(-1, 2)
+    return bounds[bounds[:, 1] > bounds[:, 0]]
+
+
+def drop_short(intervals: np.ndarray, min_length: float) -> np.ndarray:
+    return intervals[intervals[:, 1] - intervals[:, 0] >= min_length]
+
+
+def keep_segments(invalids: Iterable, duration: float, padding_start: float = INVALID_PADDING_START,
+                  padding_end: float = INVALID_PADDING_END, min_keep: float = MIN_KEEP_SEGMENT) -> List[tuple]:
+    """
+    The (start, end) segments of [0, duration] to keep: the invalids are padded,
+    merged whatever their overlap or nesting, and the rest of the timeline is
+    kept except pieces shorter than min_keep. The padding is applied here on
+    every call and never stored, so planning twice gives the same segments.
+    """
+    cuts = coalesce(pad(as_intervals(invalids), padding_start, padding_end), min_keep)
+    keeps = drop_short(complement(cuts, 0.0, duration), min_keep)
+    return [(float(start), float(end)) for start, end in keeps]
+
+
+# randomized property checks against a plain Python reference, and timing
+# usage: python -m src.utils.intervals [n_intervals]
+if __name__ == "__main__":
+    import sys
+    import time
+    import random
+
+    def reference_union(pairs: list, tolerance: float = 0.0) -> list:
+        merged = []
+        for start, end in sorted(p for p in pairs if p[1] > p[0]):
+            if merged and start - merged[-1][1] <= tolerance:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(m) for m in merged]
+
+    def reference_keep(pairs: list, duration: float) -> list:
+        keeps, t = [], 0.0
+        for start, end in reference_union(pairs):
+            if start > t:
+                keeps.append((t, min(start, duration)))
+            t = max(t, end)
+        if t < duration:
+            keeps.append((t, duration))
+        return [k for k in keeps if k[1] > k[0]]
+
+    def covered(intervals: np.ndarray, points: np.ndarray) -> np.ndarray:
+        # closed intervals, a point on a boundary counts as inside
+        return ((intervals[:, :1] <= points) & (points <= intervals[:, 1:])).any(axis=0) if len(intervals) else np.zeros(len(points), bool)
+
+    rng = random.Random(11)
+    for trial in range(2000):
+        duration = rng.choice([1.0, 10.0, 100.0])
+        n = rng.randint(0, 30)
+        # snapped to a coarse grid so touching, equal and nested intervals are common
+        grid = rng.choice([0.05, 0.5, 1.0])
+        pairs = []
+        for _ in range(n):
+            start = round(rng.uniform(-1, duration + 1) / grid) * grid
+            pairs.append((start, start + round(rng.uniform(-grid, duration / 3) / grid) * grid))
+        intervals = as_intervals(pairs)
+
+        merged = union(intervals)
+        assert [tuple(m) for m in merged.tolist()] == reference_union(pairs), (pairs, merged)
+        assert np.all(merged[1:, 0] > merged[:-1, 1]), "union not disjoint"
+        points = np.array([rng.uniform(-1, duration + 1) for _ in range(50)])
+        assert np.array_equal(covered(merged, points), covered(intervals, points)), "union changed the covered set"
+        assert np.array_equal(union(merged), merged), "union not idempotent"
+
+        keeps = complement(intervals, 0.0, duration)
+        assert [tuple(k) for k in keeps.tolist()] == reference_keep(pairs, duration), (pairs, keeps)
+        inside = (points > 0) & (points < duration)
+        # every point of the timeline is either cut or kept, boundaries aside
+        interior = inside & ~np.isin(points, merged.ravel())
+        assert np.array_equal(covered(keeps, points)[interior], ~covered(merged, points)[interior])
+
+        min_gap = rng.choice([0.0, 0.1, 0.5, 2.0])
+        joined = coalesce(intervals, min_gap)
+        assert np.all(joined[1:, 0] - joined[:-1, 1] >= min_gap), "gap shorter than min_gap left"
+        assert [tuple(m) for m in joined.tolist()] == reference_union(pairs, np.nextafter(min_gap, -np.inf) if min_gap else 0.0)
+
+        assert np.array_equal(pad(intervals), intervals), "zero padding changed the intervals"
+        segments = keep_segments(pairs, duration, 0.09, 0.02, min_gap)
+        assert segments == keep_segments(pairs, duration, 0.09, 0.02, min_gap), "planning is not repeatable"
+        assert all(end - start >= min_gap for start, end in segments), "kept segment shorter than min_keep"
+        assert all(0.0 <= start < end <= duration for start, end in segments)
+        # planning again from the cuts of a plan keeps the same segments
+        cuts = complement(as_intervals(segments), 0.0, duration)
+        assert keep_segments(cuts, duration, 0.0, 0.0, min_gap) == segments, "plan is not a fixed point"
+    print("2000 random interval sets match the reference union, complement and coalescing")
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    duration = 4 * 3600.0
+    starts = [random.uniform(0, duration) for _ in range(n)]
+    invalids = [InvalidModel(start_time=s, end_time=s + random.uniform(0.05, 0.6), type="filler_words") for s in starts]
+
+    start = time.perf_counter()
+    segments = keep_segments(invalids, duration)
+    elapsed = time.perf_counter() - start
+    print(f"keep_segments: {n} invalids -> {len(segments)} kept segments in {elapsed * 1000:.1f} ms")
+
+    pairs = [(inv.start_time, inv.end_time) for inv in invalids]
+    start = time.perf_counter()
+    reference_keep(pairs, duration)
+    print(f"python reference: {(time.perf_counter() - start) * 1000:.1f} ms")
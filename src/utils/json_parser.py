@@ -1,5 +1,9 @@
-import json
 import re
+import json
+import logging
+from typing import Callable, List, Optional, Tuple
+from pydantic import ValidationError
+from src.models.invalid_model import InvalidModel
 
 def llm_json_parser(data: str | dict) -> dict:
     """
@@ -30,5 +34,175 @@ def llm_json_parser(data: str | dict) -> dict:
             except json.JSONDecodeError:
                 raise ValueError('Invalid JSON format within backticks')
         raise ValueError('Invalid JSON format')
-    
 
+
+# keys some models answer with instead of the ones the prompt asks for
+_KEY_ALIASES = {"startTime": "start_time", "endTime": "end_time", "isEntire": "is_entire"}
+
+
+class InvalidsParser:
+    """
+    Tolerant incremental parser of an LLM answer holding {"data": [invalid, ...]}.
+    Text is fed as it arrives and every complete array item is validated
+    straight into an InvalidModel, so a truncated answer still gives the items
+    before the cut. `resolve` adds the times to items that refer to the
+    transcript by id (see TranscriptLookup). Items without times or that do
+    not validate are skipped. `complete` is True once the closing bracket of
+    the array was seen.
+    """
+
+    def __init__(self, resolve: Optional[Callable[[dict], dict]] = None):
+        self.resolve = resolve
+        self.buffer = ""
+        self.pos = None
+        self.complete = False
+        self.skipped = 0
+        self.decoder = json.JSONDecoder()
+
+    def _find_array(self) -> bool:
+        key = self.buffer.find('"data"')
+        start = self.buffer.find("[", key if key >= 0 else 0)
+        if start < 0:
+            return False
+        self.pos = start + 1
+        return True
+
+    def _validate(self, item) -> Optional[InvalidModel]:
+        if not isinstance(item, dict):
+            self.skipped += 1
+            return None
+        item = {_KEY_ALIASES.get(key, key): value for key, value in item.items()}
+        if self.resolve is not None:
+            item = self.resolve(item)
+        if 'start_time' not in item or 'end_time' not in item:
+            self.skipped += 1
+            return None
+        try:
+            return InvalidModel.model_validate(item)
+        except ValidationError:
+            self.skipped += 1
+            return None
+
+    def feed(self, text: str) -> List[InvalidModel]:
+        """Add the next part of the answer, returns the items completed by it"""
+        self.buffer += text
+        return self._parse(final=False)
+
+    def close(self) -> List[InvalidModel]:
+        """End of the answer: skip past a malformed item and take what follows it"""
+        return self._parse(final=True)
+
+    def _parse(self, final: bool) -> List[InvalidModel]:
+        items = []
+        if self.complete or (self.pos is None and not self._find_array()):
+            return items
+        buffer = self.buffer
+        while True:
+            while self.pos < len(buffer) and buffer[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(buffer):
+                break
+            if buffer[self.pos] == "]":
+                self.complete = True
+                break
+            try:
+                item, self.pos = self.decoder.raw_decode(buffer, self.pos)
+            except json.JSONDecodeError:
+                if not final:
+                    # most likely the item is not complete yet
+                    break
+                next_item = buffer.find("{", self.pos + 1)
+                if next_item < 0:
+                    break
+                self.skipped += 1
+                self.pos = next_item
+                continue
+            model = self._validate(item)
+            if model is not None:
+                items.append(model)
+        return items
+
+
+def _parse_all(data: str | dict, resolve: Optional[Callable[[dict], dict]]) -> Tuple[InvalidsParser, List[InvalidModel]]:
+    parser = InvalidsParser(resolve)
+    items = parser.feed(json.dumps(data) if isinstance(data, dict) else (data or ""))
+    items += parser.close()
+    return parser, items
+
+
+def parse_invalids(data: str | dict, resolve: Optional[Callable[[dict], dict]] = None) -> Tuple[List[InvalidModel], bool]:
+    """
+    Parse the invalids of an LLM answer into InvalidModel objects.
+    Returns the items and whether the whole array was present.
+    """
+    parser, items = _parse_all(data, resolve)
+    return items, parser.complete
+
+
+def llm_invalids_parser(data: str | dict, resolve: Optional[Callable[[dict], dict]] = None) -> dict:
+    """
+    Parse an analysis answer into {"data": [...]} of validated invalids,
+    keeping what comes before the cut of a truncated answer.
+
+    Raises:
+        ValueError: If the answer holds no array of invalids at all
+    """
+    parser, items = _parse_all(data, resolve)
+    if parser.pos is None:
+        raise ValueError('No invalids array in the answer')
+    if not parser.complete:
+        logging.warning(f"Truncated analysis answer, recovered {len(items)} invalids")
+    return {"data": [item.to_dict() for item in items]}
+
+
+# check recovery of truncated and fenced answers, chunked feeding and speed
+# usage: python -m src.utils.json_parser
+if __name__ == "__main__":
+    import time
+    import random
+
+    items = [{"start_time": f"{i * 2.5:.2f}", "end_time": f"{i * 2.5 + 1.2:.2f}", "type": "repetition",
+              "is_entire": i % 3 != 0} for i in range(2000)]
+    answer = "```json\n" + json.dumps({"data": items}, indent=2) + "\n```"
+    expected = [InvalidModel.model_validate(item) for item in items]
+
+    parsed, complete = parse_invalids(answer)
+    assert complete and parsed == expected, "fenced answer not parsed"
+
+    # cut anywhere, every item before the cut is recovered and nothing after it
+    for cut in random.Random(1).sample(range(len(answer) - 10), 200):
+        parsed, complete = parse_invalids(answer[:cut])
+        assert not complete and parsed == expected[:len(parsed)], f"wrong recovery at {cut}"
+        assert len(parsed) >= answer[:cut].count("}") - 1, f"complete items lost at {cut}"
+
+    # fed in small pieces like a stream
+    parser = InvalidsParser()
+    streamed = []
+    for i in range(0, len(answer), 7):
+        streamed += parser.feed(answer[i:i + 7])
+    streamed += parser.close()
+    assert parser.complete and streamed == expected, "chunked feeding differs"
+
+    # camelCase keys, a malformed item and an unknown type are skipped or mapped
+    messy = '{"data": [{"startTime": "1.0", "endTime": "2.0", "type": "repetition", "isEntire": false}, ' \
+            '{"start_time": "x"}, {"start_time": 3, "end_time": 4, "type": "cough"}, {"start_time": 5, "end_time": 6}]}'
+    parsed, complete = parse_invalids(messy)
+    assert complete and [(m.start_time, m.is_entire) for m in parsed] == [(1.0, False), (5.0, True)], parsed
+    assert llm_invalids_parser('{"data": []}') == {"data": []}
+    try:
+        llm_invalids_parser("Sorry, I cannot help with that.")
+        raise AssertionError("answer without an array accepted")
+    except ValueError:
+        pass
+
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        [InvalidModel.from_dict(dict(item)) for item in llm_json_parser(answer)['data']]
+    old = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        parse_invalids(answer)
+    new = (time.perf_counter() - start) / runs
+    print(f"{len(items)} invalids: json + from_dict {old * 1000:.1f} ms, tolerant parser {new * 1000:.1f} ms")
+    print("truncated, chunked and messy answers parsed")
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+from typing import Optional
+from src.models.media_info_model import MediaInfoModel, StreamInfoModel
+
+# bytes hashed from the head and the tail of the file for the cache key
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+MEDIA_INFO_FILE = "media_info.json"
+
+# probes already done by this process, keyed by absolute path
+_memo: dict[str, MediaInfoModel] = {}
+_lock = threading.Lock()
+
+
+def _content_hash(path: str, size: int) -> str:
+    """Hash the size plus the first and last MiB, enough to tell re-encoded or replaced files apart"""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_SAMPLE_SIZE))
+        if size > 2 * HASH_SAMPLE_SIZE:
+            f.seek(-HASH_SAMPLE_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def _parse_fps(rate: Optional[str]) -> Optional[float]:
+    try:
+        num, _, den = rate.partition("/")
+        return float(num) / float(den or 1) if float(den or 1) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def _run_ffprobe(path: str, with_packets: bool) -> dict:
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_format",
+        "-show_streams",
+        "-of", "json",
+    ]
+    if with_packets:
+        # one call for everything, -select_streams would also hide the audio stream info
+        cmd += ["-show_entries", "packet=stream_index,pts_time,flags"]
+    cmd.append(path)
+
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        raise RuntimeError(f"Failed to probe media using ffprobe: {result.stderr.strip()}")
+
+
+def _build_media_info(data: dict, size: int, mtime_ns: int, content_hash: str, with_packets: bool) -> MediaInfoModel:
+    try:
+        fmt = data['format']
+        start_time = float(fmt.get('start_time', 0.0))
+        streams = [
+            StreamInfoModel(
+                index=s['index'],
+                codec_type=s.get('codec_type', "unknown"),
+                codec_name=s.get('codec_name'),
+                profile=s.get('profile'),
+                pix_fmt=s.get('pix_fmt'),
+                width=s.get('width'),
+                height=s.get('height'),
+                fps=_parse_fps(s.get('avg_frame_rate')) if s.get('codec_type') == "video" else None,
+                sample_rate=int(s['sample_rate']) if 'sample_rate' in s else None,
+                channels=s.get('channels'),
+                channel_layout=s.get('channel_layout'),
+            )
+            for s in data.get('streams', [])
+        ]
+        info = MediaInfoModel(
+            size=size,
+            mtime_ns=mtime_ns,
+            content_hash=content_hash,
+            duration=float(fmt['duration']),
+            start_time=start_time,
+            format_name=fmt.get('format_name'),
+            streams=streams,
+        )
+    except (KeyError, ValueError):
+        raise RuntimeError("Failed to retrieve media info using ffprobe.")
+
+    video = info.video_stream
+    if with_packets and video is not None:
+        packets = []
+        keyframes = []
+        for packet in data.get('packets', []):
+            pts = packet.get('pts_time')
+            if packet.get('stream_index') != video.index or pts in (None, "N/A"):
+                continue
+            pts = float(pts) - start_time
+            packets.append(pts)
+            if "K" in packet.get('flags', ""):
+                keyframes.append(pts)
+        info.video_packets = sorted(packets)
+        info.keyframes = sorted(keyframes)
+
+    return info
+
+
+def probe_media(path: str, cache_dir: Optional[str] = None, with_packets: bool = False) -> MediaInfoModel:
+    """
+    Probe the media file once and serve later calls from cache. The result is
+    kept in memory and, when cache_dir is given (usually the job directory),
+    in media_info.json keyed by file size, mtime and a content hash.
+    With with_packets the video packet times and keyframes are included.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    with _lock:
+        info = _memo.get(path)
+    if info and (info.size, info.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        info = None
+
+    cache_path = os.path.join(cache_dir, MEDIA_INFO_FILE) if cache_dir else None
+    content_hash = info.content_hash if info else _content_hash(path, stat.st_size)
+
+    if info is None and cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                cached = MediaInfoModel(**json.load(f))
+            if (cached.size, cached.mtime_ns, cached.content_hash) == (stat.st_size, stat.st_mtime_ns, content_hash):
+                info = cached
+        except (json.JSONDecodeError, ValueError):
+            info = None
+
+    is_new = info is None or (with_packets and info.keyframes is None)
+    if is_new:
+        data = _run_ffprobe(path, with_packets)
+        info = _build_media_info(data, stat.st_size, stat.st_mtime_ns, content_hash, with_packets)
+
+    with _lock:
+        _memo[path] = info
+
+    if cache_path and (is_new or not os.path.exists(cache_path)):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(info.to_dict(), f)
+
+    return info
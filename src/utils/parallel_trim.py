@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from src.utils.constants import TRIM_CHUNK_DURATION, TRIM_WORKERS
+from src.utils.cut_plan import write_filter_script
+from src.utils.ffmpeg_runner import ProgressReporter, run_ffmpeg
+
+
+def plan_chunks(valid_segments: List[tuple], chunk_duration: float = TRIM_CHUNK_DURATION) -> List[List[tuple]]:
+    """
+    Split the valid segments into chunks holding about the same amount of kept
+    video. Segments longer than a chunk are split across chunks.
+    """
+    total = sum(end - start for start, end in valid_segments)
+    if total <= 0:
+        return []
+
+    n_chunks = max(1, round(total / chunk_duration))
+    target = total / n_chunks
+
+    chunks = []
+    current = []
+    filled = 0.0
+    for start, end in valid_segments:
+        while end - start > 1e-6:
+            # the last chunk takes whatever is left over from rounding
+            is_last = len(chunks) == n_chunks - 1
+            take = end - start if is_last else min(end - start, target - filled)
+            current.append((start, start + take))
+            filled += take
+            start += take
+            if not is_last and filled >= target - 1e-6:
+                chunks.append(current)
+                current = []
+                filled = 0.0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _chunk_cmd(video_path: str, pieces: List[tuple], threads: int, script_path: str, output_path: str) -> list:
+    # seek the input to the chunk so every worker only decodes its own range
+    offset = pieces[0][0]
+    length = pieces[-1][1] - offset
+
+    filter_parts = []
+    concat_parts = []
+    for i, (start, end) in enumerate(pieces):
+        start, end = start - offset, end - offset
+        filter_parts.append(
+            f"[0:v]trim=start={start:.6f}:end={end:.6f},setpts=PTS-STARTPTS[v{i}];"
+            f"[0:a]atrim=start={start:.6f}:end={end:.6f},asetpts=PTS-STARTPTS[a{i}];"
+        )
+        concat_parts.append(f"[v{i}][a{i}]")
+    filter_script = ''.join(filter_parts) + ''.join(concat_parts) + f"concat=n={len(pieces)}:v=1:a=1[outv][outa]"
+
+    return [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{offset:.6f}",
+        "-t", f"{length:.6f}",
+        "-i", video_path,
+        "-filter_complex_script", write_filter_script(filter_script, script_path),
+        "-map", "[outv]", "-map", "[outa]",
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-crf", "23",
+        "-threads", str(threads),
+        "-c:a", "pcm_s16le",    # encoded once after the concat, avoids AAC priming gaps
+        output_path
+    ]
+
+
+def _encode_chunk(index: int, cmd: list, duration: float, job_id: Optional[str], progress: Optional[ProgressReporter]) -> dict:
+    start = time.time()
+    run_ffmpeg(cmd, job_id, progress.tracker(index) if progress else None)
+    seconds = time.time() - start
+    return {
+        "chunk": index,
+        "duration": duration,
+        "seconds": seconds,
+        "speed": duration / seconds if seconds > 0 else 0.0,
+    }
+
+
+def parallel_trim(video_path: str, valid_segments: List[tuple], output_path: str,
+                  workers: int = TRIM_WORKERS, chunk_duration: float = TRIM_CHUNK_DURATION,
+                  job_id: Optional[str] = None, progress: Optional[ProgressReporter] = None) -> List[dict]:
+    """
+    Encode balanced chunks of the valid segments concurrently, one ffmpeg
+    process per chunk with at most `workers` running at once, and join them
+    with the concat demuxer without re-encoding the video.
+    Returns the per-chunk timing report.
+    """
+    chunks = plan_chunks(valid_segments, chunk_duration)
+    if not chunks:
+        raise ValueError("No valid segments to encode.")
+
+    workers = max(1, min(workers, len(chunks)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        chunk_files = [os.path.join(tmpdir, f"chunk_{idx}.mkv") for idx in range(len(chunks))]
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    _encode_chunk, idx,
+                    _chunk_cmd(video_path, pieces, threads, os.path.join(tmpdir, f"chunk_{idx}.txt"), chunk_files[idx]),
+                    sum(end - start for start, end in pieces),
+                    job_id, progress
+                )
+                for idx, pieces in enumerate(chunks)
+            ]
+            report = [future.result() for future in futures]
+        wall = time.time() - started
+
+        list_path = os.path.join(tmpdir, "chunks.txt")
+        with open(list_path, "w") as f:
+            for chunk_file in chunk_files:
+                f.write(f"file '{chunk_file}'\n")
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-c:v", "copy",
+            "-c:a", "aac",
+            output_path
+        ]
+        run_ffmpeg(cmd, job_id)
+
+    for item in report:
+        logging.info(f"Chunk {item['chunk']}: {item['duration']:.2f}s encoded in {item['seconds']:.2f}s ({item['speed']:.1f}x)")
+    kept = sum(item['duration'] for item in report)
+    logging.info(f"Parallel encode: {len(chunks)} chunks on {workers} workers, {kept:.2f}s encoded in {wall:.2f}s wall ({kept / wall if wall > 0 else 0:.1f}x)")
+
+    return report
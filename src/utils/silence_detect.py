@@ -0,0 +1,199 @@
+import math
+import tempfile
+import subprocess
+import numpy as np
+from typing import Iterator, List, Optional
+from src.models.invalid_model import InvalidModel
+from src.utils.constants import (
+    SILENCE_FRAME_MS, SILENCE_MIN_DURATION, SILENCE_PADDING, SILENCE_THRESHOLD_DB,
+)
+
+# the extracted audio track is mono 16 kHz already, decoding at that rate needs no resampling
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 10.0
+
+
+class SilenceDetector:
+    """
+    Streaming silence detector over int16 samples. Each chunk is cut into
+    frames whose energy is computed in one NumPy pass, runs of quiet frames
+    are carried over chunk boundaries. feed() and close() return the
+    long_pause invalids that ended so far.
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, threshold_db: float = SILENCE_THRESHOLD_DB,
+                 min_duration: float = SILENCE_MIN_DURATION, padding: float = SILENCE_PADDING,
+                 frame_ms: int = SILENCE_FRAME_MS):
+        self.frame = max(1, sample_rate * frame_ms // 1000)
+        self.frame_seconds = self.frame / sample_rate
+        # a frame is quiet when its sum of squares is below the threshold RMS, in int16 units
+        level = 10 ** (threshold_db / 20) * 32768
+        self.limit = level * level * self.frame
+        self.min_frames = max(1, math.ceil(min_duration / self.frame_seconds - 1e-9))
+        self.padding = padding
+        self.frames = 0
+        # first frame of the quiet run still open at the end of the last chunk
+        self.run_start: Optional[int] = None
+        self.rest = np.empty(0, dtype=np.int16)
+
+    def feed(self, samples: np.ndarray) -> List[InvalidModel]:
+        if self.rest.size:
+            samples = np.concatenate((self.rest, samples))
+        n = len(samples) // self.frame
+        self.rest = samples[n * self.frame:].copy()
+        if not n:
+            return []
+        frames = samples[:n * self.frame].reshape(n, self.frame).astype(np.float32)
+        energy = np.einsum("ij,ij->i", frames, frames)
+        return self._runs(energy < self.limit)
+
+    def close(self) -> List[InvalidModel]:
+        """End the open quiet run at the last full frame, the samples of a partial frame are ignored"""
+        self.rest = np.empty(0, dtype=np.int16)
+        if self.run_start is None:
+            return []
+        starts, ends = np.array([self.run_start]), np.array([self.frames])
+        self.run_start = None
+        return self._pauses(starts, ends)
+
+    def _runs(self, quiet: np.ndarray) -> List[InvalidModel]:
+        # +1 where a quiet run starts and -1 where it ends, relative to the state the last chunk left
+        edges = np.diff(quiet.astype(np.int8), prepend=np.int8(self.run_start is not None))
+        starts = np.flatnonzero(edges == 1) + self.frames
+        ends = np.flatnonzero(edges == -1) + self.frames
+        if self.run_start is not None:
+            starts = np.concatenate(([self.run_start], starts))
+        if len(starts) > len(ends):
+            self.run_start = int(starts[-1])
+            starts = starts[:-1]
+        else:
+            self.run_start = None
+        self.frames += len(quiet)
+        return self._pauses(starts, ends)
+
+    def _pauses(self, starts: np.ndarray, ends: np.ndarray) -> List[InvalidModel]:
+        keep = ends - starts >= self.min_frames
+        start = starts[keep] * self.frame_seconds + self.padding
+        end = ends[keep] * self.frame_seconds - self.padding
+        return [
+            InvalidModel(start_time=round(s, 3), end_time=round(e, 3), type="long_pause", is_entire=True)
+            for s, e in zip(start.tolist(), end.tolist()) if e > s
+        ]
+
+
+def iter_audio_samples(audio_path: str, sample_rate: int = SAMPLE_RATE,
+                       chunk_seconds: float = CHUNK_SECONDS) -> Iterator[np.ndarray]:
+    """Decode the first audio track once to mono int16 and yield it in chunks of chunk_seconds"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", audio_path,
+        "-map", "0:a:0",
+        "-vn", "-sn", "-dn",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "s16le", "pipe:1",
+    ]
+    chunk_bytes = 2 * max(1, int(sample_rate * chunk_seconds))
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = proc.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                # reads are whole chunks until the end of the stream, an odd byte only ends it
+                yield np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2")
+            returncode = proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+
+
+def detect_silences(audio_path: str, threshold_db: float = SILENCE_THRESHOLD_DB,
+                    min_duration: float = SILENCE_MIN_DURATION, padding: float = SILENCE_PADDING,
+                    frame_ms: int = SILENCE_FRAME_MS) -> List[InvalidModel]:
+    """Get the long pauses of the audio (or video) file as long_pause invalids, no LLM involved"""
+    detector = SilenceDetector(SAMPLE_RATE, threshold_db, min_duration, padding, frame_ms)
+    pauses = []
+    for samples in iter_audio_samples(audio_path):
+        pauses.extend(detector.feed(samples))
+    pauses.extend(detector.close())
+    return pauses
+
+
+# detection speed on synthetic speech-like audio with known pauses
+# usage: python -m src.utils.silence_detect [minutes]
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    import shutil
+
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    rng = np.random.default_rng(0)
+
+    # bursts of modulated noise at speech level between gaps of a faint noise floor
+    parts, pauses = [], []
+    t = 0
+    total = int(minutes * 60 * SAMPLE_RATE)
+    while t < total:
+        speech = int(rng.uniform(1.0, 8.0) * SAMPLE_RATE)
+        envelope = 0.5 + 0.5 * np.sin(np.arange(speech) * (2 * np.pi * 4 / SAMPLE_RATE)) ** 2
+        parts.append((rng.standard_normal(speech) * 6000 * envelope).astype(np.int16))
+        t += speech
+        gap = int(rng.uniform(0.2, 3.0) * SAMPLE_RATE)
+        parts.append((rng.standard_normal(gap) * 30).astype(np.int16))
+        pauses.append((t / SAMPLE_RATE, (t + gap) / SAMPLE_RATE))
+        t += gap
+    audio = np.concatenate(parts)
+    duration = len(audio) / SAMPLE_RATE
+    expected = [(s, e) for s, e in pauses if e - s >= SILENCE_MIN_DURATION + 2 * SILENCE_FRAME_MS / 1000]
+
+    chunk = int(CHUNK_SECONDS * SAMPLE_RATE)
+    start = time.perf_counter()
+    detector = SilenceDetector()
+    found = []
+    for i in range(0, len(audio), chunk):
+        found.extend(detector.feed(audio[i:i + chunk]))
+    found.extend(detector.close())
+    elapsed = time.perf_counter() - start
+    print(f"numpy: {duration / 60:.0f} min of audio in {elapsed * 1000:.0f} ms, "
+          f"{duration / elapsed:.0f}x realtime, {len(found)} pauses")
+    assert duration / elapsed > 200, "detection slower than 200x realtime"
+
+    # every pause long enough is found within a frame plus the padding, and every
+    # detected pause lies inside a gap
+    frame = SILENCE_FRAME_MS / 1000
+    gaps = np.array(pauses)
+    for pause in found:
+        i = int(np.searchsorted(gaps[:, 1], pause.end_time))
+        s, e = gaps[i]
+        assert abs(pause.start_time - SILENCE_PADDING - s) <= frame and abs(pause.end_time + SILENCE_PADDING - e) <= frame, \
+            f"pause {s:.2f}-{e:.2f} detected at {pause.start_time:.2f}-{pause.end_time:.2f}"
+    assert len(found) >= len(expected), f"missed pauses: {len(found)} of {len(expected)}"
+
+    # the same pauses whatever the chunk size
+    for size in (1, 317, 48_000):
+        detector = SilenceDetector()
+        chunked = [p for i in range(0, SAMPLE_RATE * 120, size) for p in detector.feed(audio[i:i + size])]
+        chunked += detector.close()
+        whole = SilenceDetector()
+        reference = whole.feed(audio[:SAMPLE_RATE * 120]) + whole.close()
+        assert chunked == reference, f"chunks of {size} samples change the pauses"
+    print("pauses match the synthetic gaps, independent of the chunk size")
+
+    # the whole path from an encoded audio track, ffmpeg decoding included
+    if shutil.which("ffmpeg"):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            audio_path = os.path.join(tmpdir, "audio.ogg")
+            subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1",
+                            "-i", "pipe:0", "-c:a", "libopus", "-b:a", "24k", "-application", "voip", audio_path],
+                           input=audio.tobytes(), check=True)
+            start = time.perf_counter()
+            decoded = detect_silences(audio_path)
+            elapsed = time.perf_counter() - start
+            print(f"ffmpeg + numpy: {duration / elapsed:.0f}x realtime from Opus, {len(decoded)} pauses")
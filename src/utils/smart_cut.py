@@ -0,0 +1,166 @@
+import os
+import bisect
+import logging
+import tempfile
+from typing import List, Optional
+from src.models.media_info_model import MediaInfoModel, StreamInfoModel
+from src.utils.cut_plan import write_filter_script
+from src.utils.ffmpeg_runner import ProgressReporter, run_ffmpeg
+
+# x264 profile names as reported by ffprobe
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
+
+# edge pieces shorter than this are folded into the copied GOPs
+MIN_EDGE_DURATION = 0.001
+
+
+class SmartCutUnavailable(Exception):
+    """Raised when the input can not be smart cut and a full re-encode is needed."""
+
+
+def plan_smart_cut(valid_segments: List[tuple], keyframes: List[float]) -> List[tuple]:
+    """
+    Split every valid segment into (start, end, action) parts where action is
+    "copy" for the whole GOPs inside the segment and "encode" for the partial
+    GOPs at the cut edges.
+    """
+    parts = []
+    for start, end in valid_segments:
+        # first keyframe inside the segment and last keyframe before its end
+        first = bisect.bisect_left(keyframes, start - MIN_EDGE_DURATION)
+        last = bisect.bisect_right(keyframes, end + MIN_EDGE_DURATION) - 1
+
+        if first >= len(keyframes) or last < 0 or keyframes[first] >= keyframes[last]:
+            # no complete GOP inside, the segment has to be re-encoded
+            parts.append((start, end, "encode"))
+            continue
+
+        copy_start, copy_end = keyframes[first], keyframes[last]
+        if copy_start - start > MIN_EDGE_DURATION:
+            parts.append((start, copy_start, "encode"))
+        parts.append((max(start, copy_start), min(end, copy_end), "copy"))
+        if end - copy_end > MIN_EDGE_DURATION:
+            parts.append((copy_end, end, "encode"))
+
+    return parts
+
+
+def _copy_cmd(video_path: str, start: float, frames: int, output_path: str) -> list:
+    # seek a hair past the keyframe so rounding never lands on the previous GOP,
+    # and cut by frame count which is exact for closed GOPs
+    return [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{start + MIN_EDGE_DURATION / 2:.6f}",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", str(frames),
+        "-c", "copy",
+        "-bsf:v", "h264_mp4toannexb",  # keeps the parameter sets in band
+        "-avoid_negative_ts", "make_zero",
+        "-f", "nut", output_path
+    ]
+
+
+def _encode_cmd(video_path: str, start: float, frames: int, info: StreamInfoModel, output_path: str) -> list:
+    cmd = [
+        "ffmpeg", "-nostdin", "-y",
+        "-ss", f"{start:.6f}",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", str(frames),
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", "18",            # edges should not stand out next to the copied GOPs
+        "-pix_fmt", info.pix_fmt,
+    ]
+    profile = X264_PROFILES.get(info.profile)
+    if profile:
+        cmd += ["-profile:v", profile]
+    # repeat the parameter sets in band, the concat demuxer only keeps the first file's
+    cmd += ["-bsf:v", "dump_extra=freq=keyframe", "-f", "nut", output_path]
+    return cmd
+
+
+def _audio_cmd(video_path: str, valid_segments: List[tuple], script_path: str, output_path: str) -> list:
+    # audio is cheap to decode so it is always cut sample accurately
+    filter_parts = []
+    concat_parts = []
+    for i, (start, end) in enumerate(valid_segments):
+        filter_parts.append(f"[0:a]atrim=start={start:.6f}:end={end:.6f},asetpts=PTS-STARTPTS[a{i}];")
+        concat_parts.append(f"[a{i}]")
+    filter_script = ''.join(filter_parts) + ''.join(concat_parts) + f"concat=n={len(valid_segments)}:v=0:a=1[outa]"
+    return [
+        "ffmpeg", "-nostdin", "-y",
+        "-i", video_path,
+        "-filter_complex_script", write_filter_script(filter_script, script_path),
+        "-map", "[outa]",
+        "-c:a", "aac",
+        output_path
+    ]
+
+
+def smart_cut(video_path: str, valid_segments: List[tuple], output_path: str, media: MediaInfoModel,
+              job_id: Optional[str] = None, progress: Optional[ProgressReporter] = None):
+    """
+    Cut the video by stream copying every GOP that lies fully inside a valid
+    segment and re-encoding only the partial GOPs at the cut edges. The pieces
+    are joined with the concat demuxer, audio is re-encoded in one cheap pass.
+    """
+    info = media.video_stream
+    if info is None or info.codec_name != "h264":
+        raise SmartCutUnavailable(f"Smart cut needs h264 input, got {info.codec_name if info else 'no video'}.")
+    if not media.keyframes:
+        raise SmartCutUnavailable("No keyframe index for the input.")
+
+    packets = media.video_packets
+    parts = plan_smart_cut(valid_segments, media.keyframes)
+
+    copied = sum(end - start for start, end, action in parts if action == "copy")
+    logging.info(f"Smart cut: {len(parts)} parts, {copied:.2f}s stream copied")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        part_files = []
+        for idx, (start, end, action) in enumerate(parts):
+            part_path = os.path.join(tmpdir, f"part_{idx}.nut")
+            first = bisect.bisect_left(packets, start - MIN_EDGE_DURATION)
+            last = bisect.bisect_left(packets, end - MIN_EDGE_DURATION)
+            frames = last - first
+            if frames <= 0:
+                continue
+            if action == "copy":
+                cmd = _copy_cmd(video_path, start, frames, part_path)
+            else:
+                cmd = _encode_cmd(video_path, start, frames, info, part_path)
+            run_ffmpeg(cmd, job_id, progress.tracker(idx) if progress else None)
+            # exact part length, the demuxer guess is off by the B-frame delay
+            duration = packets[last] - packets[first] if last < len(packets) else None
+            part_files.append((part_path, duration))
+
+        if not part_files:
+            raise SmartCutUnavailable("No video frames inside the valid segments.")
+
+        list_path = os.path.join(tmpdir, "parts.txt")
+        with open(list_path, "w") as f:
+            for part, duration in part_files:
+                f.write(f"file '{part}'\n")
+                if duration is not None:
+                    f.write(f"duration {duration:.6f}\n")
+
+        audio_path = os.path.join(tmpdir, "audio.m4a")
+        run_ffmpeg(_audio_cmd(video_path, valid_segments, os.path.join(tmpdir, "audio.txt"), audio_path), job_id)
+
+        cmd = [
+            "ffmpeg", "-nostdin", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-i", audio_path,
+            "-map", "0:v", "-map", "1:a",
+            "-c", "copy",
+            output_path
+        ]
+        run_ffmpeg(cmd, job_id)
@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import subprocess
+from typing import Optional
+from src.utils.constants import TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_MB
+from src.utils.disk_cache import evict_lru, write_atomic
+
+_lock = threading.Lock()
+
+
+def audio_hash(audio_path: str) -> str:
+    """
+    Hash the packets of the first audio stream. Unlike the file bytes this
+    ignores the container, which differs between two extractions of the same
+    recording (the Ogg stream serial is random).
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", audio_path,
+        "-map", "0:a:0", "-c", "copy",
+        "-f", "hash", "-hash", "sha256", "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0 or "=" not in result.stdout:
+        raise RuntimeError(f"Failed to hash audio: {result.stderr.strip()}")
+    return result.stdout.strip().partition("=")[2]
+
+
+def cache_key(content_hash: str, transcriber: str, options: dict) -> str:
+    """Key of a transcript: the audio content, the transcriber and every option that changes the output"""
+    payload = json.dumps({"audio": content_hash, "transcriber": transcriber, "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+
+def get_transcript(key: str, cache_dir: str = TRANSCRIPT_CACHE_DIR) -> Optional[str]:
+    """Get the cached transcript JSON, marking it as recently used"""
+    path = _cache_path(key, cache_dir)
+    try:
+        with open(path, "r") as f:
+            transcription = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return transcription
+
+
+def put_transcript(key: str, transcription: str, cache_dir: str = TRANSCRIPT_CACHE_DIR,
+                   max_mb: float = TRANSCRIPT_CACHE_MAX_MB):
+    """Store the transcript JSON and evict old entries when the cache grows over max_mb"""
+    size = write_atomic(_cache_path(key, cache_dir), transcription)
+    with _lock:
+        evict_lru(cache_dir, int(max_mb * 1024 * 1024), size)
+
+
+# check hits across re-extractions and the LRU eviction
+# usage: python -m src.utils.transcript_cache [video_path]
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+    from src.utils.audio_extract import extract_audio
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_dir = os.path.join(tmpdir, "transcripts")
+        if len(sys.argv) > 1:
+            # two extractions of the same recording give the same key
+            first = audio_hash(extract_audio(sys.argv[1], os.path.join(tmpdir, "a")))
+            second = audio_hash(extract_audio(sys.argv[1], os.path.join(tmpdir, "b")))
+            assert first == second, "re-extracted audio hashes differently"
+            print(f"audio hash {first[:16]} stable across extractions")
+
+        options = {"model": "nova-3", "smart_format": True}
+        key = cache_key("abc", "deepgram", options)
+        assert key != cache_key("abc", "deepgram", {**options, "model": "nova-2"})
+        assert get_transcript(key, cache_dir) is None
+
+        # 40 transcripts of ~100 KB in a 1 MB cache, the first one is kept in use
+        transcript = json.dumps({"results": {"padding": "x" * 100_000}})
+        keys = [cache_key(str(i), "deepgram", options) for i in range(40)]
+        for i, k in enumerate(keys):
+            put_transcript(k, transcript, cache_dir, max_mb=1)
+            time.sleep(0.01)
+            assert get_transcript(keys[0], cache_dir) == transcript, f"recently used entry evicted at {i}"
+
+        kept = [k for k in keys if get_transcript(k, cache_dir) is not None]
+        assert len(kept) < len(keys) and keys[0] in kept and keys[-1] in kept
+        print(f"{len(kept)} of {len(keys)} transcripts kept within 1 MB")
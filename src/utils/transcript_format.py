@@ -1,40 +1,124 @@
 from src.models.invalid_model import InvalidModel
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Set
+import bisect
+import itertools
 
-def format_deepgram_transcript_sent(transcript:dict):
+def iter_deepgram_transcript_sent(transcript:dict) -> Iterator[str]:
+    """Yield one "start end text" line per sentence"""
     paras = transcript['results']['channels'][0]['alternatives'][0]['paragraphs']['paragraphs']
 
-    res = ""
     for para in paras:
         for sent in para['sentences']:
-            res += "{start:.02f} {end:.02f} {text}\n".format(
+            yield "{start:.02f} {end:.02f} {text}\n".format(
                 start=sent['start'],
                 end=sent['end'],
                 text=sent['text']
             )
-    return res
 
-def format_deepgram_transcript_word(transcript:dict, invalids: List[InvalidModel]):
+def format_deepgram_transcript_sent(transcript:dict):
+    return "".join(iter_deepgram_transcript_sent(transcript))
+
+def _invalid_words(words: List[dict], invalids: List[InvalidModel]) -> Iterator[Iterable[int]]:
+    # each invalid takes the words before the first word ending after it (found by bisect on the
+    # running max of the ends) that start inside it, without scanning the words from the start
+    starts = [word['start'] for word in words]
+    max_ends = list(itertools.accumulate((word['end'] for word in words), max))
+    starts_sorted = all(a <= b for a, b in zip(starts, starts[1:]))
+
+    for inv in invalids:
+        stop = bisect.bisect_right(max_ends, inv.end_time)
+        if starts_sorted:
+            yield range(bisect.bisect_left(starts, inv.start_time, 0, stop), stop)
+        else:
+            yield [i for i in range(stop) if inv.start_time <= starts[i]]
+
+def iter_deepgram_transcript_word(transcript:dict, invalids: List[InvalidModel]) -> Iterator[str]:
+    """Yield one "start end word" line per word inside each invalid, with an empty line after every invalid"""
     words = transcript['results']['channels'][0]['alternatives'][0]['words']
     
     # new transcript with invalids word only where isEntire is false and  invalids startTime and endTime range
+    for selected in _invalid_words(words, invalids):
+        for i in selected:
+            yield "{start:.02f} {end:.02f} {text}\n".format(
+                start=words[i]['start'],
+                end=words[i]['end'],
+                text=words[i]['word']
+            )
+        yield "\n"
 
+def format_deepgram_transcript_word(transcript:dict, invalids: List[InvalidModel]):
+    return "".join(iter_deepgram_transcript_word(transcript, invalids))
 
-    res = ""
-    for inv in invalids:
-        # print("--+--"*10)
-        for word in words:
-            if inv.end_time < word['end']:
-                break
-            elif inv.start_time <= word['start'] and inv.end_time >= word['end']:
-                res += "{start:.02f} {end:.02f} {text}\n".format(
-                    start=word['start'],
-                    end=word['end'],
-                    text=word['word']
-                )
-        res += "\n"
-    return res
 
+def _sentences(transcript: dict) -> Iterator[dict]:
+    paras = transcript['results']['channels'][0]['alternatives'][0]['paragraphs']['paragraphs']
+    for para in paras:
+        yield from para['sentences']
+
+def _centiseconds(seconds: float) -> int:
+    return int(round(seconds * 100))
+
+def iter_compact_transcript_sent(transcript: dict) -> Iterator[str]:
+    """
+    Yield one "id pause duration text" line per sentence for the prompts: the
+    id is the sentence's index in the transcript, pause the silence since the
+    previous sentence and duration its length, both in integer centiseconds.
+    TranscriptLookup maps the ids of the answer back to absolute times.
+    """
+    previous_end = 0.0
+    for i, sent in enumerate(_sentences(transcript)):
+        yield f"{i} {max(0, _centiseconds(sent['start'] - previous_end))} {_centiseconds(sent['end'] - sent['start'])} {sent['text']}\n"
+        previous_end = sent['end']
+
+def iter_compact_transcript_word(transcript: dict, invalids: List[InvalidModel],
+                                 skip: Optional[Set[int]] = None) -> Iterator[str]:
+    """
+    Like iter_deepgram_transcript_word with "id word" lines, the id being the
+    word's index in the transcript. Word ids in skip (fillers already cut) are
+    left out, an invalid left without words is left out whole.
+    """
+    words = transcript['results']['channels'][0]['alternatives'][0]['words']
+    for selected in _invalid_words(words, invalids):
+        if skip:
+            selected = [i for i in selected if i not in skip]
+            if not selected:
+                continue
+        for i in selected:
+            yield f"{i} {words[i]['word']}\n"
+        yield "\n"
+
+def _at(table: List[tuple], index) -> tuple:
+    index = int(index)
+    if index < 0:
+        raise IndexError(index)
+    return table[index]
+
+class TranscriptLookup:
+    """Map the sentence and word ids of a compact prompt's answer back to the transcript's times"""
+
+    def __init__(self, transcript: dict):
+        self.sentences = [(sent['start'], sent['end']) for sent in _sentences(transcript)]
+        self.words = [(word['start'], word['end']) for word in transcript['results']['channels'][0]['alternatives'][0].get('words', [])]
+
+    def resolve(self, item: dict) -> dict:
+        """
+        Add start_time and end_time to an answer item holding "id" (a sentence)
+        or "start_id"/"end_id" (words). An item with unknown ids is returned
+        without times so the parser drops it.
+        """
+        if 'start_time' in item:
+            return item
+        try:
+            if 'id' in item:
+                start, end = _at(self.sentences, item['id'])
+            elif 'start_id' in item:
+                start = _at(self.words, item['start_id'])[0]
+                end = _at(self.words, item.get('end_id', item['start_id']))[1]
+            else:
+                return item
+        except (IndexError, TypeError, ValueError):
+            return item
+        return {**item, "start_time": start, "end_time": end}
 
 def dummy_word_transcript():
     return {
@@ -93,5 +177,142 @@ def dummy_word_transcript():
 # # sort invalids by start_time
 # invalids.sort(key=lambda x: x.start_time)
 
-# invalid_words = format_deepgram_transcript_word(transcript, invalids)
-# print(invalid_words)
\ No newline at end of file
+# invalid_words = "".join(iter_deepgram_transcript_word(transcript, invalids))
+# print(invalid_words)
+
+
+# compare with the nested loop it replaces on synthetic transcripts
+# usage: python -m src.utils.transcript_format
+if __name__ == "__main__":
+    import random
+    import time
+
+    def nested_loop_format(transcript, invalids):
+        words = transcript['results']['channels'][0]['alternatives'][0]['words']
+        res = ""
+        for inv in invalids:
+            for word in words:
+                if inv.end_time < word['end']:
+                    break
+                elif inv.start_time <= word['start'] and inv.end_time >= word['end']:
+                    res += "{start:.02f} {end:.02f} {text}\n".format(start=word['start'], end=word['end'], text=word['word'])
+            res += "\n"
+        return res
+
+    def synthetic_transcript(n_words, shuffle=False):
+        words = []
+        t = 0.0
+        for _ in range(n_words):
+            t += random.uniform(0.0, 0.3)
+            length = random.uniform(0.1, 0.6)
+            words.append({"word": "w", "start": round(t, 2), "end": round(t + length, 2)})
+            t += length
+        if shuffle:
+            random.shuffle(words)
+        return {"results": {"channels": [{"alternatives": [{"words": words}]}]}}, t
+
+    def synthetic_invalids(total, count):
+        invalids = []
+        for _ in range(count):
+            start = random.uniform(0, total)
+            invalids.append(InvalidModel(start_time=start, end_time=start + random.uniform(0.5, 20.0), is_entire=False))
+        invalids.sort(key=lambda x: x.start_time)
+        return invalids
+
+    random.seed(0)
+    # unsorted words and unsorted invalids take the exact same output as well
+    for shuffle in (False, True):
+        transcript, total = synthetic_transcript(500, shuffle)
+        invalids = synthetic_invalids(total, 50)
+        random.shuffle(invalids)
+        assert "".join(iter_deepgram_transcript_word(transcript, invalids)) == nested_loop_format(transcript, invalids)
+
+    for n_words in (1_000, 10_000, 100_000):
+        transcript, total = synthetic_transcript(n_words)
+        invalids = synthetic_invalids(total, max(10, n_words // 50))
+
+        start = time.perf_counter()
+        fast = "".join(iter_deepgram_transcript_word(transcript, invalids))
+        fast_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        slow = nested_loop_format(transcript, invalids)
+        slow_time = time.perf_counter() - start
+
+        assert fast == slow, f"output differs for {n_words} words"
+        print(f"{n_words:>7} words, {len(invalids):>5} invalids: bisect {fast_time * 1000:8.1f} ms, "
+              f"nested loop {slow_time * 1000:9.1f} ms ({slow_time / fast_time:.0f}x)")
+
+    # prompt building for a 100k word transcript: concatenated string vs lines joined into the prompt
+    import tracemalloc
+    from src.llm.prompt import generate_sent_analysis_prompt, generate_word_analysis_prompt
+
+    def concat_format_sent(transcript):
+        res = ""
+        for para in transcript['results']['channels'][0]['alternatives'][0]['paragraphs']['paragraphs']:
+            for sent in para['sentences']:
+                res += "{start:.02f} {end:.02f} {text}\n".format(start=sent['start'], end=sent['end'], text=sent['text'])
+        return res
+
+    def concat_format_word(transcript, invalids):
+        res = ""
+        for line in iter_deepgram_transcript_word(transcript, invalids):
+            res += line
+        return res
+
+    transcript, total = synthetic_transcript(100_000)
+    words = transcript['results']['channels'][0]['alternatives'][0]['words']
+    for word in words:
+        word['word'] = random.choice(["so", "basically", "the", "editor", "video", "cut"])
+    sentences = [
+        {"text": " ".join(w['word'] for w in words[i:i + 12]), "start": words[i]['start'], "end": words[i:i + 12][-1]['end']}
+        for i in range(0, len(words), 12)
+    ]
+    transcript['results']['channels'][0]['alternatives'][0]['paragraphs'] = {"paragraphs": [{"sentences": sentences}]}
+    invalids = [InvalidModel(start_time=0.0, end_time=total, is_entire=False)]
+
+    cases = [
+        ("sentence prompt", [
+            ("concat", lambda: generate_sent_analysis_prompt(concat_format_sent(transcript))),
+            ("join", lambda: generate_sent_analysis_prompt(format_deepgram_transcript_sent(transcript))),
+            ("generator", lambda: generate_sent_analysis_prompt(iter_deepgram_transcript_sent(transcript))),
+        ]),
+        ("word prompt", [
+            ("concat", lambda: generate_word_analysis_prompt(concat_format_word(transcript, invalids))),
+            ("join", lambda: generate_word_analysis_prompt(format_deepgram_transcript_word(transcript, invalids))),
+            ("generator", lambda: generate_word_analysis_prompt(iter_deepgram_transcript_word(transcript, invalids))),
+        ]),
+    ]
+    for name, builds in cases:
+        results = []
+        for label, build in builds:
+            tracemalloc.start()
+            start = time.perf_counter()
+            prompt = build()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(prompt)
+            print(f"{name:>15} {label:>9}: {elapsed * 1000:7.1f} ms, peak {peak / 1024 ** 2:6.2f} MB for {len(prompt) / 1024 ** 2:.2f} MB of prompt")
+        assert all(prompt == results[0] for prompt in results), f"{name} differs"
+
+    # compact lines: fewer prompt tokens and ids that map back to the exact times
+    from src.llm.prompt import count_tokens
+    model = "gemini/gemini-1.5-flash"
+    sample = {"results": {"channels": [{"alternatives": [{"words": words[:6000], "paragraphs": {"paragraphs": [{"sentences": sentences[:500]}]}}]}]}}
+    partial = [InvalidModel(start_time=s['start'], end_time=s['end'], is_entire=False) for s in sentences[:500:5]]
+    for name, plain, compact in (
+        ("sentences", format_deepgram_transcript_sent(sample), "".join(iter_compact_transcript_sent(sample))),
+        ("words", format_deepgram_transcript_word(sample, partial), "".join(iter_compact_transcript_word(sample, partial))),
+    ):
+        plain_tokens, compact_tokens = count_tokens(plain, model), count_tokens(compact, model)
+        print(f"{name:>9}: {plain_tokens} tokens plain, {compact_tokens} compact ({1 - compact_tokens / plain_tokens:.0%} fewer)")
+
+    lookup = TranscriptLookup(sample)
+    for i in (0, 17, 499):
+        item = lookup.resolve({"id": i, "type": "repetition"})
+        assert (item['start_time'], item['end_time']) == (sentences[i]['start'], sentences[i]['end'])
+    item = lookup.resolve({"start_id": 40, "end_id": 43})
+    assert (item['start_time'], item['end_time']) == (words[40]['start'], words[43]['end'])
+    assert 'start_time' not in lookup.resolve({"id": 500}) and 'start_time' not in lookup.resolve({"id": -1})
+    print("compact ids map back to the exact times")
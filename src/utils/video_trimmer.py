@@ -2,105 +2,156 @@ import os
 import json
 import subprocess
 import logging
-from typing import List
+from typing import Callable, List, Optional
 from src.models.invalid_model import InvalidModel
+from src.utils.constants import TEMP_DIR, TRIM_MODE
+from src.utils.ffmpeg_runner import FFmpegCancelled, ProgressReporter, clear_cancelled, run_ffmpeg
+from src.utils.batch_trim import hierarchical_trim
+from src.utils.cut_plan import build_filter_script, filter_script_file, plan_cut
+from src.utils.intervals import keep_segments
+from src.utils.media_probe import probe_media
+from src.utils.parallel_trim import parallel_trim
+from src.utils.smart_cut import SmartCutUnavailable, smart_cut
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 VIDEO_PATH = "/Users/suraj/vscode/aiml/genai/ai_video_editor/artifacts/samples/11-vs-bonus.mp4"
 
 def get_video_duration(video_path: str) -> float:
-    """Get video duration using ffprobe - optimized for speed"""
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "v:0",  # Only analyze video stream
-        "-show_entries", "format=duration",
-        "-of", "json",
-        video_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    
-    try:
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except (KeyError, json.JSONDecodeError, ValueError):
-        raise RuntimeError("Failed to retrieve video duration using ffprobe.")
+    """Get video duration from the cached ffprobe result"""
+    return probe_media(video_path).duration
+
+def get_valid_segments(invalid_timestamps: List[InvalidModel], duration: float) -> List[tuple]:
+    """
+    Get the (start, end) segments to keep: the padded invalids are merged
+    whatever their order, overlap or nesting, and slivers shorter than
+    MIN_KEEP_SEGMENT between them are cut too
+    """
+    return keep_segments(invalid_timestamps, duration)
+
+def _remove_partial(output_path: str):
+    if os.path.exists(output_path):
+        os.remove(output_path)
 
-def trim_video(video_path: str, invalid_timestamps: List[InvalidModel], output_path: str):
+def trim_video(video_path: str, invalid_timestamps: List[InvalidModel], output_path: str, mode: str = TRIM_MODE,
+               job_id: Optional[str] = None, on_progress: Optional[Callable[[dict], None]] = None):
     """
-    Trim the video based on the invalid timestamps using a single ffmpeg command
-    with complex filtergraph, avoiding any temporary file creation.
+    Trim the video based on the invalid timestamps. With mode "smart" (the
+    default) only the partial GOPs at the cut edges are re-encoded and the
+    pieces are joined; when the input can not be smart cut the chunked
+    "parallel" encode runs instead. When that fails too, or for any other mode,
+    the cut is planned: one ffmpeg filtergraph (trim branches or a select
+    expression, read from a script file), or for huge edit lists batches
+    encoded separately and joined. Every path works through temporary files,
+    removed when done.
+    Progress is reported through on_progress and the job can be stopped with
+    ffmpeg_runner.cancel_job(job_id), which raises FFmpegCancelled.
     """
+    if job_id is not None:
+        clear_cancelled(job_id)
     try:
         # Sort and validate timestamps
         invalid_timestamps.sort(key=lambda x: x.start_time)
-        duration = get_video_duration(video_path)
-
-        # Identify valid segments
-        valid_segments = []
-        if not invalid_timestamps:
-            valid_segments.append((0, duration))
-        else:
-            if invalid_timestamps[0].start_time > 0:
-                valid_segments.append((0, invalid_timestamps[0].start_time))
-
-            for i in range(len(invalid_timestamps) - 1):
-                current_end = invalid_timestamps[i].end_time
-                next_start = invalid_timestamps[i + 1].start_time
-                if next_start > current_end:
-                    valid_segments.append((current_end, next_start))
+        # probed once per input and cached in the job directory
+        cache_dir = os.path.join(TEMP_DIR, job_id) if job_id is not None else None
+        media = probe_media(video_path, cache_dir, with_packets=(mode == "smart"))
+        duration = media.duration
 
-            if invalid_timestamps[-1].end_time < duration:
-                valid_segments.append((invalid_timestamps[-1].end_time, duration))
+        valid_segments = get_valid_segments(invalid_timestamps, duration)
 
         if not valid_segments:
             logging.warning("No valid segments found after trimming.")
             return
 
-        # Build a single-pass complex filter
-        filter_parts = []
-        concat_parts = []
-
-        for i, (start, end) in enumerate(valid_segments):
-            filter_parts.append(
-                f"[0:v]trim=start={start:.6f}:end={end:.6f},setpts=PTS-STARTPTS[v{i}];"
-                f"[0:a]atrim=start={start:.6f}:end={end:.6f},asetpts=PTS-STARTPTS[a{i}];"
-            )
-            concat_parts.append(f"[v{i}][a{i}]")
-
-        filter_script = ''.join(filter_parts) + ''.join(concat_parts) + f"concat=n={len(valid_segments)}:v=1:a=1[outv][outa]"
-
-        # Direct single-command execution
-        cmd = [
-            "ffmpeg", "-nostdin", "-y",
-            "-i", video_path,
-            "-filter_complex", filter_script,
-            "-map", "[outv]", "-map", "[outa]",
-            "-c:v", "libx264", "-c:a", "aac", 
-            "-preset", "ultrafast",  # Fastest encoding preset
-            "-crf", "23",            # Balance quality vs speed
-            "-threads", "0",         # Use all available CPU threads
-            output_path
-        ]
-        
-        # For smaller segments or simple edits, avoid re-encoding if possible
-        if len(valid_segments) == 1 or sum((end - start) for start, end in valid_segments) < 0.9 * duration:
-            # Try to use segment extraction without re-encoding
-            if len(valid_segments) == 1:
-                start, end = valid_segments[0]
-                cmd = [
-                    "ffmpeg", "-nostdin", "-y",
-                    "-i", video_path,
-                    "-ss", f"{start:.6f}",
-                    "-to", f"{end:.6f}",
-                    "-c", "copy",  # Copy without re-encoding
-                    output_path
-                ]
-        
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        progress = None
+        if on_progress is not None:
+            progress = ProgressReporter(sum(end - start for start, end in valid_segments), on_progress)
+
+        if mode == "smart":
+            try:
+                smart_cut(video_path, valid_segments, output_path, media, job_id, progress)
+                if progress:
+                    progress.finish()
+                logging.info(f"Trimmed video saved to {output_path} (smart cut)")
+                return
+            except SmartCutUnavailable as e:
+                logging.warning(f"Smart cut not possible, re-encoding instead: {e}")
+            except subprocess.CalledProcessError as e:
+                logging.warning(f"Smart cut failed, re-encoding instead: {e.stderr.decode() if e.stderr else e}")
+            mode = "parallel"
+            if progress:
+                progress.reset()
+
+        if mode == "parallel":
+            try:
+                parallel_trim(video_path, valid_segments, output_path, job_id=job_id, progress=progress)
+                if progress:
+                    progress.finish()
+                logging.info(f"Trimmed video saved to {output_path} (parallel encode)")
+                return
+            except subprocess.CalledProcessError as e:
+                logging.warning(f"Parallel encode failed, using a single filtergraph: {e.stderr.decode() if e.stderr else e}")
+                if progress:
+                    progress.reset()
+
+        # cuts too short to notice in a re-encode are dropped and the graph strategy chosen
+        plan = plan_cut(valid_segments, duration, media)
+        valid_segments = plan.segments
+        logging.info(f"Cut plan: {plan.strategy}, {len(plan.segments)} segments ({plan.dropped_cuts} short cuts dropped), "
+                     f"{plan.nodes} filter nodes, predicted encode {plan.predicted_seconds:.1f}s CPU")
+        if cache_dir is not None:
+            with open(os.path.join(cache_dir, "cut_plan.json"), "w") as f:
+                json.dump(plan.to_dict(), f)
+
+        # Huge edit lists are cut in batches, no single graph holds every segment
+        if plan.strategy == "hierarchical":
+            hierarchical_trim(video_path, valid_segments, output_path, fps=plan.fps, job_id=job_id,
+                              progress=progress)
+            if progress:
+                progress.finish()
+            logging.info(f"Trimmed video saved to {output_path} (hierarchical encode)")
+            return
+
+        # Build a single-pass complex filter, trim branches or one select expression,
+        # read from a script file so the command line stays short for any segment count
+        with filter_script_file(build_filter_script(plan)) as script_path:
+            # Direct single-command execution
+            cmd = [
+                "ffmpeg", "-nostdin", "-y",
+                "-i", video_path,
+                "-filter_complex_script", script_path,
+                "-map", "[outv]", "-map", "[outa]",
+                "-c:v", "libx264", "-c:a", "aac", 
+                "-preset", "ultrafast",  # Fastest encoding preset
+                "-crf", "23",            # Balance quality vs speed
+                "-threads", "0",         # Use all available CPU threads
+                output_path
+            ]
+
+            # For smaller segments or simple edits, avoid re-encoding if possible
+            if len(valid_segments) == 1 or sum((end - start) for start, end in valid_segments) < 0.9 * duration:
+                # Try to use segment extraction without re-encoding
+                if len(valid_segments) == 1:
+                    start, end = valid_segments[0]
+                    cmd = [
+                        "ffmpeg", "-nostdin", "-y",
+                        "-i", video_path,
+                        "-ss", f"{start:.6f}",
+                        "-to", f"{end:.6f}",
+                        "-c", "copy",  # Copy without re-encoding
+                        output_path
+                    ]
+
+            run_ffmpeg(cmd, job_id, progress.tracker("filtergraph") if progress else None)
+        if progress:
+            progress.finish()
         logging.info(f"Trimmed video saved to {output_path}")
 
+    except FFmpegCancelled:
+        logging.warning(f"Trimming cancelled, removing {output_path}")
+        _remove_partial(output_path)
+        raise
+
     except subprocess.CalledProcessError as e:
         logging.error(f"Error during video trimming: {e}")
         logging.error(f"ffmpeg stderr: {e.stderr.decode() if hasattr(e, 'stderr') else 'unknown'}")
@@ -118,40 +169,51 @@ def trim_video(video_path: str, invalid_timestamps: List[InvalidModel], output_p
                     "-c", "copy",
                     output_path
                 ]
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                run_ffmpeg(cmd, job_id)
                 logging.info(f"Trimmed video saved to {output_path} (fallback simple method)")
             else:
-                # For complex cases, try with simpler encoding parameters
-                filter_script = ''.join(filter_parts) + ''.join(concat_parts) + f"concat=n={len(valid_segments)}:v=1:a=1[outv][outa]"
-                cmd = [
-                    "ffmpeg", "-nostdin", "-y",
-                    "-i", video_path,
-                    "-filter_complex", filter_script,
-                    "-map", "[outv]", "-map", "[outa]",
-                    "-c:v", "libx264", "-preset", "veryfast",
-                    "-c:a", "aac",
-                    output_path
-                ]
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                # For complex cases, try with simpler encoding parameters, a failed batch encode with one select graph
+                if plan.strategy == "hierarchical":
+                    plan = plan.model_copy(update={"strategy": "select"})
+                with filter_script_file(build_filter_script(plan)) as script_path:
+                    cmd = [
+                        "ffmpeg", "-nostdin", "-y",
+                        "-i", video_path,
+                        "-filter_complex_script", script_path,
+                        "-map", "[outv]", "-map", "[outa]",
+                        "-c:v", "libx264", "-preset", "veryfast",
+                        "-c:a", "aac",
+                        output_path
+                    ]
+                    run_ffmpeg(cmd, job_id)
                 logging.info(f"Trimmed video saved to {output_path} (fallback encoding method)")
+        except FFmpegCancelled:
+            logging.warning(f"Trimming cancelled, removing {output_path}")
+            _remove_partial(output_path)
+            raise
         except Exception as fallback_error:
             logging.error(f"Fallback also failed: {fallback_error}")
 
 
 
 if __name__ == "__main__":
+    import sys
+    import time
+
+    # benchmark the smart cut and the chunked encode against the filtergraph re-encode
+    # usage: python -m src.utils.video_trimmer [video_path]
+    video_path = sys.argv[1] if len(sys.argv) > 1 else VIDEO_PATH
     invalid_timestamps = [
         {'start_time': 0.48, 'end_time': 7.12},
         {'start_time': 10.72, 'end_time': 15.60},
         {'start_time': 16.66, 'end_time': 24.27}
     ]
-    invalids = [InvalidModel.from_dict(item) for item in invalid_timestamps]
-    import time
 
-    start = time.time()
-    output_path = os.path.splitext(VIDEO_PATH)[0] + "_trimmed.mp4"
-    
-    trim_video(VIDEO_PATH, invalids, output_path)
-    
-    end = time.time()
-    print(f"Time taken: {end - start:.2f} seconds")
\ No newline at end of file
+    for mode in ("filtergraph", "parallel", "smart"):
+        invalids = [InvalidModel.from_dict(dict(item)) for item in invalid_timestamps]
+        output_path = os.path.splitext(video_path)[0] + f"_trimmed_{mode}.mp4"
+
+        start = time.time()
+        trim_video(video_path, invalids, output_path, mode=mode)
+        end = time.time()
+        print(f"{mode}: {end - start:.2f} seconds")
@@ -0,0 +1,219 @@
+import os
+import json
+import threading
+import numpy as np
+from typing import List, Optional
+
+TRANSCRIPT_FILE = "transcript.json"
+WORD_INDEX_DIR = "word_index"
+VOCAB_FILE = "vocab.json"
+
+# one .npy per column so every column maps straight from disk
+COLUMNS = {
+    "start": np.float64,
+    "end": np.float64,
+    # running max of "end", bisected to find the last word ending before a time
+    "max_end": np.float64,
+    "confidence": np.float32,
+    "word_id": np.int32,
+    "punctuated_id": np.int32,
+}
+
+# loaded indexes by job directory, with the transcript mtime they were built from
+_memo: dict[str, tuple] = {}
+_lock = threading.Lock()
+
+
+class WordIndex:
+    """
+    Columnar view of the transcript words: start, end and confidence arrays
+    plus ids into an interned word table. Time range lookups are searchsorted
+    calls instead of walks over the Deepgram word dicts.
+    """
+
+    def __init__(self, columns: dict, vocab: List[str]):
+        self.start = columns['start']
+        self.end = columns['end']
+        self.max_end = columns['max_end']
+        self.confidence = columns['confidence']
+        self.word_id = columns['word_id']
+        self.punctuated_id = columns['punctuated_id']
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_transcript(cls, transcript: dict) -> "WordIndex":
+        words = transcript['results']['channels'][0]['alternatives'][0]['words']
+        words = sorted(words, key=lambda word: word['start'])
+
+        vocab = []
+        ids = {}
+
+        def intern(text: str) -> int:
+            if text not in ids:
+                ids[text] = len(vocab)
+                vocab.append(text)
+            return ids[text]
+
+        n = len(words)
+        end = np.fromiter((word['end'] for word in words), dtype=np.float64, count=n)
+        columns = {
+            "start": np.fromiter((word['start'] for word in words), dtype=np.float64, count=n),
+            "end": end,
+            "max_end": np.maximum.accumulate(end) if n else end,
+            "confidence": np.fromiter((word.get('confidence', 0.0) for word in words), dtype=np.float32, count=n),
+            "word_id": np.fromiter((intern(word['word']) for word in words), dtype=np.int32, count=n),
+            "punctuated_id": np.fromiter((intern(word.get('punctuated_word', word['word'])) for word in words), dtype=np.int32, count=n),
+        }
+        return cls(columns, vocab)
+
+    def save(self, index_dir: str):
+        """Write every column and the word table, renaming into place so readers never see a partial index"""
+        tmp_dir = index_dir.rstrip("/") + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp_dir, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, VOCAB_FILE), "w") as f:
+            json.dump(self.vocab, f)
+
+        if os.path.isdir(index_dir):
+            for name in os.listdir(index_dir):
+                os.remove(os.path.join(index_dir, name))
+            os.rmdir(index_dir)
+        os.replace(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "WordIndex":
+        columns = {name: np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r") for name in COLUMNS}
+        with open(os.path.join(index_dir, VOCAB_FILE), "r") as f:
+            vocab = json.load(f)
+        return cls(columns, vocab)
+
+    def range(self, start_time: Optional[float] = None, end_time: Optional[float] = None) -> tuple:
+        """
+        Get the (lo, hi) slice of the words inside [start_time, end_time],
+        the same words iter_deepgram_transcript_word picks for an invalid.
+        """
+        lo = int(np.searchsorted(self.start, start_time, side="left")) if start_time is not None else 0
+        hi = int(np.searchsorted(self.max_end, end_time, side="right")) if end_time is not None else len(self)
+        return lo, max(lo, hi)
+
+    def words(self, lo: int = 0, hi: Optional[int] = None) -> List[dict]:
+        """Get the words of a slice in the Deepgram word shape"""
+        hi = len(self) if hi is None else hi
+        return [
+            {
+                "word": self.vocab[word_id],
+                "start": start,
+                "end": end,
+                "confidence": confidence,
+                "punctuated_word": self.vocab[punctuated_id],
+            }
+            for start, end, confidence, word_id, punctuated_id in zip(
+                self.start[lo:hi].tolist(), self.end[lo:hi].tolist(),
+                np.round(self.confidence[lo:hi].astype(np.float64), 4).tolist(),
+                self.word_id[lo:hi].tolist(), self.punctuated_id[lo:hi].tolist(),
+            )
+        ]
+
+    def words_in_range(self, start_time: Optional[float] = None, end_time: Optional[float] = None) -> List[dict]:
+        return self.words(*self.range(start_time, end_time))
+
+
+def build_word_index(transcript: dict, job_dir: str) -> WordIndex:
+    """Build the index of the job transcript and save it next to transcript.json"""
+    index = WordIndex.from_transcript(transcript)
+    index.save(os.path.join(job_dir, WORD_INDEX_DIR))
+    return index
+
+
+def load_word_index(job_dir: str) -> WordIndex:
+    """
+    Get the memory mapped index of the job transcript, built from
+    transcript.json first when it is missing or older than the transcript.
+    """
+    transcript_path = os.path.join(job_dir, TRANSCRIPT_FILE)
+    index_dir = os.path.join(job_dir, WORD_INDEX_DIR)
+    mtime = os.path.getmtime(transcript_path)
+
+    with _lock:
+        cached = _memo.get(job_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    vocab_path = os.path.join(index_dir, VOCAB_FILE)
+    if os.path.exists(vocab_path) and os.path.getmtime(vocab_path) >= mtime:
+        index = WordIndex.load(index_dir)
+    else:
+        with open(transcript_path, "r") as f:
+            build_word_index(json.load(f), job_dir)
+        index = WordIndex.load(index_dir)
+
+    with _lock:
+        _memo[job_dir] = (mtime, index)
+    return index
+
+
+# time building, loading and range queries on a synthetic multi-hour transcript
+# usage: python -m src.utils.word_index [n_words]
+if __name__ == "__main__":
+    import sys
+    import time
+    import random
+    import tempfile
+    from src.models.invalid_model import InvalidModel
+    from src.utils.transcript_format import iter_deepgram_transcript_word
+
+    n_words = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    random.seed(0)
+    words = []
+    t = 0.0
+    for _ in range(n_words):
+        t += random.uniform(0.0, 0.3)
+        length = random.uniform(0.1, 0.6)
+        text = random.choice(["so", "um", "the", "video", "editor", "like", "okay"])
+        words.append({"word": text, "start": round(t, 3), "end": round(t + length, 3), "confidence": 0.9, "punctuated_word": text + "."})
+        t += length
+    transcript = {"results": {"channels": [{"alternatives": [{"words": words}]}]}}
+
+    with tempfile.TemporaryDirectory() as job_dir:
+        with open(os.path.join(job_dir, TRANSCRIPT_FILE), "w") as f:
+            json.dump(transcript, f)
+
+        start = time.perf_counter()
+        build_word_index(transcript, job_dir)
+        print(f"build: {(time.perf_counter() - start) * 1000:.1f} ms for {n_words} words ({t / 3600:.1f} h)")
+
+        start = time.perf_counter()
+        index = load_word_index(job_dir)
+        print(f"load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        start = time.perf_counter()
+        with open(os.path.join(job_dir, TRANSCRIPT_FILE), "r") as f:
+            json.load(f)
+        print(f"json load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        queries = [(q, q + 30.0) for q in (random.uniform(0, t) for _ in range(1000))]
+        start = time.perf_counter()
+        results = [index.words_in_range(t0, t1) for t0, t1 in queries]
+        print(f"range query: {(time.perf_counter() - start) * 1000 / len(queries):.3f} ms per 30 s window")
+
+        start = time.perf_counter()
+        scans = [[w for w in words if t0 <= w['start'] and w['end'] <= t1] for t0, t1 in queries[:20]]
+        print(f"list scan: {(time.perf_counter() - start) * 1000 / 20:.3f} ms per 30 s window")
+
+        for result, scan in zip(results, scans):
+            assert [(w['start'], w['end'], w['word']) for w in result] == [(w['start'], w['end'], w['word']) for w in scan]
+
+        # same words as the invalid lookup in the word formatter
+        invalids = [InvalidModel(start_time=t0, end_time=t1, is_entire=False) for t0, t1 in sorted(queries[:50])]
+        expected = "".join(iter_deepgram_transcript_word(transcript, invalids))
+        got = "".join(
+            "".join("{start:.02f} {end:.02f} {text}\n".format(start=w['start'], end=w['end'], text=w['word'])
+                    for w in index.words_in_range(inv.start_time, inv.end_time)) + "\n"
+            for inv in invalids
+        )
+        assert got == expected, "index lookup differs from iter_deepgram_transcript_word"
+        print("range queries match the list scan and the word formatter")